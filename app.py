@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
 import pandas as pd
 import json
@@ -8,6 +8,9 @@ import sys
 import uuid
 from datetime import datetime, timedelta
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(
@@ -21,21 +24,90 @@ logger = logging.getLogger(__name__)
 
 # Import project modules
 from src.plex_connector import connect_to_plex, extract_plex_movies, get_available_clients, play_movie_by_key
-from src.embedding import generate_embeddings
+from src.embedding import generate_embeddings, configure_query_cache, get_query_cache_stats
 from src.vector_db import setup_vector_db
 from src.llm_service import LLMService
-from src.recommendation import get_movie_recommendations, extract_movie_to_play
+from src.recommendation import (
+    get_movie_recommendations, get_batch_recommendations, extract_movie_to_play, format_movie,
+    speculative_search, get_speculation_stats, query_similarity
+)
+from src.http_client import configure_http_clients, get_connection_stats
+from src.snapshot import save_snapshot, load_snapshot
+from src.sync import sync_library, compute_watermark, load_sync_state, save_sync_state, SyncScheduler
+from src.jobs import BackgroundJob
+from src.catalog import MovieCatalog
+from src.filters import parse_filters, extract_filters, merge_filters
+from src.neighbors import NeighborGraph, update_neighbor_graph
+from src.intent import match_play_command, get_intent_stats
+from src.semantic_cache import SemanticResultCache
 import config
 
 app = Flask(__name__)
 
+# One keep-alive connection pool shared by every API client in the process
+configure_http_clients(
+    max_connections=config.HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    timeout=config.HTTP_TIMEOUT,
+    connect_timeout=config.HTTP_CONNECT_TIMEOUT
+)
+
+# Repeat queries skip the embedding round-trip
+configure_query_cache(
+    maxsize=config.QUERY_CACHE_SIZE,
+    disk_path=config.QUERY_CACHE_FILE or None,
+    disk_max_entries=config.QUERY_CACHE_DISK_MAX_ENTRIES
+)
+
 # Global variables to store our connections and data
 plex = None
-movies_df = None
-collection = None
+catalog = None
+vector_index = None
 llm_service = None
 sessions = {}
 
+# Results of recent queries, reused for paraphrases of them; cleared whenever the catalog changes
+result_cache = SemanticResultCache(maxsize=config.SEMANTIC_CACHE_SIZE, threshold=config.SEMANTIC_CACHE_THRESHOLD)
+
+# Runs the speculative search on the raw message while the LLM interprets it
+search_executor = ThreadPoolExecutor(max_workers=config.SPECULATIVE_SEARCH_WORKERS, thread_name_prefix="speculative-search")
+
+# Precomputed "more like this" neighbors, kept in step with the catalog by the pipeline
+neighbor_graph = None
+
+# Serializes full initializations and delta syncs; recommendations never wait on it
+pipeline_lock = threading.Lock()
+sync_scheduler = None
+
+# The most recent background initialization, reported by /api/initialize/status
+init_job = None
+init_job_lock = threading.Lock()
+
+# time.monotonic() of the last snapshot, which save_current_snapshot throttles
+last_snapshot_at = float('-inf')
+
+# Set once this process has tried to warm-start from the snapshot
+warm_started = False
+warm_start_lock = threading.Lock()
+
+# Guards only the swap of catalog and vector_index, so a request never sees
+# the catalog of one build paired with the index of another
+catalog_lock = threading.Lock()
+
+def publish_catalog(new_catalog, new_vector_index):
+    """Atomically replace the catalog and index being served"""
+    global catalog, vector_index
+    with catalog_lock:
+        catalog, vector_index = new_catalog, new_vector_index
+    if new_vector_index is not None:
+        new_vector_index.activate()
+
+def current_catalog():
+    """The catalog and index being served, read as one pair"""
+    with catalog_lock:
+        return catalog, vector_index
+
 # Function to clean up old sessions
 def cleanup_old_sessions():
     """Remove sessions older than 30 minutes"""
@@ -52,208 +124,822 @@ def index():
     """Render the main page"""
     return render_template('index.html')
 
-@app.route('/api/initialize', methods=['POST'])
-def initialize():
-    """Initialize the recommendation system"""
-    global plex, movies_df, collection, llm_service
+def create_llm_service():
+    """Create the LLM service from the configured provider"""
+    logger.info(f"Initializing LLM service with provider: {config.LLM_PROVIDER}")
+    service = LLMService(
+        provider=config.LLM_PROVIDER,
+        anthropic_api_key=config.ANTHROPIC_API_KEY,
+        openai_api_key=config.OPENAI_API_KEY,
+        anthropic_model=config.ANTHROPIC_MODEL,
+        openai_model=config.OPENAI_MODEL,
+        response_cache_size=config.RESPONSE_CACHE_SIZE,
+        response_cache_ttl=config.RESPONSE_CACHE_TTL_SECONDS
+    )
+    logger.info("LLM service initialized")
+    return service
+
+def connect_plex_from_config():
+    """Connect to Plex with whichever credentials are configured"""
+    logger.info("Connecting to Plex server")
+    if config.PLEX_URL and config.PLEX_TOKEN:
+        logger.info(f"Using direct connection to Plex server at {config.PLEX_URL}")
+        return connect_to_plex(baseurl=config.PLEX_URL, token=config.PLEX_TOKEN)
+    elif config.PLEX_USERNAME and config.PLEX_PASSWORD and config.PLEX_SERVERNAME:
+        logger.info(f"Connecting to Plex server {config.PLEX_SERVERNAME} via MyPlex account")
+        return connect_to_plex(
+            username=config.PLEX_USERNAME,
+            password=config.PLEX_PASSWORD,
+            servername=config.PLEX_SERVERNAME
+        )
+    raise ValueError("No valid Plex credentials provided")
+
+def embedding_options():
+    """Batching, concurrency and rate-limit settings for the embedding pipeline"""
+    return {
+        'batch_size': config.BATCH_SIZE,
+        'max_workers': config.EMBEDDING_CONCURRENCY,
+        'max_retries': config.EMBEDDING_MAX_RETRIES,
+        'requests_per_minute': config.EMBEDDING_REQUESTS_PER_MINUTE,
+        'tokens_per_minute': config.EMBEDDING_TOKENS_PER_MINUTE,
+        'max_request_tokens': config.EMBEDDING_MAX_REQUEST_TOKENS,
+        'max_input_tokens': config.EMBEDDING_MAX_INPUT_TOKENS,
+    }
+
+def run_initialization(job=None):
+    """Extract the Plex library, sync embeddings and the vector index, then snapshot them
+
+    The previous catalog keeps serving until the new one is published at the
+    end. When run as a ``BackgroundJob``, each step is reported as a phase.
+    """
+    with pipeline_lock:
+        return _run_initialization(job)
+
+def _run_initialization(job):
+    global plex, llm_service
+    
+    def phase(name):
+        return job.phase(name) if job is not None else None
+    
+    logger.info("Starting initialization process")
+    
+    # Connect to Plex
+    phase('connecting')
+    plex = connect_plex_from_config()
+    
+    # Extract movie data
+    logger.info(f"Extracting movie data from library: {config.MOVIE_LIBRARY_NAME}")
+    extracted_df = extract_plex_movies(
+        plex,
+        config.MOVIE_LIBRARY_NAME,
+        page_size=config.PLEX_PAGE_SIZE,
+        max_workers=config.PLEX_FETCH_WORKERS,
+        progress=phase('extracting')
+    )
+    logger.info(f"Extracted {len(extracted_df)} movies from Plex library")
+    
+    # Generate embeddings with caching
+    cache_file = config.EMBEDDINGS_CACHE_FILE
+    logger.info("Generating embeddings for movies (with caching)")
+    embedded_df, embedding_stats = generate_embeddings(
+        extracted_df, 
+        config.OPENAI_API_KEY,
+        model=config.EMBEDDING_MODEL,
+        cache_file=cache_file, 
+        use_cache=True,
+        return_stats=True,
+        progress=phase('embedding'),
+        **embedding_options()
+    )
+    logger.info(f"Generated embeddings for {len(embedded_df)} movies")
+    
+    # Pack the rows into the compact columnar catalog that is served
+    new_catalog = MovieCatalog.from_dataframe(embedded_df)
+    # Movies that failed to embed are retried by the next sync
+    retry_keys = sorted(set(extracted_df['key']) - set(new_catalog.keys)) if len(extracted_df) else []
+    del extracted_df, embedded_df
+    logger.info(f"Built movie catalog ({new_catalog.memory_usage() / 1e6:.1f} MB of arrays)")
+    
+    # Set up vector database on a copy of the serving index
+    logger.info(f"Setting up vector database at {config.VECTOR_DB_PATH}")
+    _, serving_index = current_catalog()
+    new_index = setup_vector_db(
+        new_catalog,
+        config.VECTOR_DB_PATH,
+        backend=config.VECTOR_BACKEND,
+        index=serving_index.clone() if serving_index is not None else None,
+        progress=phase('indexing')
+    )
+    logger.info("Vector database setup complete")
+    
+    # Initialize LLM service
+    if llm_service is None:
+        llm_service = create_llm_service()
+    
+    # Build the lexical index and "more like this" graph now rather than on the first request
+    new_catalog.lexical_index()
+    refresh_neighbor_graph(new_catalog, progress=phase('neighbors'))
+    publish_catalog(new_catalog, new_index)
+    
+    # Later syncs only ask Plex for what changed after this point
+    sync_state = {'watermark': compute_watermark(new_catalog), 'retry_keys': retry_keys}
     
+    # Snapshot the catalog and vectors so the next start can serve immediately
+    phase('snapshotting')
+    save_current_snapshot(sync_state, force=True)
+    
+    save_sync_state(config.SYNC_STATE_FILE, dict(sync_state, last_sync=datetime.now().isoformat()))
+    start_sync_scheduler()
+    
+    logger.info("Initialization complete")
+    return embedding_stats
+
+def start_initialization():
+    """Start a background initialization job unless one is already running
+
+    Returns the job and whether it was newly started.
+    """
+    global init_job
+    with init_job_lock:
+        if init_job is not None and init_job.is_running():
+            return init_job, False
+        init_job = BackgroundJob('initialize', run_initialization).start()
+        return init_job, True
+
+def save_current_snapshot(sync_state, force=False):
+    """Snapshot the catalog being served, if snapshots are enabled
+
+    Unless ``force``d, at most one snapshot is written every
+    ``SNAPSHOT_MIN_INTERVAL_SECONDS``. A skipped one is harmless: the last
+    snapshot carries its own ``sync_state``, so a restart syncs forward from it.
+    """
+    global last_snapshot_at
+    if not config.SNAPSHOT_ENABLED:
+        return
+    if not force and time.monotonic() - last_snapshot_at < config.SNAPSHOT_MIN_INTERVAL_SECONDS:
+        logger.info("Snapshot saved recently, skipping this one")
+        return
     try:
-        logger.info("Starting initialization process")
-        
-        # Connect to Plex
-        logger.info("Connecting to Plex server")
-        if config.PLEX_URL and config.PLEX_TOKEN:
-            logger.info(f"Using direct connection to Plex server at {config.PLEX_URL}")
-            plex = connect_to_plex(baseurl=config.PLEX_URL, token=config.PLEX_TOKEN)
-        elif config.PLEX_USERNAME and config.PLEX_PASSWORD and config.PLEX_SERVERNAME:
-            logger.info(f"Connecting to Plex server {config.PLEX_SERVERNAME} via MyPlex account")
-            plex = connect_to_plex(
-                username=config.PLEX_USERNAME,
-                password=config.PLEX_PASSWORD,
-                servername=config.PLEX_SERVERNAME
-            )
-        else:
-            logger.error("No valid Plex credentials provided")
-            return jsonify({"error": "No valid Plex credentials provided"}), 400
+        save_snapshot(catalog, config.SNAPSHOT_DIR, embedding_model=config.EMBEDDING_MODEL, sync_state=sync_state)
+        last_snapshot_at = time.monotonic()
+    except Exception as e:
+        logger.error(f"Error saving snapshot: {str(e)}")
+
+def refresh_neighbor_graph(new_catalog, progress=None):
+    """Bring the neighbor graph up to date with ``new_catalog``, recomputing only what changed"""
+    global neighbor_graph
+    try:
+        graph = neighbor_graph
+        if graph is None:
+            graph = NeighborGraph.load(config.NEIGHBOR_GRAPH_FILE)
+        updated = update_neighbor_graph(
+            graph,
+            new_catalog,
+            k=config.NEIGHBOR_GRAPH_K,
+            block_size=config.NEIGHBOR_BLOCK_SIZE,
+            progress=progress
+        )
+        if updated is not graph:
+            updated.save(config.NEIGHBOR_GRAPH_FILE)
+        neighbor_graph = updated
+    except Exception as e:
+        logger.error(f"Error updating neighbor graph: {str(e)}")
+
+def run_sync(blocking=True):
+    """Pull only the Plex changes since the last watermark into the catalog and index
+
+    Returns the sync stats, or None when another initialization or sync holds
+    the pipeline and ``blocking`` is False.
+    """
+    if not pipeline_lock.acquire(blocking=blocking):
+        logger.info("Initialization or sync already running, skipping this sync")
+        return None
+    try:
+        serving_catalog, serving_index = current_catalog()
+        if plex is None or serving_catalog is None:
+            raise ValueError("System not initialized")
         
-        # Extract movie data
-        logger.info(f"Extracting movie data from library: {config.MOVIE_LIBRARY_NAME}")
-        movies_df = extract_plex_movies(plex, config.MOVIE_LIBRARY_NAME)
-        logger.info(f"Extracted {len(movies_df)} movies from Plex library")
+        state = load_sync_state(config.SYNC_STATE_FILE)
+        since = state.get('watermark')
+        if since is None:
+            since = compute_watermark(serving_catalog)
+        if since is None:
+            raise ValueError("No sync watermark available, run /api/initialize first")
         
-        # Generate embeddings with caching
-        cache_file = os.path.join(config.VECTOR_DB_PATH, "cached_embeddings.pkl")
-        logger.info("Generating embeddings for movies (with caching)")
-        movies_df = generate_embeddings(
-            movies_df, 
+        new_catalog, stats, watermark, retry_keys = sync_library(
+            plex,
+            serving_catalog,
+            since,
             config.OPENAI_API_KEY,
-            batch_size=config.BATCH_SIZE,
-            cache_file=cache_file, 
-            use_cache=True
+            library_name=config.MOVIE_LIBRARY_NAME,
+            page_size=config.PLEX_PAGE_SIZE,
+            embedding_model=config.EMBEDDING_MODEL,
+            cache_file=config.EMBEDDINGS_CACHE_FILE,
+            embedding_options=embedding_options(),
+            retry_keys=state.get('retry_keys', [])
         )
-        logger.info(f"Generated embeddings for {len(movies_df)} movies")
-        
-        # Set up vector database
-        logger.info(f"Setting up vector database at {config.VECTOR_DB_PATH}")
-        collection = setup_vector_db(movies_df, config.VECTOR_DB_PATH)
-        logger.info("Vector database setup complete")
+        sync_state = {'watermark': watermark, 'retry_keys': retry_keys}
+        if new_catalog.version != serving_catalog.version:
+            # Only a changed library is worth a staged copy of the index (a full copy for Chroma)
+            new_index = setup_vector_db(
+                new_catalog,
+                config.VECTOR_DB_PATH,
+                backend=config.VECTOR_BACKEND,
+                index=serving_index.clone()
+            )
+            new_catalog.lexical_index()
+            refresh_neighbor_graph(new_catalog)
+            publish_catalog(new_catalog, new_index)
+            save_current_snapshot(sync_state)
+        elif new_catalog is not serving_catalog:
+            # Only view counts changed: the index, BM25, neighbor graph and snapshot still hold
+            publish_catalog(new_catalog, serving_index)
         
-        # Initialize LLM service
-        logger.info(f"Initializing LLM service with provider: {config.LLM_PROVIDER}")
-        llm_service = LLMService(
-            provider=config.LLM_PROVIDER,
-            anthropic_api_key=config.ANTHROPIC_API_KEY,
-            openai_api_key=config.OPENAI_API_KEY,
-            anthropic_model=config.ANTHROPIC_MODEL,
-            openai_model=config.OPENAI_MODEL
-        )
-        logger.info("LLM service initialized")
+        save_sync_state(config.SYNC_STATE_FILE, dict(
+            sync_state, last_sync=datetime.now().isoformat(), last_stats=stats
+        ))
+        return stats
+    finally:
+        pipeline_lock.release()
+
+def start_sync_scheduler():
+    """Start periodic delta syncs if an interval is configured"""
+    global sync_scheduler
+    if config.SYNC_INTERVAL_MINUTES <= 0:
+        return
+    if sync_scheduler is None:
+        sync_scheduler = SyncScheduler(config.SYNC_INTERVAL_MINUTES * 60, lambda: run_sync(blocking=False))
+    sync_scheduler.start()
+
+def warm_start():
+    """Serve from the last snapshot straight away, then reconcile with Plex in the background"""
+    global llm_service
+    
+    snapshot = load_snapshot(config.SNAPSHOT_DIR, embedding_model=config.EMBEDDING_MODEL)
+    if snapshot is None:
+        return False
+    
+    snapshot_catalog, manifest = snapshot
+    if manifest.get('sync_state'):
+        # Later syncs may not have been snapshotted; resume from what the snapshot holds
+        save_sync_state(config.SYNC_STATE_FILE, dict(
+            manifest['sync_state'], last_sync=manifest['created_at']
+        ))
+    snapshot_index = setup_vector_db(
+        snapshot_catalog,
+        config.VECTOR_DB_PATH,
+        backend=config.VECTOR_BACKEND
+    )
+    llm_service = create_llm_service()
+    snapshot_catalog.lexical_index()
+    publish_catalog(snapshot_catalog, snapshot_index)
+    logger.info(f"Warm start: serving {len(snapshot_catalog)} movies from snapshot created {manifest['created_at']}")
+    
+    def reconcile():
+        global plex
+        try:
+            refresh_neighbor_graph(snapshot_catalog)
+            if load_sync_state(config.SYNC_STATE_FILE).get('watermark') is None:
+                start_initialization()
+                return
+            # A snapshot with a sync watermark only needs the changes made since
+            plex = connect_plex_from_config()
+            run_sync()
+            start_sync_scheduler()
+        except Exception as e:
+            logger.error(f"Error reconciling snapshot with Plex: {str(e)}")
+            logger.error(traceback.format_exc())
+    
+    threading.Thread(target=reconcile, name="snapshot-reconcile", daemon=True).start()
+    return True
+
+def ensure_warm_start():
+    """Warm-start from the snapshot once per process, whichever server runs the app
+
+    Runs before the first request (and from ``__main__`` before serving), so
+    WSGI servers and ``flask run`` serve the snapshot too, while the debug
+    reloader's file watcher, which never handles requests, does not load it.
+    """
+    global warm_started
+    if warm_started:
+        return
+    with warm_start_lock:
+        if warm_started:
+            return
+        warm_started = True
+        if not config.SNAPSHOT_ENABLED or current_catalog()[0] is not None:
+            return
+        try:
+            warm_start()
+        except Exception as e:
+            logger.error(f"Warm start failed, waiting for /api/initialize: {str(e)}")
+
+@app.before_request
+def warm_start_before_first_request():
+    ensure_warm_start()
+
+@app.route('/api/initialize', methods=['POST'])
+def initialize():
+    """Start initializing the recommendation system in the background"""
+    try:
+        job, started = start_initialization()
+        return jsonify({
+            "success": True,
+            "message": "Initialization started" if started else "Initialization already running",
+            "job": job.to_dict(),
+            "status_url": "/api/initialize/status"
+        }), 202
         
-        logger.info("Initialization complete")
+    except Exception as e:
+        logger.error(f"Error starting initialization: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+
+@app.route('/api/initialize/status', methods=['GET'])
+def initialize_status():
+    """Report the phase, counts and throughput of the latest initialization"""
+    serving_catalog, _ = current_catalog()
+    return jsonify({
+        "job": init_job.to_dict() if init_job is not None else None,
+        "movies": len(serving_catalog) if serving_catalog is not None else 0
+    })
+
+@app.route('/api/sync', methods=['POST'])
+def sync():
+    """Sync movies added, updated or removed in Plex since the last sync"""
+    try:
+        stats = run_sync()
+        serving_catalog, _ = current_catalog()
         return jsonify({
             "success": True,
-            "message": f"Successfully initialized with {len(movies_df)} movies"
+            "message": f"Synced library, now serving {len(serving_catalog)} movies",
+            "sync": stats
         })
         
+    except ValueError as e:
+        logger.error(str(e))
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Error during initialization: {str(e)}")
+        logger.error(f"Error during library sync: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
+@app.route('/api/status', methods=['GET'])
+def status():
+    """Report whether the system can serve recommendations"""
+    serving_catalog, serving_index = current_catalog()
+    return jsonify({
+        "ready": serving_catalog is not None and serving_index is not None and llm_service is not None,
+        "plex_connected": plex is not None,
+        "movies": len(serving_catalog) if serving_catalog is not None else 0,
+        "initializing": init_job is not None and init_job.is_running()
+    })
+
+def parse_rerank_options(data):
+    """Per-request MMR diversity settings, falling back to the configured defaults"""
+    mmr_lambda = data.get('mmr_lambda', config.MMR_LAMBDA)
+    pool_size = data.get('pool_size', config.MMR_POOL_SIZE)
+    try:
+        mmr_lambda = float(mmr_lambda)
+        pool_size = int(pool_size)
+    except (TypeError, ValueError):
+        raise ValueError("mmr_lambda must be a number and pool_size an integer")
+    if not 0.0 <= mmr_lambda <= 1.0:
+        raise ValueError("mmr_lambda must be between 0 and 1")
+    if not 1 <= pool_size <= config.MMR_MAX_POOL_SIZE:
+        raise ValueError(f"pool_size must be between 1 and {config.MMR_MAX_POOL_SIZE}")
+    return mmr_lambda, pool_size
+
+def resolve_filters(user_input, request_filters, catalog):
+    """Search filters for a message as ``(filters, text_filters)``
+
+    Structured filters from the request win over ones read from the message.
+    """
+    text_filters = None
+    if config.SEARCH_EXTRACT_FILTERS:
+        text_filters = extract_filters(user_input, catalog.tags['genres'].vocabulary)
+    return merge_filters(text_filters, request_filters), text_filters
+
+def search_options(mmr_lambda, pool_size):
+    """Keyword arguments shared by every recommendation search"""
+    return {
+        'embedding_model': config.EMBEDDING_MODEL,
+        'hybrid': config.HYBRID_SEARCH,
+        'rrf_k': config.RRF_K,
+        'mmr_lambda': mmr_lambda,
+        'pool_size': pool_size,
+        'result_cache': result_cache if config.SEMANTIC_CACHE_SIZE > 0 else None
+    }
+
+def prepare_recommendations(data, catalog, vector_index):
+    """Everything a recommendation request does before the reply is written
+
+    Updates the conversation session and returns a dict with its
+    ``session_id``. Play commands come back finished, with their ``response``
+    and the session's ``recommendations``. Otherwise the new
+    ``recommendations``, ``filters`` and ``timings`` are returned for the
+    caller to describe. Raises ValueError for invalid request options.
+    """
+    global plex
+    
+    user_input = data.get('message', '')
+    session_id = data.get('session_id')
+    request_filters = parse_filters(data.get('filters'))
+    mmr_lambda, pool_size = parse_rerank_options(data)
+    
+    # Create a new session if none exists
+    if not session_id or session_id not in sessions:
+        session_id = str(uuid.uuid4())
+        sessions[session_id] = {
+            'last_updated': datetime.now(),
+            'recent_recommendations': [],
+            'conversation_history': []
+        }
+    
+    # Update session timestamp
+    sessions[session_id]['last_updated'] = datetime.now()
+    
+    # Add user message to conversation history
+    sessions[session_id]['conversation_history'].append({
+        'role': 'user',
+        'content': user_input
+    })
+    
+    logger.info(f"Received recommendation request: {user_input}")
+    
+    # Play commands and plain genre/person/decade requests are recognized locally
+    recent_recommendations = sessions[session_id].get('recent_recommendations', [])
+    if config.INTENT_FAST_PATH:
+        intent = catalog.intent_classifier().classify(user_input, recent_recommendations)
+    else:
+        movie = match_play_command(user_input, recent_recommendations)
+        intent = {'intent': 'play', 'movie': movie} if movie is not None else None
+    movie_to_play = intent['movie'] if intent is not None and intent['intent'] == 'play' else None
+    is_play_command = movie_to_play is not None
+    if is_play_command:
+        logger.info(f"User wants to play: {movie_to_play['title']}")
+    
+    # If this is a play command for a previous recommendation
+    if is_play_command and movie_to_play and plex is None:
+        return {
+            "response": "I'm still reconnecting to your Plex server. Please try playing that again in a moment.",
+            "recommendations": recent_recommendations,
+            "session_id": session_id
+        }
+    if is_play_command and movie_to_play:
+        clients = get_available_clients(plex)
+        if clients:
+            client_name = clients[0].title  # Default to first client
+            logger.info(f"Playing on client: {client_name}")
+            play_result = play_movie_by_key(plex, movie_to_play['key'], client_name)
+            
+            response_text = f"Now playing '{movie_to_play['title']}' on {client_name}."
+            
+            # Add assistant message to conversation history
+            sessions[session_id]['conversation_history'].append({
+                'role': 'assistant',
+                'content': response_text
+            })
+            
+            return {
+                "response": response_text,
+                "recommendations": recent_recommendations,
+                "session_id": session_id
+            }
+    
+    # If not a play command, get new recommendations
+    filters, text_filters = resolve_filters(user_input, request_filters, catalog)
+    options = search_options(mmr_lambda, pool_size)
+    
+    def search(query):
+        """Recommendations for one query, paired with the filters actually applied"""
+        logger.info(f"Getting movie recommendations for: {query}")
+        recommendations, timings = get_movie_recommendations(
+            query, 
+            catalog, 
+            vector_index, 
+            config.OPENAI_API_KEY,
+            filters=filters,
+            lexical_query=user_input,
+            return_timings=True,
+            **options
+        )
+        if not recommendations and text_filters and not request_filters:
+            # Filters guessed from the wording matched nothing; fall back to a plain search
+            logger.info(f"No movies match {filters}, searching without filters")
+            recommendations, timings = get_movie_recommendations(
+                query,
+                catalog,
+                vector_index,
+                config.OPENAI_API_KEY,
+                lexical_query=user_input,
+                return_timings=True,
+                **options
+            )
+            return (recommendations, None), timings
+        return (recommendations, filters), timings
+    
+    if intent is not None and intent['intent'] == 'search':
+        # Plain genre, person or decade requests go straight to retrieval
+        interpreted_query = intent['query']
+        (recommendations, filters), timings = search(interpreted_query)
+        timings['intent'] = intent['kind']
+    else:
+        # The raw message is searched while the LLM interprets it, and those
+        # results are kept if the interpretation barely changed the wording
+        logger.info("Interpreting user request")
+        interpreted_query, (recommendations, filters), timings = speculative_search(
+            user_input,
+            llm_service.interpret_user_request,
+            search,
+            executor=search_executor if config.SPECULATIVE_SEARCH else None,
+            reuse_threshold=config.SPECULATIVE_REUSE_THRESHOLD
+        )
+    logger.info(f"Interpreted query: {interpreted_query}")
+    logger.info(f"Found {len(recommendations)} recommendations ({timings})")
+    
+    # Store the new recommendations in the session
+    sessions[session_id]['recent_recommendations'] = recommendations
+    
+    return {
+        "recommendations": recommendations,
+        "filters": filters,
+        "timings": timings,
+        "session_id": session_id
+    }
+
+def finish_recommendation(session_id, response_text):
+    """Record the reply in the conversation history once it has been written"""
+    session = sessions.get(session_id)
+    if session is not None:
+        # Add assistant message to conversation history
+        session['conversation_history'].append({
+            'role': 'assistant',
+            'content': response_text
+        })
+    
+    # Clean up old sessions periodically
+    if random.random() < 0.1:  # 10% chance to clean up on each request
+        cleanup_old_sessions()
+
 @app.route('/api/recommend', methods=['POST'])
 def recommend():
     """Get movie recommendations based on user input"""
-    global plex, movies_df, collection, llm_service, sessions
-    
-    if not all([plex, movies_df is not None, collection, llm_service]):
+    # Hold on to one catalog/index pair for the whole request
+    catalog, vector_index = current_catalog()
+    if not all([catalog is not None, vector_index is not None, llm_service]):
         logger.error("System not initialized")
         return jsonify({"error": "System not initialized"}), 400
     
     try:
         data = request.json
-        user_input = data.get('message', '')
-        session_id = data.get('session_id')
-        
-        # Create a new session if none exists
-        if not session_id or session_id not in sessions:
-            session_id = str(uuid.uuid4())
-            sessions[session_id] = {
-                'last_updated': datetime.now(),
-                'recent_recommendations': [],
-                'conversation_history': []
-            }
+        try:
+            result = prepare_recommendations(data, catalog, vector_index)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if 'response' in result:
+            return jsonify(result)
         
-        # Update session timestamp
-        sessions[session_id]['last_updated'] = datetime.now()
+        # Generate response
+        logger.info("Generating response with LLM")
+        response_text = llm_service.generate_recommendation_response(data.get('message', ''), result['recommendations'])
+        finish_recommendation(result['session_id'], response_text)
         
-        # Add user message to conversation history
-        sessions[session_id]['conversation_history'].append({
-            'role': 'user',
-            'content': user_input
+        return jsonify({
+            "response": response_text,
+            "recommendations": result['recommendations'],
+            "filters": result['filters'],
+            "timings": result['timings'],
+            "session_id": result['session_id']
         })
         
-        logger.info(f"Received recommendation request: {user_input}")
+    except Exception as e:
+        logger.error(f"Error during recommendation: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+
+def server_sent_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/recommend/stream', methods=['POST'])
+def recommend_stream():
+    """Stream recommendations as Server-Sent Events
+
+    A ``recommendations`` event goes out as soon as the search is done, then
+    the reply arrives as ``token`` events while the LLM writes it, and a final
+    ``done`` event carries the full text. Failures after the stream has
+    started are reported as an ``error`` event.
+    """
+    catalog, vector_index = current_catalog()
+    if not all([catalog is not None, vector_index is not None, llm_service]):
+        logger.error("System not initialized")
+        return jsonify({"error": "System not initialized"}), 400
+    
+    try:
+        data = request.json
+        try:
+            result = prepare_recommendations(data, catalog, vector_index)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error during recommendation: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+    
+    user_input = data.get('message', '')
+    
+    def events():
+        yield server_sent_event('recommendations', {
+            "recommendations": result['recommendations'],
+            "filters": result.get('filters'),
+            "timings": result.get('timings'),
+            "session_id": result['session_id']
+        })
+        if 'response' in result:
+            # Play commands already have their whole reply
+            yield server_sent_event('token', {"text": result['response']})
+            yield server_sent_event('done', {"response": result['response'], "session_id": result['session_id']})
+            return
         
-        # Check if this is a follow-up command about previous recommendations
-        recent_recommendations = sessions[session_id].get('recent_recommendations', [])
-        is_play_command = False
-        movie_to_play = None
+        try:
+            parts = []
+            for text in llm_service.stream_recommendation_response(user_input, result['recommendations']):
+                parts.append(text)
+                yield server_sent_event('token', {"text": text})
+            response_text = ''.join(parts)
+            finish_recommendation(result['session_id'], response_text)
+            yield server_sent_event('done', {"response": response_text, "session_id": result['session_id']})
+        except Exception as e:
+            logger.error(f"Error streaming recommendation: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield server_sent_event('error', {"error": str(e)})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """Get recommendations for many messages at once
+
+    Each entry of ``queries`` is a message string or an object with a
+    ``message`` and optional ``filters``. Each message is searched with the
+    query /api/recommend would use (the local fast path, the raw message when
+    the LLM barely reworded it, or the interpretation), so it gets the same
+    results as on its own, but the whole batch shares one embedding request
+    and one index search. No conversation session is kept.
+    """
+    catalog, vector_index = current_catalog()
+    if not all([catalog is not None, vector_index is not None, llm_service]):
+        logger.error("System not initialized")
+        return jsonify({"error": "System not initialized"}), 400
+    
+    try:
+        data = request.json or {}
+        queries = data.get('queries')
+        messages = []
+        request_filters = []
+        try:
+            if not isinstance(queries, list) or not queries:
+                raise ValueError("queries must be a non-empty list")
+            if len(queries) > config.RECOMMEND_BATCH_MAX_QUERIES:
+                raise ValueError(f"At most {config.RECOMMEND_BATCH_MAX_QUERIES} queries per batch")
+            for query in queries:
+                if isinstance(query, str):
+                    query = {'message': query}
+                if not isinstance(query, dict) or not isinstance(query.get('message'), str) or not query['message'].strip():
+                    raise ValueError("Each query must be a message or an object with a 'message'")
+                messages.append(query['message'])
+                request_filters.append(parse_filters(query.get('filters')))
+            mmr_lambda, pool_size = parse_rerank_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Check for play commands by index number
-        if recent_recommendations and ('play' in user_input.lower() or 'watch' in user_input.lower()):
-            is_play_command = True
-            
-            # Check for number references (e.g., "play the second one" or "play #2")
-            number_words = {
-                'first': 0, 'second': 1, 'third': 2, 'fourth': 3, 'fifth': 4,
-                'sixth': 5, 'seventh': 6, 'eighth': 7, 'ninth': 8, 'tenth': 9,
-                '1': 0, '2': 1, '3': 2, '4': 3, '5': 4,
-                '6': 5, '7': 6, '8': 7, '9': 8, '10': 9,
-                '#1': 0, '#2': 1, '#3': 2, '#4': 3, '#5': 4,
-                '#6': 5, '#7': 6, '#8': 7, '#9': 8, '#10': 9,
-                'one': 0, 'two': 1, 'three': 2, 'four': 3, 'five': 4,
-                'six': 5, 'seven': 6, 'eight': 7, 'nine': 8, 'ten': 9
-            }
-            
-            for word, index in number_words.items():
-                if word in user_input.lower() and index < len(recent_recommendations):
-                    movie_to_play = recent_recommendations[index]
-                    logger.info(f"User wants to play recommendation #{index+1}: {movie_to_play['title']}")
-                    break
-            
-            # Check for movie title mentions
-            if not movie_to_play:
-                for movie in recent_recommendations:
-                    if movie['title'].lower() in user_input.lower():
-                        movie_to_play = movie
-                        logger.info(f"User wants to play: {movie_to_play['title']}")
-                        break
+        logger.info(f"Received batch of {len(messages)} recommendation requests")
         
-        # If this is a play command for a previous recommendation
-        if is_play_command and movie_to_play:
-            clients = get_available_clients(plex)
-            if clients:
-                client_name = clients[0].title  # Default to first client
-                logger.info(f"Playing on client: {client_name}")
-                play_result = play_movie_by_key(plex, movie_to_play['key'], client_name)
-                
-                response_text = f"Now playing '{movie_to_play['title']}' on {client_name}."
-                
-                # Add assistant message to conversation history
-                sessions[session_id]['conversation_history'].append({
-                    'role': 'assistant',
-                    'content': response_text
-                })
-                
-                return jsonify({
-                    "response": response_text,
-                    "recommendations": recent_recommendations,
-                    "session_id": session_id
-                })
+        # Pick each search query the way /api/recommend would: plain requests
+        # take the local fast path, and the rest are interpreted by the LLM
+        interpreted_queries = list(messages)
+        if config.INTENT_FAST_PATH:
+            classifier = catalog.intent_classifier()
+            # Batch messages are not chat turns, so they stay out of the hit-rate stats
+            intents = [classifier.classify(message, record=False) for message in messages]
+        else:
+            intents = [None] * len(messages)
+        to_interpret = [
+            position for position, intent in enumerate(intents)
+            if intent is None or intent['intent'] != 'search'
+        ]
+        for position, intent in enumerate(intents):
+            if intent is not None and intent['intent'] == 'search':
+                interpreted_queries[position] = intent['query']
+        if data.get('interpret', True) and to_interpret:
+            # Interpretations are independent LLM round-trips, so run them side by side
+            with ThreadPoolExecutor(max_workers=min(len(to_interpret), config.RECOMMEND_BATCH_WORKERS)) as executor:
+                interpretations = executor.map(
+                    llm_service.interpret_user_request, [messages[position] for position in to_interpret]
+                )
+                for position, interpreted_query in zip(to_interpret, interpretations):
+                    # A single request keeps its speculative raw-message results in this case
+                    if not (config.SPECULATIVE_SEARCH and query_similarity(messages[position], interpreted_query)
+                            >= config.SPECULATIVE_REUSE_THRESHOLD):
+                        interpreted_queries[position] = interpreted_query
         
-        # If not a play command, get new recommendations
-        logger.info("Interpreting user request")
-        interpreted_query = llm_service.interpret_user_request(user_input)
-        logger.info(f"Interpreted query: {interpreted_query}")
+        resolved = [
+            resolve_filters(message, filters, catalog)
+            for message, filters in zip(messages, request_filters)
+        ]
+        filters = [query_filters for query_filters, _ in resolved]
+        options = search_options(mmr_lambda, pool_size)
         
-        # Get recommendations
-        logger.info("Getting movie recommendations")
-        recommendations = get_movie_recommendations(
-            interpreted_query, 
-            movies_df, 
-            collection, 
-            config.OPENAI_API_KEY
+        results, timings = get_batch_recommendations(
+            interpreted_queries,
+            catalog,
+            vector_index,
+            config.OPENAI_API_KEY,
+            filters=filters,
+            lexical_queries=messages,
+            **options
         )
-        logger.info(f"Found {len(recommendations)} recommendations")
-        
-        # Store the new recommendations in the session
-        sessions[session_id]['recent_recommendations'] = recommendations
         
-        # Generate response
-        logger.info("Generating response with LLM")
-        response_text = llm_service.generate_recommendation_response(user_input, recommendations)
-        
-        # Add assistant message to conversation history
-        sessions[session_id]['conversation_history'].append({
-            'role': 'assistant',
-            'content': response_text
-        })
-        
-        # Clean up old sessions periodically
-        if random.random() < 0.1:  # 10% chance to clean up on each request
-            cleanup_old_sessions()
+        # Same fallback as a single request: drop filters guessed from the wording if they matched nothing
+        retry = [
+            position for position, (_, text_filters) in enumerate(resolved)
+            if not results[position] and text_filters and not request_filters[position]
+        ]
+        if retry:
+            retried, _ = get_batch_recommendations(
+                [interpreted_queries[position] for position in retry],
+                catalog,
+                vector_index,
+                config.OPENAI_API_KEY,
+                lexical_queries=[messages[position] for position in retry],
+                **options
+            )
+            for position, recommendations in zip(retry, retried):
+                results[position] = recommendations
+                filters[position] = None
+        logger.info(f"Answered batch of {len(messages)} requests ({timings})")
         
         return jsonify({
-            "response": response_text,
-            "recommendations": recommendations,
-            "session_id": session_id
+            "results": [
+                {
+                    "message": message,
+                    "query": interpreted_query,
+                    "filters": query_filters,
+                    "recommendations": recommendations
+                }
+                for message, interpreted_query, query_filters, recommendations
+                in zip(messages, interpreted_queries, filters, results)
+            ],
+            "timings": timings
         })
         
     except Exception as e:
-        logger.error(f"Error during recommendation: {str(e)}")
+        logger.error(f"Error during batch recommendation: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
+@app.route('/api/similar', methods=['GET'])
+def similar():
+    """Movies most like the one with the given key, straight from the neighbor graph"""
+    serving_catalog, _ = current_catalog()
+    graph = neighbor_graph
+    if serving_catalog is None or graph is None:
+        logger.error("System not initialized")
+        return jsonify({"error": "System not initialized"}), 400
+    
+    movie_key = request.args.get('key')
+    limit = request.args.get('limit', 5, type=int)
+    if not movie_key:
+        return jsonify({"error": "key is required"}), 400
+    if not 1 <= limit <= graph.k:
+        return jsonify({"error": f"limit must be between 1 and {graph.k}"}), 400
+    
+    row = serving_catalog.row(movie_key)
+    neighbors = graph.similar(movie_key)
+    if row is None or neighbors is None:
+        return jsonify({"error": f"Unknown movie key {movie_key}"}), 404
+    
+    similar_movies = []
+    for neighbor_key, similarity in neighbors:
+        neighbor_row = serving_catalog.row(neighbor_key)
+        if neighbor_row is None:
+            continue
+        movie = format_movie(serving_catalog, neighbor_row)
+        movie['similarity'] = round(similarity, 4)
+        similar_movies.append(movie)
+        if len(similar_movies) == limit:
+            break
+    
+    return jsonify({
+        "movie": format_movie(serving_catalog, row),
+        "similar": similar_movies
+    })
+
 @app.route('/api/clients', methods=['GET'])
 def clients():
     """Get available Plex clients"""
@@ -309,9 +995,25 @@ def play():
         logger.error(traceback.format_exc())
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Report runtime statistics for the service"""
+    return jsonify({
+        "http": get_connection_stats(),
+        "query_embedding_cache": get_query_cache_stats(),
+        "speculative_search": get_speculation_stats(),
+        "intent_fast_path": get_intent_stats(),
+        "response_cache": llm_service.response_cache_stats() if llm_service is not None else None,
+        "semantic_cache": result_cache.stats()
+    })
+
 if __name__ == '__main__':
     # Ensure the static and templates directories exist
     os.makedirs('static/css', exist_ok=True)
     os.makedirs('templates', exist_ok=True)
     
+    # Only the debug reloader's serving child process warms up, not its file watcher
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ensure_warm_start()
+    
     app.run(debug=True)
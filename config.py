@@ -20,14 +20,102 @@ LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'anthropic')  # or openai
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
 ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-sonnet-20240229')
 
+# Recommendation write-ups are reused for the same request and results (0 disables the cache)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 3600))
+
 # Vector DB Configuration
 VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', './chroma_db')
+# Vector index backend: 'numpy' (exact in-process cosine search) or 'chroma'
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'numpy')
 
 # Movie library section name
 MOVIE_LIBRARY_NAME = os.getenv('MOVIE_LIBRARY_NAME', 'Movies')
 
+# Library extraction pages through the section PLEX_PAGE_SIZE movies at a time,
+# fetching up to PLEX_FETCH_WORKERS pages in parallel
+PLEX_PAGE_SIZE = int(os.getenv('PLEX_PAGE_SIZE', 200))
+PLEX_FETCH_WORKERS = int(os.getenv('PLEX_FETCH_WORKERS', 4))
+
 # Embeddings Configuration
-EMBEDDINGS_CACHE_FILE = os.getenv('EMBEDDINGS_CACHE_FILE', os.path.join(VECTOR_DB_PATH, 'cached_embeddings.pkl'))
+# Base path of the embedding cache: <base>.json holds the key index, <base>.<generation>.npy the
+# memory-mapped float32 matrix. A legacy <base>.pkl cache is migrated automatically on first load.
+EMBEDDINGS_CACHE_FILE = os.getenv('EMBEDDINGS_CACHE_FILE', os.path.join(VECTOR_DB_PATH, 'cached_embeddings'))
+
+# Embedding model; cached vectors are only reused for the model that produced them
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+
+# Embedding requests are packed by estimated tokens: at most BATCH_SIZE movies and
+# EMBEDDING_MAX_REQUEST_TOKENS tokens per request, with single movies truncated to
+# EMBEDDING_MAX_INPUT_TOKENS (the provider allows 2048 inputs / 8191 tokens per input)
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 2048))
+EMBEDDING_MAX_REQUEST_TOKENS = int(os.getenv('EMBEDDING_MAX_REQUEST_TOKENS', 250000))
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv('EMBEDDING_MAX_INPUT_TOKENS', 8000))
+
+# Concurrent embedding pipeline: batches in flight, retries per batch and the
+# starting rate-limit budget (refined from the API's x-ratelimit-* headers)
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 6))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 3000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 1000000))
+
+# Shared keep-alive HTTP pool used by every OpenAI/Anthropic client
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60.0))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60.0))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10.0))
+
+# Query embedding cache: in-memory LRU size and optional SQLite file that survives restarts
+# (set QUERY_CACHE_FILE to an empty string to keep the cache in memory only)
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+QUERY_CACHE_FILE = os.getenv('QUERY_CACHE_FILE', os.path.join(VECTOR_DB_PATH, 'query_embeddings.sqlite3'))
+QUERY_CACHE_DISK_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_DISK_MAX_ENTRIES', 50000))
+
+# "More like this" graph: the NEIGHBOR_GRAPH_K most similar movies of every movie, computed in
+# NEIGHBOR_BLOCK_SIZE x NEIGHBOR_BLOCK_SIZE similarity tiles and stored next to the embedding cache
+NEIGHBOR_GRAPH_K = int(os.getenv('NEIGHBOR_GRAPH_K', 20))
+NEIGHBOR_BLOCK_SIZE = int(os.getenv('NEIGHBOR_BLOCK_SIZE', 1024))
+NEIGHBOR_GRAPH_FILE = os.getenv('NEIGHBOR_GRAPH_FILE', EMBEDDINGS_CACHE_FILE + '.neighbors.npz')
+
+# Snapshot bundle of the catalog and vectors, used to serve queries immediately after a restart
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(VECTOR_DB_PATH, 'snapshot'))
+# Syncs rewrite the snapshot at most this often; initialization always does
+SNAPSHOT_MIN_INTERVAL_SECONDS = float(os.getenv('SNAPSHOT_MIN_INTERVAL_SECONDS', 600))
+
+# Delta library sync: interval between background syncs (0 disables) and the watermark state file
+SYNC_INTERVAL_MINUTES = float(os.getenv('SYNC_INTERVAL_MINUTES', 5))
+SYNC_STATE_FILE = os.getenv('SYNC_STATE_FILE', os.path.join(VECTOR_DB_PATH, 'sync_state.json'))
+
+# Read year, genre, duration and rating filters out of the user's message
+SEARCH_EXTRACT_FILTERS = os.getenv('SEARCH_EXTRACT_FILTERS', 'true').lower() in ('1', 'true', 'yes')
+
+# Fuse BM25 keyword matches with the vector results (reciprocal rank fusion constant RRF_K)
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() in ('1', 'true', 'yes')
+RRF_K = int(os.getenv('RRF_K', 60))
+
+# Semantic result cache: a query whose embedding has cosine similarity of at least
+# SEMANTIC_CACHE_THRESHOLD to one of the last SEMANTIC_CACHE_SIZE queries reuses its results
+# (lower thresholds reuse results for looser paraphrases; 0 entries disables the cache)
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 256))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+
+# Diversity reranking: 1.0 is pure relevance, lower values push near-duplicates (e.g. sequels) apart.
+# Both can be overridden per request with 'mmr_lambda' and 'pool_size'
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', 0.7))
+MMR_POOL_SIZE = int(os.getenv('MMR_POOL_SIZE', 25))
+MMR_MAX_POOL_SIZE = int(os.getenv('MMR_MAX_POOL_SIZE', 200))
+
+# Recognize play commands and plain genre/person/decade requests locally instead of asking the LLM
+INTENT_FAST_PATH = os.getenv('INTENT_FAST_PATH', 'true').lower() in ('1', 'true', 'yes')
+
+# Search the raw message while the LLM is still interpreting it, and keep those results when the
+# interpretation shares at least SPECULATIVE_REUSE_THRESHOLD of its content words with the message
+SPECULATIVE_SEARCH = os.getenv('SPECULATIVE_SEARCH', 'true').lower() in ('1', 'true', 'yes')
+SPECULATIVE_REUSE_THRESHOLD = float(os.getenv('SPECULATIVE_REUSE_THRESHOLD', 0.8))
+SPECULATIVE_SEARCH_WORKERS = int(os.getenv('SPECULATIVE_SEARCH_WORKERS', 8))
 
-# Batch size for embeddings
-BATCH_SIZE = int(os.getenv('BATCH_SIZE', 100))
+# /api/recommend/batch: most queries per request and parallel LLM interpretations per batch
+RECOMMEND_BATCH_MAX_QUERIES = int(os.getenv('RECOMMEND_BATCH_MAX_QUERIES', 50))
+RECOMMEND_BATCH_WORKERS = int(os.getenv('RECOMMEND_BATCH_WORKERS', 8))
@@ -0,0 +1,383 @@
+import sys
+import copy
+import heapq
+import logging
+import itertools
+import threading
+import numpy as np
+from src.filters import evaluate_filters
+from src.lexical import BM25Index, tokenize
+from src.intent import IntentClassifier
+from src.embedding_store import unit_rows
+
+logger = logging.getLogger(__name__)
+
+# Per-movie string fields, kept as plain lists of (interned) strings
+STRING_FIELDS = ('key', 'title', 'summary', 'text_representation', 'fingerprint')
+
+# Multi-valued string fields, stored as integer codes in CSR form
+TAG_FIELDS = ('genres', 'directors', 'actors')
+
+# Numeric fields with the dtype and the sentinel that stands for "missing"
+# (None when every value, including zero, is meaningful)
+NUMERIC_FIELDS = {
+    'year': (np.int32, 0),
+    'rating': (np.float32, np.nan),
+    'audience_rating': (np.float32, np.nan),
+    'duration': (np.int64, 0),
+    'view_count': (np.int64, None),
+    'added_at': (np.int64, 0),
+    'updated_at': (np.int64, 0),
+    'last_viewed_at': (np.int64, 0),
+}
+
+# Fields that change when a movie is watched; nothing searched or embedded depends on them
+VIEW_FIELDS = ('view_count', 'last_viewed_at', 'updated_at')
+
+# Every catalog built in this process gets a new version, so caches can tell them apart
+_catalog_versions = itertools.count(1)
+
+def _ranking_scores(numeric):
+    """Sort keys of the precomputed rankings, higher is better"""
+    return {
+        'recent': numeric['added_at'].astype(np.float64),
+        # Play count first; the audience rating (0-10) only breaks ties
+        'popular': numeric['view_count'] + np.nan_to_num(numeric['audience_rating'].astype(np.float64)) / 11.0,
+    }
+
+def _merge_ranking(old_order, old_to_new, added_rows, scores):
+    """Carry a ranking over to a changed catalog without re-sorting the unchanged rows
+
+    ``old_to_new`` maps old rows to new ones (-1 when removed). The few added
+    rows are sorted on their own and merged in with ``searchsorted``.
+    """
+    kept = old_to_new[old_order]
+    kept = kept[kept >= 0]
+    added = added_rows[np.argsort(-scores[added_rows], kind='stable')]
+    positions = np.searchsorted(-scores[kept], -scores[added], side='right')
+    return np.insert(kept, positions, added)
+
+class TagColumn:
+    """Multi-valued string column in CSR form, with inverted postings
+
+    Row ``i`` holds ``vocabulary[codes[offsets[i]:offsets[i + 1]]]``. Each
+    distinct tag is stored once in the vocabulary, and rows hold int32 codes.
+    The postings are the transpose: the rows carrying tag ``c`` are
+    ``posting_rows[posting_offsets[c]:posting_offsets[c + 1]]``, in row order.
+    """
+
+    def __init__(self, vocabulary, offsets, codes):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.codes = codes
+        self.code_of = {tag: code for code, tag in enumerate(vocabulary)}
+        self.counts = np.diff(offsets).astype(np.int32)
+        self.row_of_code = np.repeat(np.arange(len(self.counts), dtype=np.int32), self.counts)
+        order = np.argsort(codes, kind='stable')
+        self.posting_rows = self.row_of_code[order]
+        self.posting_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(vocabulary)), out=self.posting_offsets[1:])
+
+    @classmethod
+    def from_lists(cls, lists):
+        vocabulary = []
+        code_of = {}
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        codes = []
+        for i, tags in enumerate(lists):
+            for tag in tags if isinstance(tags, (list, tuple, np.ndarray)) else ():
+                code = code_of.get(tag)
+                if code is None:
+                    code = code_of[tag] = len(vocabulary)
+                    vocabulary.append(sys.intern(str(tag)))
+                codes.append(code)
+            offsets[i + 1] = len(codes)
+        return cls(vocabulary, offsets, np.asarray(codes, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        vocabulary = self.vocabulary
+        return [vocabulary[code] for code in self.codes[self.offsets[row]:self.offsets[row + 1]]]
+
+    def row_codes(self, row):
+        return self.codes[self.offsets[row]:self.offsets[row + 1]]
+
+    def rows_with(self, tag):
+        """Rows carrying ``tag``, in row order"""
+        code = self.code_of.get(tag)
+        if code is None:
+            return self.posting_rows[:0]
+        return self.posting_rows[self.posting_offsets[code]:self.posting_offsets[code + 1]]
+
+    def overlap_counts(self, tags):
+        """Number of the given tags each row carries, as an array over all rows"""
+        postings = [self.rows_with(tag) for tag in set(tags)]
+        if not postings:
+            return np.zeros(len(self), dtype=np.int64)
+        return np.bincount(np.concatenate(postings), minlength=len(self))
+
+class MovieCatalog:
+    """Immutable columnar catalog of the movies being served
+
+    Strings are plain lists, multi-valued fields are ``TagColumn``s, numeric
+    fields are typed NumPy arrays, and the embeddings are one unit-normalized
+    float32 matrix whose rows line up with the catalog. ``key_to_row`` gives O(1) lookup by
+    Plex key. Changes build a new catalog, so readers never see a partial update,
+    and each catalog carries a new ``version`` (view-count patches keep it).
+
+    The ``recent`` and ``popular`` rankings are kept as precomputed row
+    orderings; ``with_changes`` merges changed rows into them instead of
+    sorting the library again.
+    """
+
+    def __init__(self, strings, tags, numeric, embeddings, orderings=None):
+        self.strings = strings
+        self.tags = tags
+        self.numeric = numeric
+        self.embeddings = embeddings
+        self.version = next(_catalog_versions)
+        self.keys = strings['key']
+        self.key_to_row = {key: row for row, key in enumerate(self.keys)}
+        self.scores = _ranking_scores(numeric)
+        if orderings is None:
+            orderings = {
+                name: np.argsort(-scores, kind='stable')
+                for name, scores in self.scores.items()
+            }
+        self.orderings = orderings
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    @classmethod
+    def from_columns(cls, columns, embeddings, orderings=None):
+        """Build a catalog from a mapping of field name to per-movie values"""
+        size = len(columns['key'])
+        strings = {}
+        for field in STRING_FIELDS:
+            values = columns.get(field)
+            if values is None:
+                strings[field] = [None] * size
+            else:
+                strings[field] = [sys.intern(v) if isinstance(v, str) else None for v in values]
+        tags = {field: TagColumn.from_lists(columns.get(field) or [[]] * size) for field in TAG_FIELDS}
+        numeric = {}
+        for field, (dtype, missing) in NUMERIC_FIELDS.items():
+            values = columns.get(field)
+            array = np.full(size, 0 if missing is None else missing, dtype=dtype)
+            if values is not None:
+                for i, value in enumerate(values):
+                    if value is not None and value == value:
+                        array[i] = value
+            numeric[field] = array
+        if embeddings is None or len(embeddings) == 0:
+            embeddings = np.zeros((size, 0), dtype=np.float32)
+        return cls(strings, tags, numeric, unit_rows(np.asarray(embeddings, dtype=np.float32)), orderings)
+
+    @classmethod
+    def from_dataframe(cls, movies_df, embeddings=None):
+        """Build a catalog from a movies DataFrame, taking vectors from its ``embedding`` column"""
+        if embeddings is None and 'embedding' in movies_df.columns and len(movies_df):
+            embeddings = np.vstack(movies_df['embedding'].tolist())
+        columns = {field: movies_df[field].tolist() for field in movies_df.columns if field != 'embedding'}
+        return cls.from_columns(columns, embeddings)
+
+    @classmethod
+    def from_records(cls, records, embeddings):
+        fields = STRING_FIELDS + TAG_FIELDS + tuple(NUMERIC_FIELDS)
+        columns = {field: [record.get(field) for record in records] for field in fields}
+        return cls.from_columns(columns, embeddings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_to_row
+
+    def row(self, key):
+        return self.key_to_row.get(key)
+
+    def value(self, field, row):
+        """One field of one movie, with missing numeric values as None"""
+        if field in self.strings:
+            return self.strings[field][row]
+        if field in self.tags:
+            return self.tags[field][row]
+        if field == 'embedding':
+            return self.embeddings[row]
+        value = self.numeric[field][row]
+        missing = NUMERIC_FIELDS[field][1]
+        if missing is not None and (value != value or value == missing):
+            return None
+        return value.item()
+
+    def movie(self, row):
+        """The full record for one movie (without its embedding)"""
+        record = {field: self.strings[field][row] for field in STRING_FIELDS}
+        for field in TAG_FIELDS:
+            record[field] = self.tags[field][row]
+        for field in NUMERIC_FIELDS:
+            record[field] = self.value(field, row)
+        return record
+
+    def records(self):
+        for row in range(len(self)):
+            yield self.movie(row)
+
+    def with_changes(self, updates_df, deleted_keys=()):
+        """New catalog with ``updates_df`` rows added or replaced and ``deleted_keys`` removed"""
+        replaced = set(deleted_keys) | set(updates_df['key'])
+        kept = [row for row, key in enumerate(self.keys) if key not in replaced]
+        columns = {}
+        for field in STRING_FIELDS:
+            values = self.strings[field]
+            columns[field] = [values[row] for row in kept]
+        for field in TAG_FIELDS:
+            column = self.tags[field]
+            columns[field] = [column[row] for row in kept]
+        for field in NUMERIC_FIELDS:
+            columns[field] = [self.value(field, row) for row in kept]
+        for field in columns:
+            if field in updates_df.columns:
+                columns[field] += updates_df[field].tolist()
+            else:
+                columns[field] += [None] * len(updates_df)
+
+        parts = [self.embeddings[kept]] if self.embeddings.shape[1] else []
+        if len(updates_df):
+            parts.append(unit_rows(np.vstack(updates_df['embedding'].tolist()).astype(np.float32)))
+        embeddings = np.vstack(parts) if parts else None
+        catalog = MovieCatalog.from_columns(columns, embeddings, orderings={})
+
+        old_to_new = np.full(len(self), -1, dtype=np.int64)
+        old_to_new[kept] = np.arange(len(kept))
+        added_rows = np.arange(len(kept), len(catalog))
+        catalog.orderings = {
+            name: _merge_ranking(order, old_to_new, added_rows, catalog.scores[name])
+            for name, order in self.orderings.items()
+        }
+        return catalog
+
+    def only_views_changed(self, row, record):
+        """Whether ``record`` differs from the movie at ``row`` in ``VIEW_FIELDS`` alone"""
+        for field in ('title', 'summary', 'text_representation'):
+            if (record.get(field) or None) != (self.strings[field][row] or None):
+                return False
+        for field in TAG_FIELDS:
+            if list(record.get(field) or []) != self.tags[field][row]:
+                return False
+        for field, (dtype, missing) in NUMERIC_FIELDS.items():
+            if field in VIEW_FIELDS:
+                continue
+            value = record.get(field)
+            if value is not None and value == value:
+                # Round-trip through the column's dtype, so float32 ratings compare equal
+                value = np.array(value, dtype=dtype).item()
+                if missing is not None and value == missing:
+                    value = None
+            else:
+                value = None
+            if value != self.value(field, row):
+                return False
+        return True
+
+    def with_view_changes(self, records):
+        """New catalog with only the ``VIEW_FIELDS`` of ``records`` patched in
+
+        Strings, tags, embeddings and derived structures (BM25, filters) are
+        shared, and the catalog keeps its ``version``, since nothing a search
+        returns has changed. Only the ``popular`` ranking merges the patched
+        rows back in.
+        """
+        numeric = dict(self.numeric)
+        for field in VIEW_FIELDS:
+            numeric[field] = self.numeric[field].copy()
+        rows = []
+        for record in records:
+            row = self.key_to_row.get(record['key'])
+            if row is None:
+                continue
+            for field in VIEW_FIELDS:
+                numeric[field][row] = record.get(field) or 0
+            rows.append(row)
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+
+        catalog = copy.copy(self)
+        catalog.numeric = numeric
+        catalog.scores = _ranking_scores(numeric)
+        old_to_new = np.arange(len(self), dtype=np.int64)
+        old_to_new[rows] = -1
+        catalog.orderings = dict(self.orderings)
+        catalog.orderings['popular'] = _merge_ranking(
+            self.orderings['popular'], old_to_new, rows, catalog.scores['popular']
+        )
+        catalog._derived = dict(self._derived)
+        catalog._derived_lock = threading.Lock()
+        return catalog
+
+    def ranked(self, name, limit, rows=None):
+        """Top ``limit`` rows of a ranking, optionally restricted to ``rows``
+
+        Unfiltered requests slice the precomputed ordering; filtered ones take
+        a heap-based top k over the candidate rows only.
+        """
+        if rows is None:
+            return self.orderings[name][:limit].tolist()
+        scores = self.scores[name]
+        # Ties go to the earlier row, matching the stable full ordering
+        return heapq.nlargest(limit, np.unique(rows).tolist(), key=lambda row: (scores[row], -row))
+
+    def _derive(self, name, build):
+        """Build a derived structure once per catalog and keep it"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build()
+        return value
+
+    def lexical_index(self):
+        """BM25 index over the text representations, ids are catalog rows"""
+        return self._derive('lexical', lambda: BM25Index(self.strings['text_representation']))
+
+    def name_terms(self):
+        """Word tokens of every title, genre, director and actor name in the catalog"""
+        def build():
+            names = [title for title in self.strings['title'] if title]
+            for field in TAG_FIELDS:
+                names.extend(self.tags[field].vocabulary)
+            return frozenset(token for name in names for token in tokenize(name))
+        return self._derive('name_terms', build)
+
+    def intent_classifier(self):
+        """Local request classifier over this catalog's genres and people"""
+        return self._derive('intent', lambda: IntentClassifier.from_catalog(self))
+
+    def filter_mask(self, filters):
+        """Boolean mask of the movies passing a filter dict (see ``src.filters``)"""
+        return evaluate_filters(self._derive('filter_columns', self._build_filter_columns), filters)
+
+    def _build_filter_columns(self):
+        duration = self.numeric['duration']
+        rating = self.numeric['audience_rating']
+        rating = np.where(np.isnan(rating), self.numeric['rating'], rating)
+        genres = self.tags['genres']
+        genre_masks = {}
+        for tag in genres.vocabulary:
+            mask = genre_masks.setdefault(tag.lower(), np.zeros(len(self), dtype=bool))
+            mask[genres.rows_with(tag)] = True
+        return {
+            'year': self.numeric['year'],
+            'duration': np.rint(duration / 60000).astype(np.int32),
+            'rating': np.nan_to_num(rating),
+            'genres': genre_masks,
+        }
+
+    def memory_usage(self):
+        """Approximate resident bytes of the NumPy columns and embedding matrix"""
+        total = self.embeddings.nbytes + sum(array.nbytes for array in self.numeric.values())
+        for column in self.tags.values():
+            total += column.offsets.nbytes + column.codes.nbytes
+        return total
@@ -1,28 +1,24 @@
 import numpy as np
-import time
-import os
-import httpx
+import hashlib
 import logging
-import pickle
-import pandas as pd
+from src.embedding_store import EmbeddingStore
+from src.http_client import get_openai_client
+from src.query_cache import QueryEmbeddingCache, normalize_query
+from src.embedding_pipeline import embed_batches, pack_batches, truncate_to_tokens
 
 logger = logging.getLogger(__name__)
 
-def save_embeddings(movies_df, file_path="cached_embeddings.pkl"):
-    """Save movie embeddings to a pickle file"""
+def save_embeddings(movies_df, file_path="cached_embeddings", model=None):
+    """Save movie embeddings as a memory-mappable float32 matrix with a key index"""
     logger.info(f"Saving embeddings to {file_path}")
     try:
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        keys = movies_df['key'].tolist()
+        embeddings = movies_df['embedding'].tolist()
+        matrix = np.vstack(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
         
-        # Extract essential data to save
-        cache_data = {
-            'movie_keys': movies_df['key'].tolist(),
-            'embeddings': movies_df['embedding'].tolist()
-        }
+        fingerprints = movies_df['fingerprint'].tolist() if 'fingerprint' in movies_df.columns else None
         
-        with open(file_path, 'wb') as f:
-            pickle.dump(cache_data, f)
+        EmbeddingStore(file_path).save(keys, matrix, fingerprints=fingerprints, model=model)
         
         logger.info(f"Successfully saved embeddings for {len(movies_df)} movies")
         return True
@@ -30,16 +26,18 @@ def save_embeddings(movies_df, file_path="cached_embeddings.pkl"):
         logger.error(f"Error saving embeddings: {str(e)}")
         return False
 
-def load_embeddings(file_path="cached_embeddings.pkl"):
-    """Load movie embeddings from a pickle file"""
+def load_embeddings(file_path="cached_embeddings"):
+    """Load movie embeddings as a read-only memory map (legacy pickle caches are migrated)"""
     logger.info(f"Loading embeddings from {file_path}")
     try:
-        if not os.path.exists(file_path):
+        store = EmbeddingStore(file_path)
+        if not store.exists():
             logger.info(f"No cached embeddings found at {file_path}")
             return None
         
-        with open(file_path, 'rb') as f:
-            cache_data = pickle.load(f)
+        cache_data = store.load()
+        if cache_data is None:
+            return None
         
         logger.info(f"Successfully loaded embeddings for {len(cache_data['movie_keys'])} movies")
         return cache_data
@@ -58,13 +56,12 @@ def apply_cached_embeddings(movies_df, cache_data):
         if 'embedding' not in movies_df.columns:
             movies_df['embedding'] = None
         
-        # Create a mapping of movie keys to embeddings
-        embedding_map = {key: emb for key, emb in zip(cache_data['movie_keys'], cache_data['embeddings'])}
-        
-        # Apply embeddings to the dataframe
-        for idx, row in movies_df.iterrows():
-            if row['key'] in embedding_map:
-                movies_df.at[idx, 'embedding'] = embedding_map[row['key']]
+        # Look up each movie's row in the memory-mapped matrix
+        key_to_row = cache_data['key_to_row']
+        matrix = cache_data['embeddings']
+        movies_df['embedding'] = movies_df['key'].map(
+            lambda k: matrix[key_to_row[k]] if k in key_to_row else None
+        )
         
         # Count how many movies got embeddings
         embedded_count = movies_df['embedding'].notna().sum()
@@ -75,95 +72,180 @@ def apply_cached_embeddings(movies_df, cache_data):
         logger.error(f"Error applying cached embeddings: {str(e)}")
         return movies_df, 0
 
-def generate_embeddings(movies_df, api_key, batch_size=20, model="text-embedding-ada-002", 
-                        cache_file="cached_embeddings.pkl", use_cache=True):
-    """Generate embeddings for movie text representations using the latest OpenAI API"""
-    from openai import OpenAI
-    import pandas as pd
+def fingerprint_text(text, model):
+    """Fingerprint a text representation together with the embedding model that encodes it"""
+    digest = hashlib.sha1(f"{model}\0{text}".encode('utf-8')).hexdigest()
+    return digest[:16]
+
+def plan_embedding_sync(keys, fingerprints, cache_data):
+    """Decide which cached vectors can be reused
+
+    Returns a list with the cached row for every reusable movie (None where the
+    movie must be embedded) and counts of added, changed, unchanged and removed rows.
+    """
+    stats = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    if not cache_data:
+        stats['added'] = len(keys)
+        return [None] * len(keys), stats
+
+    key_to_row = cache_data['key_to_row']
+    cached_fingerprints = cache_data.get('fingerprints')
+    if cached_fingerprints is None:
+        # Caches written before fingerprints existed are trusted once and fingerprinted on the next save
+        logger.info("Embedding cache has no fingerprints, adopting cached vectors as unchanged")
+
+    reuse_rows = []
+    for key, fingerprint in zip(keys, fingerprints):
+        row = key_to_row.get(key)
+        if row is None:
+            stats['added'] += 1
+            reuse_rows.append(None)
+        elif cached_fingerprints is not None and cached_fingerprints[row] not in (None, fingerprint):
+            stats['changed'] += 1
+            reuse_rows.append(None)
+        else:
+            stats['unchanged'] += 1
+            reuse_rows.append(row)
+
+    stats['removed'] = len(set(key_to_row) - set(keys))
+    return reuse_rows, stats
+
+def _embed_rows(movies_df, indices, api_key, model, store, batch_size=2048, max_workers=4, max_retries=6,
+                requests_per_minute=3000, tokens_per_minute=1000000, max_request_tokens=250000,
+                max_input_tokens=8000, progress=None):
+    """Embed the given rows of ``movies_df`` in place, checkpointing each batch to ``store``
+
+    Returns the DataFrame indices whose batches failed after all retries.
+    ``progress(done, total)`` is called with the number of movies embedded so far.
+    """
+    logger.info(f"Generating embeddings for {len(indices)} movies "
+                f"(up to {batch_size} movies / {max_request_tokens} tokens per request)")
+    
+    # Reuse the process-wide pooled client
+    client = get_openai_client(api_key)
+    
+    # Over-long representations are cut deterministically so a re-run sends identical input
+    originals = movies_df.loc[indices, 'text_representation'].tolist()
+    texts = [truncate_to_tokens(text, max_input_tokens) for text in originals]
+    truncated = sum(1 for text, original in zip(texts, originals) if len(text) != len(original))
+    if truncated:
+        logger.info(f"Truncated {truncated} text representations to {max_input_tokens} estimated tokens")
     
+    # Pack requests by estimated tokens rather than a fixed number of movies
+    packed = pack_batches(texts, max_request_tokens, batch_size)
+    batch_indices_by_id = {batch_id: indices[positions] for batch_id, positions in enumerate(packed)}
+    batch_texts = [(batch_id, [texts[p] for p in positions]) for batch_id, positions in enumerate(packed)]
+    logger.info(f"Packed {len(texts)} movies into {len(packed)} embedding requests")
+    embedded = 0
+    if progress:
+        progress(embedded, len(texts))
+    
+    def on_batch_done(batch_id, batch_embeddings):
+        nonlocal embedded
+        batch_indices = batch_indices_by_id[batch_id]
+        for idx, embedding in zip(batch_indices, batch_embeddings):
+            movies_df.at[idx, 'embedding'] = embedding
+        # Checkpoint so a crash later in the run keeps this batch
+        if store is not None:
+            try:
+                store.append_checkpoint(
+                    movies_df.loc[batch_indices, 'key'].tolist(),
+                    batch_embeddings,
+                    movies_df.loc[batch_indices, 'fingerprint'].tolist()
+                )
+            except Exception as e:
+                logger.warning(f"Could not checkpoint embedding batch {batch_id}: {str(e)}")
+        embedded += len(batch_embeddings)
+        if progress:
+            progress(embedded, len(texts))
+        logger.info(f"Successfully generated {len(batch_embeddings)} embeddings for batch {batch_id}")
+    
+    failed_batches = embed_batches(
+        client,
+        batch_texts,
+        model,
+        on_batch_done,
+        max_workers=max_workers,
+        max_retries=max_retries,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute
+    )
+    return [idx for batch_id in failed_batches for idx in batch_indices_by_id[batch_id]]
+
+def generate_embeddings(movies_df, api_key, batch_size=20, model="text-embedding-ada-002", 
+                        cache_file="cached_embeddings", use_cache=True, return_stats=False,
+                        max_workers=4, max_retries=6, requests_per_minute=3000, tokens_per_minute=1000000,
+                        max_request_tokens=250000, max_input_tokens=8000, progress=None):
+    """Generate embeddings for movie text representations using the latest OpenAI API
+
+    Cached vectors are reused only when the fingerprint of the movie's text
+    representation and the embedding model both match; everything else is
+    re-embedded. With ``return_stats`` the added/changed/unchanged/removed counts
+    are returned alongside the DataFrame.
+
+    Requests are packed by estimated token count (at most ``batch_size`` movies
+    and ``max_request_tokens`` tokens each, with single inputs truncated to
+    ``max_input_tokens``), run concurrently under a shared rate-limit budget
+    (see ``src.embedding_pipeline``), and each finished batch is checkpointed
+    to the cache journal as soon as it completes. ``progress(done, total)``
+    reports how many of the movies that need embedding are done.
+    """
     if not api_key:
         raise ValueError("OpenAI API key is required for generating embeddings")
     
     # Make sure we have a copy of the DataFrame
     movies_df = movies_df.copy()
-    
-    # Make sure the embedding column exists
-    if 'embedding' not in movies_df.columns:
-        movies_df['embedding'] = None
+    movies_df['embedding'] = None
+    movies_df['fingerprint'] = [
+        fingerprint_text(text, model) for text in movies_df['text_representation']
+    ]
     
     # Check if we should use cached embeddings
-    if use_cache:
-        cache_data = load_embeddings(cache_file)
-        if cache_data:
-            # Apply cached embeddings
-            embedding_map = {key: emb for key, emb in zip(cache_data['movie_keys'], cache_data['embeddings'])}
-            
-            # Create a new column with the embeddings
-            movies_df['embedding'] = movies_df['key'].map(lambda k: embedding_map.get(k))
-            
-            # Count how many movies got embeddings
-            embedded_count = movies_df['embedding'].notna().sum()
-            logger.info(f"Applied cached embeddings to {embedded_count} out of {len(movies_df)} movies")
-            
-            # If all movies have embeddings, return early
-            if embedded_count == len(movies_df):
-                logger.info("All movies have cached embeddings, skipping API calls")
-                return movies_df
-            
-            # Filter out movies that already have embeddings
-            movies_to_embed_indices = movies_df[movies_df['embedding'].isna()].index
-            logger.info(f"Need to generate embeddings for {len(movies_to_embed_indices)} new movies")
-            
-            if len(movies_to_embed_indices) == 0:
-                return movies_df
-        else:
-            movies_to_embed_indices = movies_df.index
-    else:
-        movies_to_embed_indices = movies_df.index
-    
-    logger.info(f"Generating embeddings for {len(movies_to_embed_indices)} movies with batch size {batch_size}")
+    cache_data = load_embeddings(cache_file) if use_cache else None
+    if cache_data and cache_data.get('model') not in (None, model):
+        logger.info(f"Embedding model changed from {cache_data['model']} to {model}, re-embedding all movies")
     
-    # Create a custom httpx client without proxies
-    http_client = httpx.Client(
-        timeout=60.0,
-        follow_redirects=True
+    reuse_rows, stats = plan_embedding_sync(
+        movies_df['key'].tolist(), movies_df['fingerprint'].tolist(), cache_data
     )
+    if cache_data:
+        # Apply cached embeddings as row views into the memory-mapped matrix
+        matrix = cache_data['embeddings']
+        movies_df['embedding'] = [matrix[row] if row is not None else None for row in reuse_rows]
     
-    # Initialize OpenAI client with the custom httpx client
-    client = OpenAI(
-        api_key=api_key,
-        http_client=http_client
+    logger.info(
+        f"Embedding sync plan: {stats['added']} added, {stats['changed']} changed, "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed"
     )
     
-    # Process in batches to avoid rate limits
-    for i in range(0, len(movies_to_embed_indices), batch_size):
-        batch_indices = movies_to_embed_indices[i:i+batch_size]
-        batch_df = movies_df.loc[batch_indices]
-        batch = batch_df['text_representation'].tolist()
-        
-        logger.info(f"Processing batch {i}-{i+min(batch_size, len(movies_to_embed_indices)-i)} of {len(movies_to_embed_indices)}")
+    movies_to_embed_indices = movies_df.index[[row is None for row in reuse_rows]]
+    stats['failed'] = 0
+    
+    if (len(movies_to_embed_indices) == 0 and stats['removed'] == 0 and cache_data
+            and not cache_data.get('journaled') and None not in (cache_data.get('fingerprints') or [None])):
+        logger.info("All movies have up-to-date cached embeddings, skipping API calls")
+        return (movies_df, stats) if return_stats else movies_df
+    
+    if len(movies_to_embed_indices) > 0:
+        store = EmbeddingStore(cache_file) if use_cache else None
+        failed_indices = _embed_rows(
+            movies_df, movies_to_embed_indices, api_key, model, store,
+            batch_size=batch_size, max_workers=max_workers, max_retries=max_retries,
+            requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+            max_request_tokens=max_request_tokens, max_input_tokens=max_input_tokens,
+            progress=progress
+        )
         
-        try:
-            response = client.embeddings.create(
-                input=batch,
-                model=model
-            )
-            batch_embeddings = [item.embedding for item in response.data]
-            
-            # Assign embeddings directly to the DataFrame
-            for j, idx in enumerate(batch_indices):
-                if j < len(batch_embeddings):
-                    movies_df.at[idx, 'embedding'] = batch_embeddings[j]
-            
-            logger.info(f"Successfully generated {len(batch_embeddings)} embeddings")
-            
-            # Sleep to avoid rate limits
-            if i + batch_size < len(movies_to_embed_indices):
-                time.sleep(1)
-                
-        except Exception as e:
-            logger.error(f"Error generating embeddings for batch {i}-{i+batch_size}: {str(e)}")
-            # We don't add None values, just leave them as they are
+        # Keep the previous vector for changed movies that could not be re-embedded;
+        # their old fingerprint makes the next sync retry them. Vectors of another
+        # model are never kept, so those movies are dropped and retried by key
+        if failed_indices and cache_data and cache_data.get('model') == model:
+            key_to_row = cache_data['key_to_row']
+            for idx in failed_indices:
+                row = key_to_row.get(movies_df.at[idx, 'key'])
+                if row is not None:
+                    movies_df.at[idx, 'embedding'] = cache_data['embeddings'][row]
+                    movies_df.at[idx, 'fingerprint'] = (cache_data.get('fingerprints') or [None] * (row + 1))[row]
     
     # Remove rows with failed embeddings
     before_count = len(movies_df)
@@ -171,46 +253,130 @@ def generate_embeddings(movies_df, api_key, batch_size=20, model="text-embedding
     after_count = len(movies_df)
     
     if before_count > after_count:
+        stats['failed'] = before_count - after_count
         logger.warning(f"Dropped {before_count - after_count} rows with failed embeddings")
     
     # Save the updated embeddings to cache
     if use_cache:
-        save_embeddings(movies_df, cache_file)
+        save_embeddings(movies_df, cache_file, model=model)
     
-    return movies_df
+    return (movies_df, stats) if return_stats else movies_df
 
+def embed_movie_updates(updates_df, previous_catalog, api_key, model="text-embedding-ada-002",
+                        cache_file="cached_embeddings", use_cache=True, **options):
+    """Embed a small set of added or updated movies for an incremental sync
+
+    Vectors are reused from ``previous_catalog`` (the catalog currently being served)
+    whenever the fingerprint is unchanged, e.g. when only play counts moved.
+    New vectors are appended to the cache journal instead of rewriting the full
+    matrix. Returns the embedded rows and reused/embedded/failed counts (plus
+    ``failed_keys`` when some movies could not be embedded).
+    """
+    updates_df = updates_df.copy()
+    updates_df['fingerprint'] = [
+        fingerprint_text(text, model) for text in updates_df['text_representation']
+    ]
+    
+    previous = {}
+    if previous_catalog is not None:
+        previous_fingerprints = previous_catalog.strings['fingerprint']
+        for key in updates_df['key']:
+            row = previous_catalog.row(key)
+            if row is not None:
+                previous[key] = (previous_fingerprints[row], previous_catalog.embeddings[row])
+    
+    embeddings = []
+    for key, fingerprint in zip(updates_df['key'], updates_df['fingerprint']):
+        cached = previous.get(key)
+        embeddings.append(cached[1] if cached is not None and cached[0] == fingerprint else None)
+    updates_df['embedding'] = embeddings
+    
+    stats = {'reused': sum(e is not None for e in embeddings), 'embedded': 0, 'failed': 0}
+    missing = updates_df.index[[e is None for e in embeddings]]
+    if len(missing) > 0:
+        if not api_key:
+            raise ValueError("OpenAI API key is required for generating embeddings")
+        store = EmbeddingStore(cache_file) if use_cache else None
+        failed_indices = _embed_rows(updates_df, missing, api_key, model, store, **options)
+        stats['failed'] = len(failed_indices)
+        stats['embedded'] = len(missing) - len(failed_indices)
+        stats['failed_keys'] = [updates_df.at[idx, 'key'] for idx in failed_indices]
+        
+        # Keep serving the old vector for movies that could not be re-embedded
+        for idx in failed_indices:
+            cached = previous.get(updates_df.at[idx, 'key'])
+            if cached is not None:
+                updates_df.at[idx, 'embedding'] = cached[1]
+                updates_df.at[idx, 'fingerprint'] = cached[0]
+    
+    updates_df = updates_df.dropna(subset=['embedding'])
+    return updates_df, stats
+
+
+# Process-wide query embedding cache; replaced by configure_query_cache()
+_query_cache = QueryEmbeddingCache()
+
+def configure_query_cache(maxsize=1024, disk_path=None, disk_max_entries=50000):
+    """Set up the query embedding cache (memory LRU plus optional SQLite disk tier)"""
+    global _query_cache
+    _query_cache = QueryEmbeddingCache(maxsize=maxsize, disk_path=disk_path, disk_max_entries=disk_max_entries)
+    return _query_cache
+
+def get_query_cache_stats():
+    """Hit/miss counters for the query embedding cache"""
+    return _query_cache.stats()
 
 def generate_query_embedding(query_text, api_key, model="text-embedding-ada-002"):
-    """Generate embedding for a query string using the latest OpenAI API"""
-    from openai import OpenAI
+    """Generate embedding for a query string using the latest OpenAI API
+
+    Repeat queries (after normalization) are answered from the query embedding
+    cache without calling the API.
+    """
+    return generate_query_embeddings([query_text], api_key, model=model)[0]
+
+def generate_query_embeddings(query_texts, api_key, model="text-embedding-ada-002"):
+    """Embed several query strings with at most one API request
+
+    Cached queries are answered from the query embedding cache, and the
+    remaining distinct ones (after normalization) go out together as a single
+    embeddings request. Returns one vector per query, in order, with None for
+    queries that could not be embedded.
+    """
+    embeddings = [None] * len(query_texts)
+    missing = {}
+    for position, query_text in enumerate(query_texts):
+        cached = _query_cache.get(query_text, model)
+        if cached is not None:
+            logger.info(f"Query embedding cache hit for: {query_text}")
+            embeddings[position] = cached.tolist()
+        else:
+            missing.setdefault(normalize_query(query_text), []).append(position)
+    if not missing:
+        return embeddings
     
     if not api_key:
         raise ValueError("OpenAI API key is required for generating embeddings")
     
-    logger.info(f"Generating embedding for query: {query_text}")
+    texts = [query_texts[positions[0]] for positions in missing.values()]
+    logger.info(f"Generating embeddings for {len(texts)} queries: {texts}")
     
     try:
-        # Create a custom httpx client without proxies
-        http_client = httpx.Client(
-            timeout=60.0,
-            follow_redirects=True
-        )
-        
-        # Initialize OpenAI client with the custom httpx client
-        client = OpenAI(
-            api_key=api_key,
-            http_client=http_client
-        )
+        # Reuse the process-wide pooled client so repeat queries skip the TLS handshake
+        client = get_openai_client(api_key)
         
         response = client.embeddings.create(
-            input=query_text,
+            input=texts,
             model=model
         )
         
-        embedding = response.data[0].embedding
-        logger.info("Successfully generated query embedding")
-        return embedding
+        for item, text, positions in zip(sorted(response.data, key=lambda d: d.index), texts, missing.values()):
+            # Store as float32, like the movie vectors, so hits and misses return identical values
+            embedding = np.asarray(item.embedding, dtype=np.float32)
+            _query_cache.put(text, model, embedding)
+            for position in positions:
+                embeddings[position] = embedding.tolist()
+        logger.info("Successfully generated query embeddings")
             
     except Exception as e:
-        logger.error(f"Error generating query embedding: {str(e)}")
-        return None
+        logger.error(f"Error generating query embeddings: {str(e)}")
+    return embeddings
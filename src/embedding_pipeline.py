@@ -0,0 +1,230 @@
+import time
+import random
+import logging
+import threading
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Conservative characters-per-token ratio: English averages about four, so
+# estimating with three keeps packed requests under the provider's limits
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text):
+    """Conservative token estimate for a text, without needing a tokenizer"""
+    return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+def truncate_to_tokens(text, max_tokens):
+    """Deterministically cut a text to fit ``max_tokens``, preferring a word boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens * CHARS_PER_TOKEN
+    cut = text[:limit]
+    boundary = cut.rfind(' ')
+    if boundary > limit // 2:
+        cut = cut[:boundary]
+    return cut.rstrip()
+
+def pack_batches(texts, max_request_tokens, max_items):
+    """Greedily pack texts, in order, into batches bounded by estimated tokens and count
+
+    Returns a list of batches, each a list of positions into ``texts``.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_request_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_reset(value):
+    """Parse OpenAI reset headers such as '1s', '250ms' or '6m0s' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        amount = float(amount)
+        seconds += {'ms': amount / 1000.0, 's': amount, 'm': amount * 60, 'h': amount * 3600}[unit]
+    return seconds
+
+class RateLimiter:
+    """Shared request/token budget for concurrent embedding calls
+
+    Starts from the configured per-minute quotas, then follows the
+    ``x-ratelimit-*`` headers the API returns. A 429 pauses every worker until
+    the advertised reset and halves the number of requests allowed in flight;
+    successful calls grow it back one step at a time.
+    """
+
+    def __init__(self, requests_per_minute=3000, tokens_per_minute=1000000, max_in_flight=4):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max(1, max_in_flight)
+        self.allowed_in_flight = self.max_in_flight
+        self.in_flight = 0
+        self.remaining_requests = requests_per_minute
+        self.remaining_tokens = tokens_per_minute
+        self.window_reset_at = time.monotonic() + 60.0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens):
+        """Block until a request of roughly ``tokens`` tokens fits in the budget"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now >= self.window_reset_at:
+                    self.remaining_requests = self.requests_per_minute
+                    self.remaining_tokens = self.tokens_per_minute
+                    self.window_reset_at = now + 60.0
+
+                wait = 0.0
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.remaining_requests < 1 or (
+                        self.remaining_tokens < tokens and self.remaining_tokens < self.tokens_per_minute):
+                    # An oversized request still goes through once the window is fresh
+                    wait = max(self.window_reset_at - now, 0.05)
+                elif self.in_flight >= self.allowed_in_flight:
+                    wait = None
+                else:
+                    self.in_flight += 1
+                    self.remaining_requests -= 1
+                    self.remaining_tokens -= tokens
+                    return
+
+                self._condition.wait(timeout=wait)
+
+    def release(self, headers=None, success=True):
+        """Return a slot and update the budget from rate-limit response headers"""
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            if headers is not None:
+                self._update_from_headers(headers)
+            if success and self.allowed_in_flight < self.max_in_flight:
+                self.allowed_in_flight += 1
+            self._condition.notify_all()
+
+    def throttle(self, retry_after=None, headers=None):
+        """Record a 429: pause all workers and shrink concurrency"""
+        with self._condition:
+            if headers is not None:
+                self._update_from_headers(headers)
+            delay = retry_after if retry_after is not None else 1.0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.allowed_in_flight = max(1, self.allowed_in_flight // 2)
+            logger.warning(f"Rate limited, pausing embedding requests for {delay:.2f}s "
+                           f"(concurrency now {self.allowed_in_flight})")
+            self._condition.notify_all()
+
+    def _update_from_headers(self, headers):
+        now = time.monotonic()
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        limit_requests = headers.get('x-ratelimit-limit-requests')
+        limit_tokens = headers.get('x-ratelimit-limit-tokens')
+        reset_requests = _parse_reset(headers.get('x-ratelimit-reset-requests'))
+        reset_tokens = _parse_reset(headers.get('x-ratelimit-reset-tokens'))
+
+        if limit_requests and limit_requests.isdigit():
+            self.requests_per_minute = int(limit_requests)
+        if limit_tokens and limit_tokens.isdigit():
+            self.tokens_per_minute = int(limit_tokens)
+        if remaining_requests and remaining_requests.isdigit():
+            self.remaining_requests = int(remaining_requests)
+        if remaining_tokens and remaining_tokens.isdigit():
+            self.remaining_tokens = int(remaining_tokens)
+
+        resets = [r for r in (reset_requests, reset_tokens) if r is not None]
+        if resets:
+            self.window_reset_at = now + max(resets)
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None, None
+    headers = response.headers
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return float(retry_after), headers
+        except ValueError:
+            pass
+    return _parse_reset(headers.get('x-ratelimit-reset-requests') or headers.get('x-ratelimit-reset-tokens')), headers
+
+def _embed_with_retries(client, texts, model, limiter, max_retries, base_delay=1.0):
+    """Embed one batch, retrying rate-limit and transient failures with backoff"""
+    import openai
+
+    tokens = sum(estimate_tokens(t) for t in texts)
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        try:
+            raw = client.embeddings.with_raw_response.create(input=texts, model=model)
+            response = raw.parse()
+        except openai.RateLimitError as e:
+            retry_after, headers = _retry_after(e)
+            limiter.release(success=False)
+            limiter.throttle(retry_after, headers)
+            error = e
+        except (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+            limiter.release(success=False)
+            error = e
+        except Exception:
+            limiter.release(success=False)
+            raise
+        else:
+            limiter.release(headers=raw.headers)
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+        attempt += 1
+        if attempt > max_retries:
+            raise error
+        delay = min(60.0, base_delay * (2 ** (attempt - 1))) * (0.5 + random.random() / 2)
+        logger.info(f"Retrying embedding batch in {delay:.2f}s (attempt {attempt}/{max_retries}): {error}")
+        time.sleep(delay)
+
+def embed_batches(client, batches, model, on_batch_done, max_workers=4, max_retries=6,
+                  requests_per_minute=3000, tokens_per_minute=1000000):
+    """Embed batches of texts concurrently
+
+    ``batches`` is a list of ``(batch_id, texts)``. ``on_batch_done(batch_id, vectors)``
+    is called from the calling thread as each batch finishes, so callers can
+    checkpoint completed work without locking. Returns the ids of batches that
+    still failed after all retries.
+    """
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute, max_in_flight=max_workers)
+    failed = []
+    # Retries are handled here, with the shared budget, rather than by the client
+    client = client.with_options(max_retries=0)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_embed_with_retries, client, texts, model, limiter, max_retries): batch_id
+            for batch_id, texts in batches
+        }
+        for future in as_completed(futures):
+            batch_id = futures[future]
+            try:
+                vectors = future.result()
+            except Exception as e:
+                logger.error(f"Embedding batch {batch_id} failed after retries: {str(e)}")
+                failed.append(batch_id)
+                continue
+            on_batch_done(batch_id, vectors)
+
+    return failed
@@ -0,0 +1,231 @@
+import numpy as np
+import os
+import json
+import glob
+import pickle
+import logging
+import uuid
+import threading
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+def unit_rows(matrix):
+    """``matrix`` with its nonzero rows scaled to unit length
+
+    Returns ``matrix`` itself (memory-mapped or not) when the rows already are,
+    so normalized vectors are never copied again.
+    """
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1)
+    if np.allclose(norms[norms > 0], 1.0, atol=1e-4):
+        return matrix
+    norms[norms == 0] = 1.0
+    return (matrix / norms[:, None]).astype(np.float32, copy=False)
+
+class EmbeddingStore:
+    """On-disk embedding cache: a memory-mapped float32 matrix plus a key->row index.
+
+    The index lives in ``<base>.json`` and names the matrix file it belongs to
+    (``<base>.<generation>.npy``). Saves write a fresh matrix generation and then
+    atomically replace the index, so readers never observe a half-written cache
+    and processes that still map an older generation keep working.
+
+    Batches finished between full saves are appended to ``<base>.journal`` and
+    folded back in on load, so a crash mid-run keeps the completed work.
+    """
+
+    def __init__(self, file_path):
+        base, ext = os.path.splitext(file_path)
+        if ext not in ('.pkl', '.npy', '.json'):
+            base = file_path
+        self.base_path = base
+        self.index_path = base + '.json'
+        self.legacy_path = base + '.pkl'
+        self.journal_path = base + '.journal'
+        self._journal_lock = threading.Lock()
+
+    def exists(self):
+        return any(os.path.exists(p) for p in (self.index_path, self.legacy_path, self.journal_path))
+
+    def save(self, keys, embeddings, fingerprints=None, model=None):
+        """Write keys, their unit-normalized embeddings and content fingerprints as a new cache generation"""
+        keys = [str(k) for k in keys]
+        if fingerprints is not None and len(fingerprints) != len(keys):
+            raise ValueError(f"Expected {len(keys)} fingerprints, got {len(fingerprints)}")
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(keys):
+            if len(keys) == 0:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            else:
+                raise ValueError(f"Expected a ({len(keys)}, dim) matrix, got shape {matrix.shape}")
+        matrix = unit_rows(matrix)
+
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(directory, exist_ok=True)
+
+        generation = uuid.uuid4().hex[:12]
+        matrix_path = f"{self.base_path}.{generation}.npy"
+        np.save(matrix_path, matrix)
+
+        index = {
+            'version': FORMAT_VERSION,
+            'matrix_file': os.path.basename(matrix_path),
+            'rows': int(matrix.shape[0]),
+            'dim': int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            'dtype': 'float32',
+            'model': model,
+            'keys': keys,
+            'fingerprints': list(fingerprints) if fingerprints is not None else None,
+        }
+        tmp_path = f"{self.index_path}.{generation}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+        self._remove_stale_generations(keep=matrix_path)
+        # Everything in the journal is now part of the saved generation
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        return matrix_path
+
+    def append_checkpoint(self, keys, embeddings, fingerprints):
+        """Durably append a finished batch to the journal"""
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        header = json.dumps({
+            'keys': [str(k) for k in keys],
+            'fingerprints': list(fingerprints),
+            'rows': int(matrix.shape[0]),
+            'dim': int(matrix.shape[1]),
+        }, separators=(',', ':'))
+
+        with self._journal_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+            with open(self.journal_path, 'ab') as f:
+                f.write(header.encode('utf-8') + b'\n')
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self):
+        """Memory-map the cached matrix, migrating a legacy pickle cache if needed"""
+        if not os.path.exists(self.index_path) and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+
+        cache_data = self._load_index() if os.path.exists(self.index_path) else None
+        journal = self._read_journal()
+        if journal:
+            cache_data = self._apply_journal(cache_data, journal)
+        return cache_data
+
+    def _load_index(self):
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+
+        if index.get('version') != FORMAT_VERSION:
+            logger.warning(f"Unsupported embedding cache version {index.get('version')} at {self.index_path}")
+            return None
+
+        keys = index['keys']
+        matrix_path = os.path.join(os.path.dirname(os.path.abspath(self.index_path)), index['matrix_file'])
+        if index['rows'] == 0:
+            matrix = np.zeros((0, index['dim']), dtype=np.float32)
+        else:
+            matrix = np.load(matrix_path, mmap_mode='r')
+
+        if matrix.shape[0] != len(keys) or matrix.shape[0] != index['rows']:
+            logger.warning(f"Embedding cache at {self.index_path} is inconsistent, ignoring it")
+            return None
+
+        return {
+            'movie_keys': keys,
+            'embeddings': matrix,
+            'key_to_row': {key: row for row, key in enumerate(keys)},
+            'fingerprints': index.get('fingerprints'),
+            'model': index.get('model'),
+        }
+
+    def _read_journal(self):
+        """Read complete journal records, ignoring a torn trailing write"""
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, 'rb') as f:
+            while True:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    header = json.loads(line)
+                except ValueError:
+                    break
+                nbytes = header['rows'] * header['dim'] * 4
+                payload = f.read(nbytes)
+                if len(payload) < nbytes:
+                    break
+                matrix = np.frombuffer(payload, dtype=np.float32).reshape(header['rows'], header['dim'])
+                records.append((header['keys'], header['fingerprints'], matrix))
+        return records
+
+    def _apply_journal(self, cache_data, journal):
+        """Overlay checkpointed batches on top of the saved matrix"""
+        dim = journal[0][2].shape[1]
+        if cache_data and len(cache_data['movie_keys']) and cache_data['embeddings'].shape[1] == dim:
+            keys = list(cache_data['movie_keys'])
+            fingerprints = list(cache_data['fingerprints'] or [None] * len(keys))
+            rows = [np.asarray(cache_data['embeddings'])]
+            model = cache_data['model']
+        else:
+            keys, fingerprints, rows, model = [], [], [], None
+
+        key_to_row = {key: row for row, key in enumerate(keys)}
+        matrix = np.vstack(rows + [m for _, _, m in journal])
+        keep = np.ones(len(matrix), dtype=bool)
+        offset = len(keys)
+        for batch_keys, batch_fingerprints, batch_matrix in journal:
+            for i, (key, fingerprint) in enumerate(zip(batch_keys, batch_fingerprints)):
+                if key in key_to_row:
+                    keep[key_to_row[key]] = False
+                key_to_row[key] = offset + i
+                keys.append(key)
+                fingerprints.append(fingerprint)
+            offset += len(batch_keys)
+
+        keys = [k for k, kept in zip(keys, keep) if kept]
+        fingerprints = [fp for fp, kept in zip(fingerprints, keep) if kept]
+        matrix = matrix[keep]
+        logger.info(f"Recovered {sum(len(k) for k, _, _ in journal)} checkpointed embeddings from {self.journal_path}")
+        return {
+            'movie_keys': keys,
+            'embeddings': matrix,
+            'key_to_row': {key: row for row, key in enumerate(keys)},
+            'fingerprints': fingerprints,
+            'model': model,
+            'journaled': True,
+        }
+
+    def _migrate_legacy(self):
+        """Convert a pickled cache of Python float lists into the binary format"""
+        logger.info(f"Migrating legacy pickle embedding cache {self.legacy_path}")
+        with open(self.legacy_path, 'rb') as f:
+            cache_data = pickle.load(f)
+
+        keys = cache_data['movie_keys']
+        embeddings = cache_data['embeddings']
+        matrix = np.asarray(embeddings, dtype=np.float32) if len(embeddings) else np.zeros((0, 0), dtype=np.float32)
+        self.save(keys, matrix)
+
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        logger.info(f"Migrated {len(keys)} cached embeddings to {self.index_path}")
+
+    def _remove_stale_generations(self, keep):
+        keep = os.path.abspath(keep)
+        for path in glob.glob(glob.escape(self.base_path) + '.*.npy'):
+            if os.path.abspath(path) != keep:
+                try:
+                    # Processes that still map the old file keep their pages until they release it
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove stale embedding matrix {path}: {e}")
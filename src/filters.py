@@ -0,0 +1,183 @@
+import re
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Structured search filters are plain dicts with any of these keys. Durations
+# are in minutes, ratings on Plex's 0-10 scale, and a movie must carry every
+# listed genre.
+FILTER_KEYS = ('year_min', 'year_max', 'genres', 'duration_min', 'duration_max', 'rating_min')
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'an': 1, 'a': 1, 'half an': 0.5,
+}
+
+DECADE_WORDS = {
+    'twenties': 1920, 'thirties': 1930, 'forties': 1940, 'fifties': 1950,
+    'sixties': 1960, 'seventies': 1970, 'eighties': 1980, 'nineties': 1990,
+}
+
+def parse_filters(raw):
+    """Validate filters from an API request into a filter dict, or None when empty"""
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+    unknown = set(raw) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    filters = {}
+    for key in ('year_min', 'year_max', 'duration_min', 'duration_max'):
+        if raw.get(key) is not None:
+            try:
+                filters[key] = int(raw[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be an integer")
+    if raw.get('rating_min') is not None:
+        try:
+            filters['rating_min'] = float(raw['rating_min'])
+        except (TypeError, ValueError):
+            raise ValueError("rating_min must be a number")
+    if raw.get('genres'):
+        genres = raw['genres']
+        if isinstance(genres, str):
+            genres = [genres]
+        if not isinstance(genres, list) or not all(isinstance(g, str) for g in genres):
+            raise ValueError("genres must be a list of strings")
+        filters['genres'] = genres
+    return filters or None
+
+def merge_filters(*filter_dicts):
+    """Combine filter dicts; later ones win key by key"""
+    merged = {}
+    for filters in filter_dicts:
+        if filters:
+            merged.update(filters)
+    return merged or None
+
+# A genre right after one of these (give or take an article) is excluded, not wanted
+NEGATION_PATTERN = re.compile(
+    r"\b(?:not|no|never|except|excluding|without|besides|other than|anything but|everything but|all but)"
+    r"\s+(?:(?:a|an|the|any|more|too|much|many|really|very|so)\s+){0,2}$"
+)
+
+# Genre names that are also everyday words ("a short comedy", "great music").
+# These only filter when used as a genre: "<genre> movie/film" or "the <genre> genre".
+AMBIGUOUS_GENRES = {'short', 'music', 'family', 'history', 'news', 'sport'}
+GENRE_USAGE_PATTERN = re.compile(r"\s+(?:movies?|films?|flicks?|genre)\b")
+
+# A genre word in a compound adjective ("action-packed", "family-friendly") describes, not filters
+COMPOUND_PATTERN = re.compile(r"-(?:packed|friendly|free|filled|heavy|laden|themed|ish|like)\b")
+
+def _duration_minutes(match):
+    amount, unit, half = match.groups()
+    amount = float(NUMBER_WORDS.get(amount, amount))
+    if half:
+        amount += 0.5
+    return int(round(amount * (60 if unit.startswith('h') else 1)))
+
+def extract_filters(text, genre_vocabulary=()):
+    """Pull structured filters out of a free-text request
+
+    Recognizes decades ("90s", "the nineties", "1980s"), years ("from 1995",
+    "after 2010", "before 2000"), durations ("under two hours", "less than 90
+    minutes") and ratings ("rated 7 or higher"), plus any genre in
+    ``genre_vocabulary`` that is named in the text. Genres in
+    ``AMBIGUOUS_GENRES`` only count when used as one ("a music film"); otherwise
+    the word is left to the semantic search. Returns None when nothing was found.
+    """
+    lowered = text.lower()
+    filters = {}
+
+    decade = re.search(r"\b(?:19|20)?(\d)0'?s\b", lowered)
+    if decade:
+        digits = re.search(r"\b((?:19|20)\d0)'?s\b", lowered)
+        if digits:
+            start = int(digits.group(1))
+        else:
+            tens = int(decade.group(1))
+            start = (1900 if tens >= 2 else 2000) + tens * 10
+        filters['year_min'], filters['year_max'] = start, start + 9
+    else:
+        for word, start in DECADE_WORDS.items():
+            if re.search(rf"\b{word}\b", lowered):
+                filters['year_min'], filters['year_max'] = start, start + 9
+                break
+
+    for match in re.finditer(r"\b(from|in|after|since|before|until|pre|post)[\s-]+((?:19|20)\d\d)\b", lowered):
+        word, year = match.group(1), int(match.group(2))
+        if word in ('from', 'in'):
+            filters['year_min'], filters['year_max'] = year, year
+        elif word in ('after', 'post'):
+            filters['year_min'] = year + 1
+        elif word == 'since':
+            filters['year_min'] = year
+        else:
+            filters['year_max'] = year - 1
+
+    amount = r"(\d+(?:\.\d+)?|one|two|three|four|five|half an|an|a)"
+    unit = r"(hours?|hrs?|minutes?|mins?)(\s+and\s+a\s+half)?"
+    shorter = re.search(rf"\b(?:under|less than|shorter than|at most|no more than|max(?:imum)?)\s+{amount}\s+{unit}", lowered)
+    if shorter:
+        filters['duration_max'] = _duration_minutes(shorter)
+    longer = re.search(rf"\b(?:over|more than|longer than|at least)\s+{amount}\s+{unit}", lowered)
+    if longer:
+        filters['duration_min'] = _duration_minutes(longer)
+
+    rating = re.search(r"\brated\s+(?:at least\s+|above\s+|over\s+)?(\d+(?:\.\d+)?)", lowered)
+    if rating:
+        filters['rating_min'] = float(rating.group(1))
+
+    mentions = []
+    for genre in genre_vocabulary:
+        name = genre.lower()
+        stem = name[:-1] + 'ies' if name.endswith('y') else name + 's'
+        for match in re.finditer(rf"\b(?:{re.escape(name)}|{re.escape(stem)})\b", lowered):
+            if COMPOUND_PATTERN.match(lowered, match.end()):
+                continue
+            if name in AMBIGUOUS_GENRES and not (
+                GENRE_USAGE_PATTERN.match(lowered, match.end())
+                or re.search(r"\bgenres?:?\s+(?:of\s+)?$", lowered[:match.start()])
+            ):
+                continue
+            if not NEGATION_PATTERN.search(lowered[:match.start()]):
+                mentions.append((match.start(), match.end(), genre))
+                break
+    mentions.sort()
+    either = any(
+        re.search(r"\b(?:or|either)\b", lowered[end:start])
+        for (_, end, _), (start, _, _) in zip(mentions, mentions[1:])
+    )
+    if mentions and not either:
+        filters['genres'] = [genre for _, _, genre in mentions]
+
+    if filters:
+        logger.info(f"Extracted search filters: {filters}")
+    return filters or None
+
+def evaluate_filters(columns, filters):
+    """Boolean mask of the rows passing ``filters``
+
+    ``columns`` holds aligned ``year``, ``duration`` (minutes) and ``rating``
+    arrays, with 0 for missing values, and ``genres``, a dict of lowercased
+    genre name to boolean row mask.
+    """
+    mask = np.ones(len(columns['year']), dtype=bool)
+    # Missing years and durations are stored as 0 and never pass a range filter
+    for field, low, high in (('year', 'year_min', 'year_max'), ('duration', 'duration_min', 'duration_max')):
+        values = columns[field]
+        if filters.get(low) is not None:
+            mask &= values >= filters[low]
+        if filters.get(high) is not None:
+            mask &= (values <= filters[high]) & (values > 0)
+    if filters.get('rating_min') is not None:
+        mask &= columns['rating'] >= filters['rating_min']
+    for genre in filters.get('genres') or ():
+        genre_mask = columns['genres'].get(genre.lower())
+        if genre_mask is None:
+            return np.zeros_like(mask)
+        mask &= genre_mask
+    return mask
@@ -0,0 +1,120 @@
+import httpx
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Pool settings used when the shared client is first built; override with configure_http_clients()
+_settings = {
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 60.0,
+    'timeout': 60.0,
+    'connect_timeout': 10.0,
+}
+
+_lock = threading.Lock()
+_http_client = None
+_transport = None
+_sdk_clients = {}
+
+class _CountingTransport(httpx.HTTPTransport):
+    """HTTP transport that counts requests and the pooled connections they open"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._stats_lock = threading.Lock()
+        self._seen_connections = weakref.WeakSet()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        with self._stats_lock:
+            self.requests += 1
+            for connection in list(getattr(self._pool, 'connections', [])):
+                if connection not in self._seen_connections:
+                    self._seen_connections.add(connection)
+                    self.connections_opened += 1
+        return response
+
+    def open_connections(self):
+        return len(getattr(self._pool, 'connections', []))
+
+def configure_http_clients(max_connections=None, max_keepalive_connections=None, keepalive_expiry=None,
+                           timeout=None, connect_timeout=None):
+    """Set pool limits and timeouts; takes effect for clients built after the call"""
+    global _http_client, _transport
+    updates = {
+        'max_connections': max_connections,
+        'max_keepalive_connections': max_keepalive_connections,
+        'keepalive_expiry': keepalive_expiry,
+        'timeout': timeout,
+        'connect_timeout': connect_timeout,
+    }
+    with _lock:
+        _settings.update({k: v for k, v in updates.items() if v is not None})
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _transport = None
+        _sdk_clients.clear()
+
+def get_http_client():
+    """Return the process-wide keep-alive httpx client shared by every API client"""
+    global _http_client, _transport
+    with _lock:
+        if _http_client is None:
+            limits = httpx.Limits(
+                max_connections=_settings['max_connections'],
+                max_keepalive_connections=_settings['max_keepalive_connections'],
+                keepalive_expiry=_settings['keepalive_expiry']
+            )
+            _transport = _CountingTransport(limits=limits)
+            _http_client = httpx.Client(
+                transport=_transport,
+                timeout=httpx.Timeout(_settings['timeout'], connect=_settings['connect_timeout']),
+                follow_redirects=True
+            )
+            logger.info(f"Created shared HTTP client (max {_settings['max_connections']} connections, "
+                        f"{_settings['max_keepalive_connections']} keep-alive)")
+        return _http_client
+
+def get_openai_client(api_key):
+    """Return a cached OpenAI client for ``api_key`` backed by the shared connection pool"""
+    from openai import OpenAI
+    return _get_sdk_client('openai', api_key, lambda http_client: OpenAI(api_key=api_key, http_client=http_client))
+
+def get_anthropic_client(api_key):
+    """Return a cached Anthropic client for ``api_key`` backed by the shared connection pool"""
+    from anthropic import Anthropic
+    return _get_sdk_client('anthropic', api_key, lambda http_client: Anthropic(api_key=api_key, http_client=http_client))
+
+def _get_sdk_client(provider, api_key, factory):
+    http_client = get_http_client()
+    with _lock:
+        client = _sdk_clients.get((provider, api_key))
+        if client is None:
+            client = factory(http_client)
+            _sdk_clients[(provider, api_key)] = client
+        return client
+
+def get_connection_stats():
+    """Report how many requests reused a pooled connection instead of opening a new one"""
+    with _lock:
+        transport = _transport
+    if transport is None:
+        return {'requests': 0, 'connections_opened': 0, 'reused_requests': 0,
+                'reuse_ratio': 0.0, 'open_connections': 0}
+    with transport._stats_lock:
+        requests = transport.requests
+        opened = transport.connections_opened
+    reused = max(0, requests - opened)
+    return {
+        'requests': requests,
+        'connections_opened': opened,
+        'reused_requests': reused,
+        'reuse_ratio': round(reused / requests, 4) if requests else 0.0,
+        'open_connections': transport.open_connections(),
+    }
@@ -0,0 +1,210 @@
+import re
+import logging
+import threading
+from src.filters import DECADE_WORDS
+from src.lexical import TOKEN_PATTERN
+
+logger = logging.getLogger(__name__)
+
+PLAY_PATTERN = re.compile(r"\b(?:play|watch|start|put on)\b")
+
+ORDINAL_WORDS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+    'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10,
+}
+CARDINAL_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+}
+
+# "the third one", "#2", "number 4", "no. 5", "the 2nd", a bare "2" or "the last one"
+ORDINAL_PATTERN = re.compile(
+    rf"\b({'|'.join(ORDINAL_WORDS)}|last)\b"
+    rf"|(?:#\s*|\bnumber\s+|\bno\.\s*)({'|'.join(CARDINAL_WORDS)}|\d{{1,2}})\b"
+    r"|(?<![\w#])(\d{1,2})(?:st|nd|rd|th)?\b(?!\s*(?:s\b|'s|min|hour))"
+)
+
+# Words that carry no search intent of their own in short requests. Qualifiers
+# ("good", "classic", "new") and "or" do change the request, so they send it to the LLM.
+FILLER_WORDS = frozenset("""
+a an the some any something anything i i'm im i'd id want wanna would like to watch see show me us give find get
+recommend suggest movie movies film films flick flicks please tonight
+with starring featuring by directed from of in for and maybe can you let's lets what about how play
+""".split())
+
+GENRE_ALIASES = {
+    'sci fi': 'science fiction', 'scifi': 'science fiction',
+    'romcom': 'romance', 'rom com': 'romance',
+}
+
+MAX_NAME_TOKENS = 4
+
+# Outcome counters for IntentClassifier.classify, reported by get_intent_stats()
+_intent_stats = {'play': 0, 'search': 0, 'llm': 0}
+_intent_lock = threading.Lock()
+
+def get_intent_stats():
+    """How many requests the local classifier answered without the LLM"""
+    with _intent_lock:
+        stats = dict(_intent_stats)
+    total = sum(stats.values())
+    stats['hit_rate'] = round((stats['play'] + stats['search']) / total, 4) if total else 0.0
+    return stats
+
+def _record(outcome):
+    with _intent_lock:
+        _intent_stats[outcome] += 1
+
+def _name_key(name):
+    return tuple(TOKEN_PATTERN.findall(name.lower()))
+
+def _decade_start(token):
+    """First year of a decade token such as "90s", "1980s", "80's" or "nineties", or None"""
+    if token in DECADE_WORDS:
+        return DECADE_WORDS[token]
+    match = re.fullmatch(r"((?:19|20)?\d)0'?s", token)
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 3:
+        return int(digits) * 10
+    tens = int(digits)
+    return (1900 if tens >= 2 else 2000) + tens * 10
+
+def match_play_command(text, recommendations):
+    """The recommendation a play request refers to, or None
+
+    A request counts when it asks to play or watch something and names one
+    of the ``recommendations`` by title or by position ("the second one",
+    "#3", "play 2", "the last one"). Titles are checked first, longest first,
+    so "play First Blood" isn't read as "play the first one".
+    """
+    lowered = text.lower()
+    if not recommendations or not PLAY_PATTERN.search(lowered):
+        return None
+
+    for movie in sorted(recommendations, key=lambda movie: -len(movie['title'])):
+        title = movie['title'].lower()
+        if title and re.search(rf"(?<!\w){re.escape(title)}(?!\w)", lowered):
+            return movie
+
+    for match in ORDINAL_PATTERN.finditer(lowered):
+        word, counted, digits = match.groups()
+        if word == 'last':
+            return recommendations[-1]
+        position = ORDINAL_WORDS.get(word) or CARDINAL_WORDS.get(counted) or int(counted or digits)
+        if 1 <= position <= len(recommendations):
+            return recommendations[position - 1]
+    return None
+
+class IntentClassifier:
+    """Recognizes requests simple enough to skip the LLM interpretation
+
+    Play commands for earlier recommendations, and requests made up only of
+    genres, people and decades from the catalog's own vocabulary plus filler
+    words ("horror", "something with Tom Hanks", "90s comedies"), are
+    answered locally. Anything else returns None and goes to the LLM.
+    """
+
+    def __init__(self, genres, directors, actors):
+        self.genres = {}
+        for genre in genres:
+            key = _name_key(genre)
+            if not key:
+                continue
+            self.genres.setdefault(key, genre)
+            # Plural forms: "comedies", "thrillers"
+            last = key[-1]
+            plural = last[:-1] + 'ies' if last.endswith('y') else last + 's'
+            self.genres.setdefault(key[:-1] + (plural,), genre)
+        for alias, name in GENRE_ALIASES.items():
+            genre = self.genres.get(_name_key(name))
+            if genre is not None:
+                self.genres.setdefault(_name_key(alias), genre)
+
+        self.people = {}
+        for role, names in (('director', directors), ('actor', actors)):
+            for name in names:
+                key = _name_key(name)
+                # One-word names that are also filler ("will", "good") would match too much
+                if key and not (len(key) == 1 and key[0] in FILLER_WORDS):
+                    self.people.setdefault(key, (name, role))
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        return cls(
+            catalog.tags['genres'].vocabulary,
+            catalog.tags['directors'].vocabulary,
+            catalog.tags['actors'].vocabulary
+        )
+
+    def classify(self, text, recommendations=(), record=True):
+        """Classify one message
+
+        Returns ``{'intent': 'play', 'movie': ...}`` for a play command,
+        ``{'intent': 'search', 'kind': ..., 'query': ...}`` for a plain
+        genre/person/decade request, with a query phrased like the movie
+        text representations, or None when the LLM should interpret it.
+        Pass ``record=False`` to leave the chat hit-rate counters alone.
+        """
+        movie = match_play_command(text, recommendations)
+        if movie is not None:
+            if record:
+                _record('play')
+            return {'intent': 'play', 'movie': movie}
+
+        result = self._match_search(text)
+        if record:
+            _record('search' if result is not None else 'llm')
+        if result is not None:
+            logger.info(f"Fast path {result['kind']} request: {result['query']}")
+        return result
+
+    def _match_search(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        genres, directors, actors, decades = [], [], [], []
+        i = 0
+        while i < len(tokens):
+            matched = self._match_name(tokens, i, self.genres, MAX_NAME_TOKENS)
+            if matched:
+                genres.append(matched[0])
+                i = matched[1]
+                continue
+            matched = self._match_name(tokens, i, self.people, MAX_NAME_TOKENS)
+            if matched:
+                name, role = matched[0]
+                (directors if role == 'director' else actors).append(name)
+                i = matched[1]
+                continue
+            decade = _decade_start(tokens[i])
+            if decade is not None:
+                decades.append(decade)
+            elif tokens[i] not in FILLER_WORDS:
+                return None
+            i += 1
+
+        if len(decades) > 1 or not (genres or directors or actors or decades):
+            return None
+
+        parts = []
+        if genres:
+            parts.append(f"{', '.join(genres)} movies")
+        else:
+            parts.append("Movies")
+        if directors:
+            parts.append(f"directed by {', '.join(directors)}")
+        if actors:
+            parts.append(f"starring {', '.join(actors)}")
+        if decades:
+            parts.append(f"from the {decades[0]}s")
+        kinds = [kind for kind, found in (('genre', genres), ('person', directors or actors), ('decade', decades)) if found]
+        return {'intent': 'search', 'kind': '+'.join(kinds), 'query': ' '.join(parts)}
+
+    @staticmethod
+    def _match_name(tokens, start, names, max_tokens):
+        """Longest entry of ``names`` starting at ``tokens[start]``, as ``(value, end)``"""
+        for length in range(min(max_tokens, len(tokens) - start), 0, -1):
+            value = names.get(tuple(tokens[start:start + length]))
+            if value is not None:
+                return value, start + length
+        return None
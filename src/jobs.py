@@ -0,0 +1,105 @@
+import time
+import uuid
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+class BackgroundJob:
+    """Runs ``target(job)`` on a daemon thread and records its progress by phase
+
+    The target reports progress through callbacks from ``job.phase(name)``,
+    which take the cumulative ``(done, total)`` for that phase. ``to_dict``
+    returns a consistent view for status endpoints, including each phase's
+    elapsed time and throughput.
+    """
+
+    def __init__(self, name, target):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.target = target
+        self.status = 'pending'
+        self.phase_name = None
+        self.phases = []
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def is_running(self):
+        return self.status in ('pending', 'running')
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def phase(self, name, total=None):
+        """Enter a new phase and return its ``progress(done, total)`` callback"""
+        now = time.time()
+        entry = {'name': name, 'done': 0, 'total': total, 'started_at': now, 'finished_at': None}
+        with self._lock:
+            if self.phases and self.phases[-1]['finished_at'] is None:
+                self.phases[-1]['finished_at'] = now
+            self.phases.append(entry)
+            self.phase_name = name
+        logger.info(f"Job {self.name} ({self.id}): {name}")
+
+        def progress(done, total=None):
+            with self._lock:
+                entry['done'] = done
+                if total is not None:
+                    entry['total'] = total
+        return progress
+
+    def _run(self):
+        with self._lock:
+            self.status = 'running'
+            self.started_at = time.time()
+        try:
+            result = self.target(self)
+            with self._lock:
+                self.result = result
+                self.status = 'succeeded'
+        except Exception as e:
+            logger.error(f"Job {self.name} ({self.id}) failed: {str(e)}")
+            logger.error(traceback.format_exc())
+            with self._lock:
+                self.error = str(e)
+                self.status = 'failed'
+        finally:
+            with self._lock:
+                self.finished_at = time.time()
+                if self.phases and self.phases[-1]['finished_at'] is None:
+                    self.phases[-1]['finished_at'] = self.finished_at
+
+    def to_dict(self):
+        with self._lock:
+            now = time.time()
+            phases = []
+            for entry in self.phases:
+                elapsed = (entry['finished_at'] or now) - entry['started_at']
+                phases.append({
+                    'name': entry['name'],
+                    'done': entry['done'],
+                    'total': entry['total'],
+                    'seconds': round(elapsed, 3),
+                    'per_second': round(entry['done'] / elapsed, 2) if elapsed > 0 else None,
+                })
+            return {
+                'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'phase': self.phase_name,
+                'phases': phases,
+                'result': self.result,
+                'error': self.error,
+                'seconds': round((self.finished_at or now) - self.started_at, 3) if self.started_at else 0.0,
+            }
@@ -0,0 +1,118 @@
+import re
+import time
+import logging
+import numpy as np
+from src.vector_db import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:'[a-z]+)?")
+
+# Boilerplate of the text representation plus common English words
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have he her his in is it its of on or she that the their them
+they this to was were which who will with title directed starring genres summary movie movies film films
+""".split())
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords and possessive endings removed"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall((text or '').lower()):
+        if token.endswith("'s"):
+            token = token[:-2]
+        if token and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+class BM25Index:
+    """Okapi BM25 over one text per document, stored as NumPy postings
+
+    Postings are grouped by term: the documents containing term ``t`` are
+    ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching ``term_freqs``. A
+    query scores only the postings of its own terms.
+    """
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        started = time.time()
+        self.k1 = k1
+        self.b = b
+        self.term_ids = {}
+        term_column = []
+        doc_column = []
+        freq_column = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_id = self.term_ids.get(token)
+                if term_id is None:
+                    term_id = self.term_ids[token] = len(self.term_ids)
+                term_column.append(term_id)
+                doc_column.append(doc_id)
+                freq_column.append(count)
+
+        terms = np.asarray(term_column, dtype=np.int32)
+        order = np.argsort(terms, kind='stable')
+        self.doc_ids = np.asarray(doc_column, dtype=np.int32)[order]
+        self.term_freqs = np.asarray(freq_column, dtype=np.float32)[order]
+        document_frequency = np.bincount(terms, minlength=len(self.term_ids))
+        self.offsets = np.zeros(len(self.term_ids) + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=self.offsets[1:])
+
+        size = len(texts)
+        self.idf = np.log(1.0 + (size - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = doc_lengths.mean() if size else 0.0
+        # Per-document part of the BM25 denominator, precomputed once
+        self.length_norm = (k1 * (1.0 - b + b * doc_lengths / average_length)).astype(np.float32) \
+            if average_length else np.full(size, k1, dtype=np.float32)
+        self.size = size
+        logger.info(f"Built BM25 index of {size} documents and {len(self.term_ids)} terms "
+                    f"in {time.time() - started:.2f}s")
+
+    def search(self, query, k=10, mask=None):
+        """Ids of the ``k`` best matching documents, best first
+
+        ``mask`` is an optional boolean array over documents; documents outside
+        it are never returned.
+        """
+        term_ids = {self.term_ids[token] for token in tokenize(query) if token in self.term_ids}
+        if not term_ids or k <= 0:
+            return []
+
+        doc_parts = []
+        score_parts = []
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            freqs = self.term_freqs[start:end]
+            doc_parts.append(docs)
+            score_parts.append(self.idf[term_id] * freqs * (self.k1 + 1.0) / (freqs + self.length_norm[docs]))
+        docs = np.concatenate(doc_parts)
+        scores = np.concatenate(score_parts)
+        if mask is not None:
+            keep = mask[docs]
+            docs, scores = docs[keep], scores[keep]
+        if len(docs) == 0:
+            return []
+
+        # Sum the per-term contributions of each matched document
+        matched, inverse = np.unique(docs, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        return matched[top_k_indices(totals, min(k, len(matched)))].tolist()
+
+def reciprocal_rank_fusion(rankings, k=60, return_scores=False):
+    """Fuse ranked id lists: each id scores the sum of 1 / (k + rank) over the lists
+
+    Ties keep the order in which ids were first seen, so a single list comes
+    back unchanged. With ``return_scores`` the fused scores are returned too.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores, key=lambda item: -scores[item])
+    return (fused, [scores[item] for item in fused]) if return_scores else fused
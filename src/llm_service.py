@@ -1,40 +1,40 @@
-from anthropic import Anthropic
-from openai import OpenAI
-import httpx
+import time
 import logging
+import threading
+from src.cache import LRUCache
+from src.http_client import get_anthropic_client, get_openai_client
+from src.query_cache import normalize_query
 
 logger = logging.getLogger(__name__)
 
 class LLMService:
-    """Service for interacting with LLMs (Claude or OpenAI)"""
+    """Service for interacting with LLMs (Claude or OpenAI)
+
+    Recommendation write-ups are cached for ``response_cache_ttl`` seconds,
+    keyed on the normalized user input, the ordered recommendation keys, the
+    provider and the model, so a repeated request with the same results skips
+    the LLM call.
+    """
     
     def __init__(self, provider="anthropic", anthropic_api_key=None, openai_api_key=None,
-                 anthropic_model="claude-3-sonnet-20240229", openai_model="gpt-4"):
+                 anthropic_model="claude-3-sonnet-20240229", openai_model="gpt-4",
+                 response_cache_size=512, response_cache_ttl=3600):
         self.provider = provider
         self.anthropic_api_key = anthropic_api_key
         self.openai_api_key = openai_api_key
         self.anthropic_model = anthropic_model
         self.openai_model = openai_model
+        self.response_cache = LRUCache(maxsize=response_cache_size, ttl=response_cache_ttl)
+        self._saved_ms = 0.0
+        self._saved_lock = threading.Lock()
         
-        # Create a custom httpx client without proxies
-        http_client = httpx.Client(
-            timeout=60.0,
-            follow_redirects=True
-        )
-        
-        # Initialize appropriate client
+        # Initialize appropriate client on the shared connection pool
         if self.provider == "anthropic" and self.anthropic_api_key:
             logger.info(f"Initializing Anthropic client with model: {self.anthropic_model}")
-            self.anthropic_client = Anthropic(
-                api_key=self.anthropic_api_key,
-                http_client=http_client
-            )
+            self.anthropic_client = get_anthropic_client(self.anthropic_api_key)
         elif self.provider == "openai" and self.openai_api_key:
             logger.info(f"Initializing OpenAI client with model: {self.openai_model}")
-            self.openai_client = OpenAI(
-                api_key=self.openai_api_key,
-                http_client=http_client
-            )
+            self.openai_client = get_openai_client(self.openai_api_key)
     
     def interpret_user_request(self, user_input, conversation_history=None):
         """Interpret the user's movie request using an LLM"""
@@ -103,8 +103,30 @@ class LLMService:
         
         return user_input
     
-    def generate_recommendation_response(self, user_input, recommendations):
-        """Generate a natural language response with movie recommendations"""
+    def _response_cache_key(self, user_input, recommendations):
+        model = self.anthropic_model if self.provider == "anthropic" else self.openai_model
+        return (self.provider, model, normalize_query(user_input), tuple(movie['key'] for movie in recommendations))
+    
+    def _cached_response(self, cache_key):
+        """A cached write-up, counting the generation time it saved, or None"""
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            return None
+        text, generation_ms = cached
+        with self._saved_lock:
+            self._saved_ms += generation_ms
+        logger.info(f"Response cache hit, skipped {generation_ms:.0f} ms of generation")
+        return text
+    
+    def response_cache_stats(self):
+        """Hit/miss counters of the response cache and the LLM time it saved"""
+        stats = self.response_cache.stats()
+        with self._saved_lock:
+            stats['saved_ms'] = round(self._saved_ms, 2)
+        return stats
+    
+    def _recommendation_prompt(self, user_input, recommendations):
+        """The reply prompt and the plain-text list used as a fallback reply"""
         # Format the recommendations
         recommendation_text = "\n".join([
             f"{i+1}. {movie['title']} ({movie['year']}) - {movie['genres']}"
@@ -122,8 +144,19 @@ class LLMService:
         Explain briefly why each movie might match what they're looking for.
         If they mentioned a specific movie, you can reference how these recommendations relate to it.
         """
+        return prompt, recommendation_text
+    
+    def generate_recommendation_response(self, user_input, recommendations):
+        """Generate a natural language response with movie recommendations"""
+        cache_key = self._response_cache_key(user_input, recommendations)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
+        prompt, recommendation_text = self._recommendation_prompt(user_input, recommendations)
         
         logger.info("Generating recommendation response")
+        started = time.perf_counter()
         
         if self.provider == "anthropic":
             try:
@@ -136,6 +169,7 @@ class LLMService:
                 )
                 generated_response = response.content[0].text
                 logger.info("Successfully generated recommendation response")
+                self.response_cache.put(cache_key, (generated_response, (time.perf_counter() - started) * 1000))
                 return generated_response
             except Exception as e:
                 logger.error(f"Error generating response with Anthropic: {str(e)}")
@@ -151,9 +185,68 @@ class LLMService:
                 )
                 generated_response = response.choices[0].message.content
                 logger.info("Successfully generated recommendation response")
+                self.response_cache.put(cache_key, (generated_response, (time.perf_counter() - started) * 1000))
                 return generated_response
             except Exception as e:
                 logger.error(f"Error generating response with OpenAI: {str(e)}")
                 return f"Here are some movie recommendations for you:\n\n{recommendation_text}"
         
         return f"Here are some movie recommendations for you:\n\n{recommendation_text}"
+    
+    def stream_recommendation_response(self, user_input, recommendations):
+        """Generate the recommendation response as a stream of text chunks
+
+        Yields the text as the model produces it. If the provider fails before
+        any text arrived, the plain recommendation list is yielded instead;
+        a failure midway just ends the stream. A cached write-up is yielded
+        whole, and a completed stream is cached for next time.
+        """
+        cache_key = self._response_cache_key(user_input, recommendations)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        prompt, recommendation_text = self._recommendation_prompt(user_input, recommendations)
+        fallback = f"Here are some movie recommendations for you:\n\n{recommendation_text}"
+        
+        logger.info("Streaming recommendation response")
+        started = time.perf_counter()
+        
+        parts = []
+        try:
+            if self.provider == "anthropic":
+                stream = self.anthropic_client.messages.create(
+                    model=self.anthropic_model,
+                    max_tokens=1000,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=True
+                )
+                for event in stream:
+                    if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                        parts.append(event.delta.text)
+                        yield event.delta.text
+                    
+            elif self.provider == "openai":
+                stream = self.openai_client.chat.completions.create(
+                    model=self.openai_model,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=True
+                )
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            
+            if parts:
+                logger.info("Successfully streamed recommendation response")
+                self.response_cache.put(cache_key, (''.join(parts), (time.perf_counter() - started) * 1000))
+        except Exception as e:
+            logger.error(f"Error streaming response with {self.provider}: {str(e)}")
+        
+        if not parts:
+            yield fallback
@@ -0,0 +1,192 @@
+import os
+import time
+import uuid
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _inverse_norms(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1)
+    norms[norms == 0] = 1.0
+    return (1.0 / norms).astype(np.float32)
+
+def _merge_top_k(ids, scores, candidate_ids, candidate_scores, k):
+    """Row by row, the ``k`` best of the current lists and a tile of new candidates, best first"""
+    ids = np.concatenate([ids, candidate_ids], axis=1)
+    scores = np.concatenate([scores, candidate_scores], axis=1)
+    if ids.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ids = np.take_along_axis(ids, keep, axis=1)
+        scores = np.take_along_axis(scores, keep, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+def _nearest(embeddings, inverse_norms, rows, columns, k, block_size, ids=None, scores=None, progress=None):
+    """Top ``k`` of ``columns`` by cosine similarity for each of ``rows``, a tile at a time
+
+    Similarities are computed for at most ``block_size`` rows against
+    ``block_size`` columns at once and folded into running top-k lists
+    (optionally seeded with ``ids``/``scores``), so memory stays bounded by
+    the tile size however large the library is. A row never lists itself.
+    """
+    if ids is None:
+        ids = np.full((len(rows), k), -1, dtype=np.int32)
+        scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    else:
+        ids, scores = ids.copy(), scores.copy()
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        queries = embeddings[block] * inverse_norms[block, None]
+        best_ids, best_scores = ids[start:start + len(block)], scores[start:start + len(block)]
+        for column_start in range(0, len(columns), block_size):
+            chunk = columns[column_start:column_start + block_size]
+            similarities = queries @ (embeddings[chunk] * inverse_norms[chunk, None]).T
+            similarities[block[:, None] == chunk[None, :]] = -np.inf
+            best_ids, best_scores = _merge_top_k(
+                best_ids, best_scores,
+                np.broadcast_to(chunk.astype(np.int32), similarities.shape), similarities, k
+            )
+        ids[start:start + len(block)], scores[start:start + len(block)] = best_ids, best_scores
+        if progress is not None:
+            progress(min(start + block_size, len(rows)), len(rows))
+    # Self matches only survive as padding in libraries smaller than k + 1
+    ids[np.isneginf(scores)] = -1
+    return ids, scores
+
+class NeighborGraph:
+    """The ``k`` most similar movies of every movie, by cosine similarity of their embeddings
+
+    Row ``i`` of ``neighbors`` holds rows (into ``keys``) of the movies
+    nearest to ``keys[i]``, best first, with the similarities in ``scores``.
+    Libraries with fewer than ``k + 1`` movies pad the lists with -1. The
+    embedding ``fingerprints`` the graph was built from let a later catalog
+    tell which movies changed.
+    """
+
+    def __init__(self, keys, fingerprints, neighbors, scores):
+        self.keys = list(keys)
+        self.fingerprints = list(fingerprints)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.k = neighbors.shape[1]
+        self.key_to_row = {key: row for row, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def similar(self, key, n=None):
+        """``(key, similarity)`` pairs of the movies nearest to ``key``, or None for an unknown key"""
+        row = self.key_to_row.get(key)
+        if row is None:
+            return None
+        ids, scores = self.neighbors[row, :n], self.scores[row, :n]
+        return [(self.keys[i], float(score)) for i, score in zip(ids, scores) if i >= 0]
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                keys=np.array(self.keys, dtype=str),
+                fingerprints=np.array(self.fingerprints, dtype=str),
+                neighbors=self.neighbors,
+                scores=self.scores
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Saved neighbor graph of {len(self)} movies to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """The graph saved at ``path``, or None when there is none or it is unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls(data['keys'].tolist(), data['fingerprints'].tolist(), data['neighbors'], data['scores'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read neighbor graph {path}: {e}")
+            return None
+
+def _fingerprints(catalog):
+    return [fingerprint or '' for fingerprint in catalog.strings['fingerprint']]
+
+def build_neighbor_graph(catalog, k=20, block_size=1024, progress=None):
+    """Compute the neighbor graph of every movie in a ``MovieCatalog`` from scratch"""
+    started = time.time()
+    embeddings = catalog.embeddings
+    rows = np.arange(len(catalog))
+    if len(catalog) == 0 or embeddings.shape[1] == 0:
+        neighbors = np.full((len(catalog), k), -1, dtype=np.int32)
+        scores = np.full((len(catalog), k), -np.inf, dtype=np.float32)
+    else:
+        neighbors, scores = _nearest(embeddings, _inverse_norms(embeddings), rows, rows, k, block_size,
+                                     progress=progress)
+    logger.info(f"Built {k}-nearest-neighbor graph of {len(catalog)} movies in {time.time() - started:.2f}s")
+    return NeighborGraph(catalog.keys, _fingerprints(catalog), neighbors, scores)
+
+def update_neighbor_graph(graph, catalog, k=20, block_size=1024, rebuild_fraction=0.25, progress=None):
+    """Carry a neighbor graph over to a changed catalog, recomputing only the affected rows
+
+    A movie has changed when its key is new or its embedding fingerprint
+    differs. Changed movies get fresh neighbor lists, as does any other movie
+    whose list pointed at a removed or changed one. Every remaining movie keeps
+    its list and only merges in the changed movies as new candidates. Falls
+    back to a full build without a usable graph or when more than
+    ``rebuild_fraction`` of the library changed. Returns the graph unchanged
+    when nothing changed.
+    """
+    if graph is None or graph.k != k or catalog.embeddings.shape[1] == 0:
+        return build_neighbor_graph(catalog, k, block_size, progress)
+
+    started = time.time()
+    fingerprints = _fingerprints(catalog)
+    old_to_new = np.full(len(graph) + 1, -1, dtype=np.int64)  # last slot maps the -1 padding
+    for old_row, key in enumerate(graph.keys):
+        new_row = catalog.key_to_row.get(key)
+        if new_row is not None and fingerprints[new_row] == graph.fingerprints[old_row]:
+            old_to_new[old_row] = new_row
+    new_to_old = np.full(len(catalog), -1, dtype=np.int64)
+    kept_old = np.flatnonzero(old_to_new[:-1] >= 0)
+    new_to_old[old_to_new[kept_old]] = kept_old
+
+    changed = np.flatnonzero(new_to_old < 0)
+    stale = len(graph) - len(kept_old)
+    if not len(changed) and not stale and np.array_equal(new_to_old, np.arange(len(catalog))):
+        return graph
+    if len(changed) > rebuild_fraction * len(catalog):
+        return build_neighbor_graph(catalog, k, block_size, progress)
+
+    kept = np.flatnonzero(new_to_old >= 0)
+    old_ids = graph.neighbors[new_to_old[kept]]
+    kept_ids = old_to_new[old_ids].astype(np.int32)
+    kept_scores = graph.scores[new_to_old[kept]]
+    # A list that pointed at a removed or re-embedded movie may now miss a closer one
+    lost = ((old_ids >= 0) & (kept_ids < 0)).any(axis=1)
+
+    neighbors = np.full((len(catalog), k), -1, dtype=np.int32)
+    scores = np.full((len(catalog), k), -np.inf, dtype=np.float32)
+    embeddings = catalog.embeddings
+    inverse_norms = _inverse_norms(embeddings)
+
+    merged = kept[~lost]
+    if len(changed):
+        neighbors[merged], scores[merged] = _nearest(
+            embeddings, inverse_norms, merged, changed, k, block_size,
+            ids=kept_ids[~lost], scores=kept_scores[~lost]
+        )
+    else:
+        neighbors[merged], scores[merged] = kept_ids[~lost], kept_scores[~lost]
+
+    recomputed = np.concatenate([changed, kept[lost]])
+    if len(recomputed):
+        neighbors[recomputed], scores[recomputed] = _nearest(
+            embeddings, inverse_norms, recomputed, np.arange(len(catalog)), k, block_size, progress=progress
+        )
+
+    logger.info(f"Updated neighbor graph in {time.time() - started:.2f}s: {len(changed)} changed, "
+                f"{stale} removed or re-embedded, {len(recomputed)} rows recomputed, {len(merged)} merged")
+    return NeighborGraph(catalog.keys, fingerprints, neighbors, scores)
@@ -1,6 +1,9 @@
 from plexapi.server import PlexServer
 from plexapi.myplex import MyPlexAccount
+from plexapi.exceptions import NotFound
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 def connect_to_plex(baseurl=None, token=None, username=None, password=None, servername=None):
     """Connect to Plex server using either direct connection or via MyPlex account"""
@@ -12,46 +15,161 @@ def connect_to_plex(baseurl=None, token=None, username=None, password=None, serv
     else:
         raise ValueError("Either (baseurl, token) or (username, password, servername) must be provided")
 
-def extract_plex_movies(plex, library_name='Movies'):
-    """Extract movie data from Plex library"""
+def build_text_representation(movie_info):
+    """Create a rich text representation of a movie for embedding"""
+    text = f"Title: {movie_info['title']}"
+    
+    if movie_info['year']:
+        text += f" ({movie_info['year']})"
+    
+    if movie_info['directors']:
+        text += f". Directed by {', '.join(movie_info['directors'])}"
+    
+    if movie_info['actors']:
+        text += f". Starring {', '.join(movie_info['actors'])}"
+    
+    if movie_info['genres']:
+        text += f". Genres: {', '.join(movie_info['genres'])}"
+    
+    if movie_info['summary']:
+        text += f". Summary: {movie_info['summary']}"
+    
+    return text
+
+def _epoch(value):
+    """Convert a plexapi datetime to integer epoch seconds"""
+    return int(value.timestamp()) if value else None
+
+def movie_to_record(movie):
+    """Turn a fully loaded plexapi Movie into a movie record"""
+    # The item was fetched with all its fields; never let a missing one trigger a per-item reload
+    movie._autoReload = False
+    movie_info = {
+        'title': movie.title,
+        'year': getattr(movie, 'year', None),
+        'summary': getattr(movie, 'summary', None) or "",
+        'genres': [g.tag for g in getattr(movie, 'genres', None) or []],
+        'directors': [d.tag for d in getattr(movie, 'directors', None) or []],
+        'actors': [a.tag for a in getattr(movie, 'roles', None) or []][:5],
+        'key': movie.key,  # Store the key for later retrieval
+        'rating': getattr(movie, 'rating', None),
+        'duration': getattr(movie, 'duration', None),
+        'audience_rating': getattr(movie, 'audienceRating', None),
+        'view_count': getattr(movie, 'viewCount', None) or 0,
+        'added_at': _epoch(getattr(movie, 'addedAt', None)),
+        'updated_at': _epoch(getattr(movie, 'updatedAt', None)),
+        'last_viewed_at': _epoch(getattr(movie, 'lastViewedAt', None)),
+    }
+    movie_info['text_representation'] = build_text_representation(movie_info)
+    return movie_info
+
+def _list_rating_keys(plex, section_key, start, page_size, filters=''):
+    """List one page of rating keys from the section without building plexapi objects"""
+    listing = plex.query(
+        f"/library/sections/{section_key}/all?type=1&sort=addedAt:asc{filters}",
+        headers={'X-Plex-Container-Start': str(start), 'X-Plex-Container-Size': str(page_size)}
+    )
+    if listing is None:
+        return []
+    return [el.attrib['ratingKey'] for el in listing if el.attrib.get('ratingKey')]
+
+def _fetch_movie_page(plex, section_key, start, page_size, filters=''):
+    """Fetch one page of the section with every field the records need
+
+    The listing call only returns rating keys; the full metadata for the whole
+    page then comes back from a single ``/library/metadata/<k1>,<k2>,...`` request.
+    """
+    return _fetch_movie_records(plex, _list_rating_keys(plex, section_key, start, page_size, filters))
+
+def _fetch_movie_records(plex, rating_keys):
+    """Fetch full metadata for a batch of rating keys in one request"""
+    if not rating_keys:
+        return []
+    movies = plex.fetchItems(f"/library/metadata/{','.join(rating_keys)}")
+    return [movie_to_record(movie) for movie in movies if getattr(movie, 'type', None) == 'movie']
+
+def iter_plex_movies(plex, library_name='Movies', page_size=200, max_workers=1, progress=None):
+    """Stream movie records from a Plex library one page at a time
+
+    Pages are fetched in fixed-size containers, optionally several in parallel,
+    and yielded in library order. At most ``2 * max_workers`` pages are held in
+    memory at once, so memory stays bounded regardless of library size.
+    ``progress(done, total)`` is called after each page.
+    """
     movies_section = plex.library.section(library_name)
+    total = movies_section.totalViewSize(libtype='movie')
+    starts = iter(range(0, total, page_size))
+    done = 0
     
-    movies_data = []
-    for movie in movies_section.all():
-        # Extract relevant metadata
-        movie_info = {
-            'title': movie.title,
-            'year': movie.year if hasattr(movie, 'year') else None,
-            'summary': movie.summary if hasattr(movie, 'summary') else "",
-            'genres': [g.tag for g in movie.genres] if hasattr(movie, 'genres') and movie.genres else [],
-            'directors': [d.tag for d in movie.directors] if hasattr(movie, 'directors') and movie.directors else [],
-            'actors': [a.tag for a in movie.roles][:5] if hasattr(movie, 'roles') and movie.roles else [],
-            'key': movie.key,  # Store the key for later retrieval
-            'rating': movie.rating if hasattr(movie, 'rating') else None,
-            'duration': movie.duration if hasattr(movie, 'duration') else None,
-        }
-        
-        # Create a rich text representation for embedding
-        movie_info['text_representation'] = f"Title: {movie_info['title']}"
-        
-        if movie_info['year']:
-            movie_info['text_representation'] += f" ({movie_info['year']})"
-        
-        if movie_info['directors']:
-            movie_info['text_representation'] += f". Directed by {', '.join(movie_info['directors'])}"
-        
-        if movie_info['actors']:
-            movie_info['text_representation'] += f". Starring {', '.join(movie_info['actors'])}"
-        
-        if movie_info['genres']:
-            movie_info['text_representation'] += f". Genres: {', '.join(movie_info['genres'])}"
-        
-        if movie_info['summary']:
-            movie_info['text_representation'] += f". Summary: {movie_info['summary']}"
-        
-        movies_data.append(movie_info)
+    def advance(page):
+        nonlocal done
+        done += len(page)
+        if progress:
+            progress(done, total)
+        return page
     
-    return pd.DataFrame(movies_data)
+    if max_workers <= 1:
+        for start in starts:
+            yield from advance(_fetch_movie_page(plex, movies_section.key, start, page_size))
+        return
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for start in starts:
+            pending.append(executor.submit(_fetch_movie_page, plex, movies_section.key, start, page_size))
+            if len(pending) >= 2 * max_workers:
+                yield from advance(pending.popleft().result())
+        while pending:
+            yield from advance(pending.popleft().result())
+
+def iter_plex_movies_since(plex, since, library_name='Movies', page_size=200):
+    """Stream records for movies added, updated or watched after epoch second ``since``
+
+    Plex's ``>>=`` filter is a strict greater-than, so a movie stamped exactly
+    ``since`` is not returned.
+    """
+    movies_section = plex.library.section(library_name)
+    seen = set()
+    for field in ('updatedAt', 'addedAt', 'lastViewedAt'):
+        start = 0
+        while True:
+            rating_keys = _list_rating_keys(plex, movies_section.key, start, page_size, f"&{field}>>={int(since)}")
+            new_keys = [k for k in rating_keys if f"/library/metadata/{k}" not in seen]
+            for record in _fetch_movie_records(plex, new_keys):
+                seen.add(record['key'])
+                yield record
+            if len(rating_keys) < page_size:
+                break
+            start += page_size
+
+def iter_plex_movies_by_key(plex, keys, page_size=200):
+    """Stream records for the given movie keys, skipping ones no longer in the library"""
+    rating_keys = [key.rsplit('/', 1)[-1] for key in keys]
+    for start in range(0, len(rating_keys), page_size):
+        try:
+            yield from _fetch_movie_records(plex, rating_keys[start:start + page_size])
+        except NotFound:
+            continue
+
+def count_plex_movies(plex, library_name='Movies'):
+    """Number of movies in the library, from a single lightweight request"""
+    return plex.library.section(library_name).totalViewSize(libtype='movie')
+
+def fetch_plex_movie_keys(plex, library_name='Movies', page_size=1000):
+    """Every movie key in the library, listed page by page without loading metadata"""
+    movies_section = plex.library.section(library_name)
+    keys = set()
+    start = 0
+    while True:
+        rating_keys = _list_rating_keys(plex, movies_section.key, start, page_size)
+        keys.update(f"/library/metadata/{rating_key}" for rating_key in rating_keys)
+        if len(rating_keys) < page_size:
+            return keys
+        start += page_size
+
+def extract_plex_movies(plex, library_name='Movies', page_size=200, max_workers=1, progress=None):
+    """Extract movie data from Plex library"""
+    return pd.DataFrame(list(iter_plex_movies(plex, library_name, page_size, max_workers, progress)))
 
 def get_available_clients(plex):
     """Get a list of available Plex clients"""
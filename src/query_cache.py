@@ -0,0 +1,107 @@
+import os
+import re
+import sqlite3
+import logging
+import threading
+import numpy as np
+from src.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(text):
+    """Normalize query text so trivially different phrasings share a cache entry"""
+    return re.sub(r'\s+', ' ', text.strip().lower())
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings keyed by normalized text and model
+
+    The in-memory tier is a bounded LRU. The optional disk tier is a small
+    SQLite table that survives restarts; entries found there are promoted to
+    memory, and the table is pruned back to ``disk_max_entries`` by last use.
+    """
+
+    def __init__(self, maxsize=1024, disk_path=None, disk_max_entries=50000):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.disk_hits = 0
+        self._disk_lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (model, query))"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Query embedding disk cache disabled ({disk_path}): {e}")
+            self._conn = None
+
+    def get(self, query_text, model):
+        key = (model, normalize_query(query_text))
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector
+        if self._conn is None:
+            return None
+
+        with self._disk_lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?", key
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "UPDATE query_embeddings SET last_used = julianday('now') WHERE model = ? AND query = ?", key
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Query embedding disk cache read failed: {e}")
+                return None
+
+        vector = np.frombuffer(row[0], dtype=np.float32).copy()
+        self.disk_hits += 1
+        self.memory.put(key, vector)
+        return vector
+
+    def put(self, query_text, model, vector):
+        key = (model, normalize_query(query_text))
+        vector = np.asarray(vector, dtype=np.float32)
+        self.memory.put(key, vector)
+        if self._conn is None:
+            return
+
+        with self._disk_lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, vector, last_used) "
+                    "VALUES (?, ?, ?, julianday('now'))",
+                    (key[0], key[1], vector.tobytes())
+                )
+                self._conn.execute(
+                    "DELETE FROM query_embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Query embedding disk cache write failed: {e}")
+
+    def stats(self):
+        stats = self.memory.stats()
+        # A disk hit is also counted as a memory miss; report the combined picture
+        stats['memory_hits'] = stats.pop('hits')
+        stats['disk_hits'] = self.disk_hits
+        stats['misses'] = stats['misses'] - self.disk_hits
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['disk_enabled'] = self._conn is not None
+        return stats
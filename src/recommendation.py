@@ -1,35 +1,273 @@
-import pandas as pd
+import json
+import time
+import logging
+import threading
+import numpy as np
 
-def get_movie_recommendations(query, movies_df, collection, openai_api_key, n=5):
-    """Get movie recommendations based on a query"""
-    from src.embedding import generate_query_embedding
-    from src.vector_db import query_vector_db
+logger = logging.getLogger(__name__)
+
+def format_movie(catalog, row, include_summary=False):
+    """Format one catalog row as a recommendation entry"""
+    movie = {
+        'title': catalog.strings['title'][row],
+        'year': catalog.value('year', row),
+        'genres': ', '.join(catalog.tags['genres'][row]),
+        'key': catalog.keys[row]
+    }
+    if include_summary:
+        movie['summary'] = catalog.strings['summary'][row]
+    return movie
+
+def mmr_rerank(query_embedding, candidate_embeddings, n, mmr_lambda=0.7, fused_scores=None):
+    """Order candidates by maximal marginal relevance, returning positions into the pool
+
+    Each pick maximizes ``lambda * sim(query, c) - (1 - lambda) * max sim(c, picked)``.
+    All candidate-to-candidate similarities come from one matrix product, and
+    each pick only updates a running maximum, so the loop is over the ``n``
+    picks, never over candidate pairs. When the pool came from rank fusion,
+    ``fused_scores`` replace the query similarities, rescaled onto the pool's
+    similarity range so relevance and redundancy stay comparable.
+    """
+    vectors = np.asarray(candidate_embeddings, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
     
-    # Generate embedding for the query
-    query_embedding = generate_query_embedding(query, openai_api_key)
+    relevance = vectors @ query
+    if fused_scores is not None:
+        fused = np.asarray(fused_scores, dtype=np.float32)
+        spread = fused.max() - fused.min()
+        if spread > 0:
+            relevance = relevance.min() + (fused - fused.min()) / spread * (relevance.max() - relevance.min())
+    similarity = vectors @ vectors.T
     
-    # Query the vector database
-    results = query_vector_db(collection, query_embedding, n)
+    n = min(n, len(vectors))
+    picked = []
+    available = np.ones(len(vectors), dtype=bool)
+    redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)
+    for _ in range(n):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * penalty
+        scores[~available] = -np.inf
+        choice = int(np.argmax(scores))
+        picked.append(choice)
+        available[choice] = False
+        np.maximum(redundancy, similarity[choice], out=redundancy)
+    return picked
+
+def get_movie_recommendations(query, catalog, vector_index, openai_api_key, n=5,
+                              embedding_model="text-embedding-ada-002", filters=None,
+                              lexical_query=None, hybrid=True, rrf_k=60,
+                              mmr_lambda=None, pool_size=25, return_timings=False, result_cache=None):
+    """Get movie recommendations based on a query, optionally restricted by a filter dict
+
+    With ``hybrid`` the vector results are fused with BM25 matches for
+    ``lexical_query`` (the query itself by default) using reciprocal rank
+    fusion, so exact names of actors, directors and titles rank well.
+
+    With ``mmr_lambda`` below 1, a pool of ``pool_size`` candidates is reranked
+    with maximal marginal relevance so near-duplicates (e.g. a run of sequels)
+    don't crowd out everything else. With ``return_timings`` the per-stage
+    latencies in milliseconds are returned alongside the recommendations.
+
+    This is a batch of one for ``get_batch_recommendations``, so single and
+    batched queries always rank the same way.
+    """
+    results, timings = get_batch_recommendations(
+        [query], catalog, vector_index, openai_api_key, n=n, embedding_model=embedding_model,
+        filters=[filters], lexical_queries=[lexical_query], hybrid=hybrid, rrf_k=rrf_k,
+        mmr_lambda=mmr_lambda, pool_size=pool_size, result_cache=result_cache
+    )
+    return (results[0], timings) if return_timings else results[0]
+
+def get_batch_recommendations(queries, catalog, vector_index, openai_api_key, n=5,
+                              embedding_model="text-embedding-ada-002", filters=None,
+                              lexical_queries=None, hybrid=True, rrf_k=60,
+                              mmr_lambda=None, pool_size=25, result_cache=None):
+    """Recommendations for many queries, with one embedding request and one index query per filter
+
+    ``filters`` and ``lexical_queries`` are optional lists aligned with
+    ``queries``. All queries are embedded in a single API call, and queries
+    sharing a filter are scored against the index as one matrix product.
+    Fusion and reranking then run per query exactly as for a single query.
+    With a ``SemanticResultCache``, queries close enough to a recent one
+    searched the same way (naming the same titles, genres and people when
+    ``hybrid``) reuse its results and skip the search entirely.
+    Returns the list of recommendation lists and the stage latencies for the
+    whole batch in milliseconds.
+    """
+    from src.embedding import generate_query_embeddings
+    from src.lexical import reciprocal_rank_fusion, tokenize
     
-    if not results or 'ids' not in results or not results['ids']:
-        return []
+    filters = filters or [None] * len(queries)
+    lexical_queries = lexical_queries or [None] * len(queries)
+    timings = {}
+    started = time.perf_counter()
+    rerank = mmr_lambda is not None and mmr_lambda < 1.0
     
-    # Get the recommended movies
-    recommended_indices = [int(idx) for idx in results['ids'][0]]
-    recommended_movies = movies_df.iloc[recommended_indices].copy()
+    # Retrieve a deeper candidate pool than n when fusing or reranking
+    candidates = n
+    if hybrid:
+        candidates = max(candidates, 4 * n, 20)
+    if rerank:
+        candidates = max(candidates, pool_size)
+    
+    # Generate embeddings for all queries at once
+    query_embeddings = generate_query_embeddings(queries, openai_api_key, model=embedding_model)
+    timings['embedding_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    started = time.perf_counter()
+    
+    # Paraphrases of recent queries reuse the results they got. Names embed
+    # fuzzily but decide the keyword matches, so hybrid searches must also
+    # name the same titles, genres and people; other wording may differ
+    name_terms = catalog.name_terms() if hybrid else None
+    contexts = [
+        (json.dumps(query_filters, sort_keys=True), n, embedding_model, hybrid, rrf_k, mmr_lambda, pool_size,
+         tuple(sorted(name_terms.intersection(tokenize(lexical_query or query)))) if hybrid else None)
+        for query, query_filters, lexical_query in zip(queries, filters, lexical_queries)
+    ]
+    cached = [None] * len(queries)
+    if result_cache is not None:
+        cached = [
+            result_cache.get(query_embedding, context, catalog.version)
+            for query_embedding, context in zip(query_embeddings, contexts)
+        ]
+        timings['semantic_cache_hits'] = sum(result is not None for result in cached)
+    
+    # Query the vector index once per distinct filter
+    groups = {}
+    for position, (query_embedding, context) in enumerate(zip(query_embeddings, contexts)):
+        if query_embedding is not None and cached[position] is None:
+            groups.setdefault(context[0], []).append(position)
+    vector_rows = [[] for _ in queries]
+    for positions in groups.values():
+        results = vector_index.query(
+            [query_embeddings[position] for position in positions], candidates, filters=filters[positions[0]]
+        )
+        for position, ids in zip(positions, results['ids']):
+            # Index ids are Plex keys
+            vector_rows[position] = [row for row in (catalog.row(key) for key in ids) if row is not None]
+    
+    ranked = []
+    for query, query_filters, lexical_query, rows, result in zip(queries, filters, lexical_queries, vector_rows, cached):
+        if result is not None:
+            ranked.append(([], None))
+            continue
+        fused_scores = None
+        if hybrid:
+            mask = catalog.filter_mask(query_filters) if query_filters else None
+            lexical_rows = catalog.lexical_index().search(lexical_query or query, candidates, mask)
+            if lexical_rows:
+                rows, fused_scores = reciprocal_rank_fusion([rows, lexical_rows], k=rrf_k, return_scores=True)
+        ranked.append((rows, fused_scores))
+    timings['retrieval_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    
+    if rerank:
+        started = time.perf_counter()
+        pool_end = max(pool_size, n)
+        for position, (rows, fused_scores) in enumerate(ranked):
+            if len(rows) <= n or query_embeddings[position] is None:
+                continue
+            pool = rows[:pool_end]
+            order = mmr_rerank(
+                query_embeddings[position], catalog.embeddings[pool], n, mmr_lambda,
+                fused_scores=fused_scores[:pool_end] if fused_scores is not None else None
+            )
+            ranked[position] = ([pool[i] for i in order], fused_scores)
+        timings['rerank_ms'] = round((time.perf_counter() - started) * 1000, 2)
     
     # Format the recommendations
-    formatted_recommendations = []
-    for _, movie in recommended_movies.iterrows():
-        formatted_recommendations.append({
-            'title': movie['title'],
-            'year': movie['year'],
-            'genres': ', '.join(movie['genres']),
-            'key': movie['key'],
-            'summary': movie['summary']
-        })
-    
-    return formatted_recommendations
+    recommendations = []
+    for position, (rows, _) in enumerate(ranked):
+        if cached[position] is not None:
+            recommendations.append(list(cached[position]))
+            continue
+        result = [format_movie(catalog, row, include_summary=True) for row in rows[:n]]
+        if result_cache is not None and result:
+            result_cache.put(query_embeddings[position], contexts[position], catalog.version, result)
+        recommendations.append(list(result))
+    return recommendations, timings
+
+def query_similarity(first, second):
+    """Overlap of the content words of two queries, from 0 (disjoint) to 1 (same words)"""
+    from src.lexical import tokenize
+    
+    first_tokens, second_tokens = set(tokenize(first)), set(tokenize(second))
+    if not first_tokens or not second_tokens:
+        return 1.0 if first_tokens == second_tokens else 0.0
+    return len(first_tokens & second_tokens) / len(first_tokens | second_tokens)
+
+# Outcome counters for speculative_search, reported by get_speculation_stats()
+_speculation_stats = {'reused': 0, 'discarded': 0, 'off': 0, 'saved_ms': 0.0}
+_speculation_lock = threading.Lock()
+
+def get_speculation_stats():
+    """How often speculative searches were reused and the latency that saved"""
+    with _speculation_lock:
+        stats = dict(_speculation_stats)
+    speculated = stats['reused'] + stats['discarded']
+    stats['saved_ms'] = round(stats['saved_ms'], 2)
+    stats['reuse_rate'] = round(stats['reused'] / speculated, 4) if speculated else 0.0
+    return stats
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+def speculative_search(user_input, interpret, search, executor=None, reuse_threshold=0.8):
+    """Search for the raw ``user_input`` while its LLM interpretation is still in flight
+
+    ``interpret(text)`` returns the rewritten query and ``search(query)``
+    returns ``(results, timings)``. With an ``executor``, the raw input is
+    searched on it while the interpretation runs. If the interpretation comes
+    back essentially the same (``query_similarity`` of at least
+    ``reuse_threshold``), those results are used and the search drops off the
+    critical path. Otherwise the interpreted query is searched as usual.
+    Without an executor the two steps simply run one after the other.
+
+    Returns ``(interpreted_query, results, timings)``; the timings gain
+    ``interpret_ms``, ``pipeline_ms``, the ``speculation`` outcome and the
+    estimated ``saved_ms``.
+    """
+    started = time.perf_counter()
+    speculative = executor.submit(_timed, search, user_input) if executor is not None else None
+    
+    interpreted_query, interpret_ms = _timed(interpret, user_input)
+    similarity = query_similarity(user_input, interpreted_query)
+    
+    outcome = 'off'
+    saved_ms = 0.0
+    results = None
+    if speculative is not None:
+        outcome = 'discarded'
+        if similarity >= reuse_threshold:
+            try:
+                (results, timings), search_ms = speculative.result()
+                outcome = 'reused'
+                # Run back to back the two steps would have taken interpret_ms + search_ms
+                saved_ms = min(interpret_ms, search_ms)
+            except Exception as e:
+                logger.warning(f"Speculative search failed, searching again: {str(e)}")
+        else:
+            speculative.cancel()
+    if results is None:
+        results, timings = search(interpreted_query)
+    
+    timings = dict(timings)
+    timings['interpret_ms'] = interpret_ms
+    timings['pipeline_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    timings['speculation'] = outcome
+    timings['saved_ms'] = saved_ms
+    timings['query_similarity'] = round(similarity, 3)
+    with _speculation_lock:
+        _speculation_stats[outcome] += 1
+        _speculation_stats['saved_ms'] += saved_ms
+    return interpreted_query, results, timings
 
 def extract_movie_to_play(user_input, recommendations):
     """Extract which movie the user wants to play from their input"""
@@ -52,89 +290,71 @@ def extract_movie_to_play(user_input, recommendations):
     
     return None
 
-def find_similar_by_director(movies_df, director, exclude_title=None, limit=3):
+def find_similar_by_director(catalog, director, exclude_title=None, limit=3):
     """Find movies by the same director"""
     if not director:
         return []
     
+    titles = catalog.strings['title']
     similar_movies = []
-    for _, movie in movies_df.iterrows():
-        if director in movie['directors'] and movie['title'] != exclude_title:
-            similar_movies.append({
-                'title': movie['title'],
-                'year': movie['year'],
-                'genres': ', '.join(movie['genres']),
-                'key': movie['key']
-            })
+    for row in catalog.tags['directors'].rows_with(director):
+        if titles[row] != exclude_title:
+            similar_movies.append(format_movie(catalog, row))
             if len(similar_movies) >= limit:
                 break
     
     return similar_movies
 
-def find_similar_by_genre(movies_df, genres, exclude_title=None, limit=3):
-    """Find movies with similar genres"""
-    if not genres:
+def _find_by_tag_overlap(catalog, field, tags, exclude_title=None, limit=3, normalize=True):
+    """Rank movies by how many of ``tags`` they share, scored over the inverted postings"""
+    if not tags:
         return []
     
-    # Calculate genre similarity scores
-    similarity_scores = []
-    for _, movie in movies_df.iterrows():
-        if movie['title'] == exclude_title:
+    column = catalog.tags[field]
+    matches = column.overlap_counts(tags)
+    candidates = np.flatnonzero(matches)
+    scores = matches[candidates].astype(np.float64)
+    if normalize:
+        scores /= np.maximum(column.counts[candidates], len(set(tags)))
+    
+    # Highest score first, ties in catalog order
+    titles = catalog.strings['title']
+    similar_movies = []
+    for position in np.lexsort((candidates, -scores)):
+        row = candidates[position]
+        if titles[row] == exclude_title:
             continue
-        
-        # Count matching genres
-        matching_genres = set(movie['genres']).intersection(set(genres))
-        score = len(matching_genres) / max(len(movie['genres']), len(genres))
-        
-        if score > 0:
-            similarity_scores.append({
-                'title': movie['title'],
-                'year': movie['year'],
-                'genres': ', '.join(movie['genres']),
-                'key': movie['key'],
-                'score': score
-            })
-    
-    # Sort by similarity score
-    similarity_scores.sort(key=lambda x: x['score'], reverse=True)
-    
-    # Return top matches
-    return similarity_scores[:limit]
-
-def get_popular_movies(movies_df, limit=5):
-    """Get a list of popular movies (placeholder - in a real implementation, 
-    this could use ratings or view counts)"""
-    # In a real implementation, you might sort by rating or view count
-    # Here we'll just return some random movies
-    import random
-    
-    sample_indices = random.sample(range(len(movies_df)), min(limit, len(movies_df)))
-    popular_movies = []
-    
-    for idx in sample_indices:
-        movie = movies_df.iloc[idx]
-        popular_movies.append({
-            'title': movie['title'],
-            'year': movie['year'],
-            'genres': ', '.join(movie['genres']),
-            'key': movie['key']
-        })
-    
-    return popular_movies
-
-def get_recently_added_movies(movies_df, limit=5):
-    """Get recently added movies (placeholder - in a real implementation, 
-    this would use the 'addedAt' field)"""
-    # In a real implementation, you would sort by addedAt
-    # Here we'll just return the last rows in the dataframe
-    recent_movies = []
-    
-    for _, movie in movies_df.tail(limit).iterrows():
-        recent_movies.append({
-            'title': movie['title'],
-            'year': movie['year'],
-            'genres': ', '.join(movie['genres']),
-            'key': movie['key']
-        })
-    
-    return recent_movies
\ No newline at end of file
+        movie = format_movie(catalog, row)
+        movie['score'] = float(scores[position])
+        similar_movies.append(movie)
+        if len(similar_movies) >= limit:
+            break
+    return similar_movies
+
+def find_similar_by_genre(catalog, genres, exclude_title=None, limit=3):
+    """Find movies with similar genres"""
+    return _find_by_tag_overlap(catalog, 'genres', genres, exclude_title, limit)
+
+def find_similar_by_actor(catalog, actors, exclude_title=None, limit=3):
+    """Find movies sharing the most actors"""
+    return _find_by_tag_overlap(catalog, 'actors', actors, exclude_title, limit, normalize=False)
+
+def _rows_with_genres(catalog, genres):
+    if not genres:
+        return None
+    genre_column = catalog.tags['genres']
+    postings = [genre_column.rows_with(genre) for genre in genres]
+    return np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32)
+
+def get_popular_movies(catalog, limit=5, genres=None):
+    """Get the most played movies, ties broken by audience rating
+
+    With ``genres`` only movies in any of those genres are considered.
+    """
+    rows = catalog.ranked('popular', limit, _rows_with_genres(catalog, genres))
+    return [format_movie(catalog, row) for row in rows]
+
+def get_recently_added_movies(catalog, limit=5, genres=None):
+    """Get the most recently added movies, optionally within ``genres``"""
+    rows = catalog.ranked('recent', limit, _rows_with_genres(catalog, genres))
+    return [format_movie(catalog, row) for row in rows]
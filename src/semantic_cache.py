@@ -0,0 +1,100 @@
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticResultCache:
+    """Search results of recent queries, looked up by cosine similarity of the query embeddings
+
+    The embeddings are kept unit-normalized in one preallocated float32
+    matrix of ``maxsize`` rows, so a lookup is a single matrix-vector
+    product. A stored result is reused when a new query is at least
+    ``threshold`` similar and was searched with the same ``context`` (filters
+    and search options). When full, the least recently used row is
+    overwritten. Everything is dropped when the catalog version changes.
+    """
+
+    def __init__(self, maxsize=256, threshold=0.95):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._contexts = [None] * maxsize
+        self._results = [None] * maxsize
+        self._last_used = np.zeros(maxsize, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+        self._catalog_version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self, catalog_version):
+        if catalog_version != self._catalog_version:
+            if self._size:
+                self.invalidations += 1
+                logger.info("Catalog changed, clearing the semantic result cache")
+            self._size = 0
+            self._contexts = [None] * self.maxsize
+            self._results = [None] * self.maxsize
+            self._catalog_version = catalog_version
+
+    def get(self, embedding, context, catalog_version):
+        """The stored result of a similar enough query searched the same way, or None"""
+        if self.maxsize <= 0 or embedding is None:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version(catalog_version)
+            if self._size and self._vectors.shape[1] == len(query):
+                similarities = self._vectors[:self._size] @ query
+                candidates = np.flatnonzero(similarities >= self.threshold)
+                for row in candidates[np.argsort(-similarities[candidates])]:
+                    if self._contexts[row] == context:
+                        self._clock += 1
+                        self._last_used[row] = self._clock
+                        self.hits += 1
+                        return self._results[row]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, context, catalog_version, result):
+        if self.maxsize <= 0 or embedding is None:
+            return
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version(catalog_version)
+            if self._vectors is None or self._vectors.shape[1] != len(query):
+                # First entry, or a different embedding model: start a fresh matrix
+                self._vectors = np.zeros((self.maxsize, len(query)), dtype=np.float32)
+                self._size = 0
+            if self._size < self.maxsize:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._last_used))
+            self._vectors[row] = query
+            self._contexts[row] = context
+            self._results[row] = result
+            self._clock += 1
+            self._last_used[row] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': self._size,
+                'maxsize': self.maxsize,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
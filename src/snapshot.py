@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import logging
+import uuid
+from datetime import datetime
+import numpy as np
+from src.embedding_store import EmbeddingStore
+from src.catalog import MovieCatalog
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def save_snapshot(catalog, snapshot_dir, embedding_model=None, sync_state=None):
+    """Save the ``MovieCatalog`` and its embeddings together as one versioned bundle
+
+    The bundle is written to a fresh directory and then published by atomically
+    replacing the ``CURRENT`` pointer, so a reader always sees a complete bundle.
+    ``sync_state`` (the watermark and retry keys the catalog is current to) is
+    kept in the manifest, so syncing can resume from the snapshot itself.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    bundle_name = f"bundle-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    bundle_dir = os.path.join(snapshot_dir, bundle_name)
+    os.makedirs(bundle_dir)
+
+    try:
+        EmbeddingStore(os.path.join(bundle_dir, 'embeddings')).save(
+            catalog.keys, catalog.embeddings,
+            fingerprints=catalog.strings['fingerprint'], model=embedding_model
+        )
+
+        records = []
+        for record in catalog.records():
+            record.pop('fingerprint')
+            records.append(record)
+        with open(os.path.join(bundle_dir, 'catalog.json'), 'w') as f:
+            json.dump(records, f, default=_json_default)
+
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'created_at': datetime.now().isoformat(),
+            'embedding_model': embedding_model,
+            'movies': len(catalog),
+            'sync_state': sync_state,
+        }
+        with open(os.path.join(bundle_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+        pointer_tmp = os.path.join(snapshot_dir, f"CURRENT.{uuid.uuid4().hex[:8]}.tmp")
+        with open(pointer_tmp, 'w') as f:
+            f.write(bundle_name)
+        os.replace(pointer_tmp, os.path.join(snapshot_dir, 'CURRENT'))
+    except Exception:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        raise
+
+    # Drop older bundles; processes still mapping them keep their open files
+    for name in os.listdir(snapshot_dir):
+        if name.startswith('bundle-') and name != bundle_name:
+            shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+    logger.info(f"Saved snapshot of {len(catalog)} movies to {bundle_dir}")
+    return bundle_dir
+
+def load_snapshot(snapshot_dir, embedding_model=None):
+    """Load the current snapshot bundle as a ``MovieCatalog`` with memory-mapped embeddings
+
+    Returns ``(catalog, manifest)``, or None when there is no usable snapshot
+    (missing, from another format version, or built with a different model).
+    """
+    pointer = os.path.join(snapshot_dir, 'CURRENT')
+    if not os.path.exists(pointer):
+        logger.info(f"No snapshot found in {snapshot_dir}")
+        return None
+
+    try:
+        with open(pointer, 'r') as f:
+            bundle_dir = os.path.join(snapshot_dir, f.read().strip())
+        with open(os.path.join(bundle_dir, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring snapshot with unsupported version {manifest.get('version')}")
+            return None
+        if embedding_model and manifest.get('embedding_model') not in (None, embedding_model):
+            logger.warning(f"Ignoring snapshot built with embedding model {manifest['embedding_model']}")
+            return None
+
+        with open(os.path.join(bundle_dir, 'catalog.json'), 'r') as f:
+            records = json.load(f)
+
+        cache_data = EmbeddingStore(os.path.join(bundle_dir, 'embeddings')).load()
+        if cache_data is None or len(cache_data['movie_keys']) != len(records):
+            logger.warning(f"Snapshot at {bundle_dir} is incomplete, ignoring it")
+            return None
+
+        key_to_row = cache_data['key_to_row']
+        rows = [key_to_row.get(record['key']) for record in records]
+        if any(row is None for row in rows):
+            logger.warning(f"Snapshot at {bundle_dir} has movies without embeddings, ignoring it")
+            return None
+        fingerprints = cache_data.get('fingerprints')
+        for record, row in zip(records, rows):
+            record['fingerprint'] = fingerprints[row] if fingerprints is not None else None
+
+        # Bundles are written in catalog order, so the mapped matrix is used as is
+        matrix = cache_data['embeddings']
+        if rows != list(range(len(rows))):
+            matrix = matrix[rows]
+        catalog = MovieCatalog.from_records(records, matrix)
+
+        logger.info(f"Loaded snapshot of {len(catalog)} movies from {bundle_dir}")
+        return catalog, manifest
+    except Exception as e:
+        logger.error(f"Error loading snapshot: {str(e)}")
+        return None
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import logging
+import threading
+import pandas as pd
+from src.plex_connector import iter_plex_movies_since, iter_plex_movies_by_key, count_plex_movies, fetch_plex_movie_keys
+from src.embedding import embed_movie_updates
+
+logger = logging.getLogger(__name__)
+
+# Record timestamps that move a movie into the next delta sync
+WATERMARK_FIELDS = ('updated_at', 'added_at', 'last_viewed_at')
+
+def compute_watermark(catalog):
+    """Latest addedAt/updatedAt/lastViewedAt timestamp present in the catalog, or None"""
+    stamps = [
+        int(catalog.numeric[field].max())
+        for field in WATERMARK_FIELDS if len(catalog)
+    ]
+    stamps = [stamp for stamp in stamps if stamp > 0]
+    return max(stamps) if stamps else None
+
+def _latest_stamp(records):
+    stamps = [
+        record.get(field) for record in records for field in WATERMARK_FIELDS
+        if record.get(field)
+    ]
+    return max(stamps) if stamps else None
+
+def load_sync_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read sync state {state_file}: {e}")
+        return {}
+
+def save_sync_state(state_file, state):
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    tmp_path = state_file + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_file)
+
+def sync_library(plex, catalog, since, api_key, library_name='Movies', page_size=200,
+                 embedding_model="text-embedding-ada-002", cache_file="cached_embeddings",
+                 embedding_options=None, retry_keys=()):
+    """Apply Plex changes made since the ``since`` watermark to a ``MovieCatalog``
+
+    Only movies whose addedAt/updatedAt/lastViewedAt is after the watermark are
+    fetched and (re-)embedded, along with the ``retry_keys`` of movies that
+    could not be embedded earlier. Deletions are detected by comparing the
+    library's item count with the expected count, and only when they differ is
+    the key list scanned. Movies that were only watched have their view fields
+    patched into a catalog with the same ``version`` and are neither
+    re-embedded nor re-indexed. Returns ``(catalog, stats, watermark,
+    retry_keys)``, where the catalog is a new one when anything changed (with
+    a new version when more than view fields did) and ``retry_keys`` lists
+    the movies still missing from it. Bringing the vector index in line with a
+    new version is left to the caller, so an unchanged library costs no index
+    work at all.
+    """
+    started = time.time()
+    updates = list(iter_plex_movies_since(plex, since, library_name, page_size))
+
+    known_keys = set(catalog.keys)
+    update_keys = {record['key'] for record in updates}
+
+    # Watching a movie only moves its view fields; patch those without re-indexing
+    viewed = [
+        record for record in updates
+        if record['key'] in known_keys and catalog.only_views_changed(catalog.row(record['key']), record)
+    ]
+    if viewed:
+        catalog = catalog.with_view_changes(viewed)
+        viewed_keys = {record['key'] for record in viewed}
+        content_updates = [record for record in updates if record['key'] not in viewed_keys]
+    else:
+        content_updates = list(updates)
+
+    retry_keys = set(retry_keys) - known_keys - update_keys
+    retries = list(iter_plex_movies_by_key(plex, sorted(retry_keys), page_size))
+    # Keys Plex no longer returns were deleted and need no retry
+    retry_keys = {record['key'] for record in retries}
+    updates += retries
+    content_updates += retries
+
+    expected = len(known_keys | update_keys | retry_keys)
+    total = count_plex_movies(plex, library_name)
+    deleted_keys = set()
+    if total != expected:
+        deleted_keys = known_keys - fetch_plex_movie_keys(plex, library_name)
+        logger.info(f"Library count {total} differs from expected {expected}, found {len(deleted_keys)} deletions")
+
+    stats = {
+        'fetched': len(updates),
+        'added': len(update_keys - known_keys),
+        'updated': len(update_keys & known_keys) - len(viewed),
+        'viewed': len(viewed),
+        'retried': len(retries),
+        'deleted': len(deleted_keys),
+        'reused': 0,
+        'embedded': 0,
+        'failed': 0,
+    }
+
+    watermark = since
+    failed_keys = set()
+    if updates:
+        watermark = max(since, _latest_stamp(updates) or since)
+    if content_updates:
+        updates_df = pd.DataFrame(content_updates)
+        embedded_df, embed_stats = embed_movie_updates(
+            updates_df, catalog, api_key, model=embedding_model, cache_file=cache_file,
+            **(embedding_options or {})
+        )
+        failed_keys = set(embed_stats.pop('failed_keys', []))
+        stats.update(embed_stats)
+
+        failed_stamps = [
+            _latest_stamp([record]) for record in content_updates
+            if record['key'] in failed_keys and record['key'] not in retry_keys and _latest_stamp([record])
+        ]
+        if failed_stamps:
+            # Hold the watermark just below the failed movies (the fetch is strictly
+            # after it) so the next sync retries them
+            watermark = min(watermark, min(failed_stamps) - 1)
+    else:
+        embedded_df = pd.DataFrame({'key': []})
+    # New movies that failed to embed are not in the catalog yet; keep asking for them
+    retry_keys = sorted(failed_keys - known_keys)
+
+    if not content_updates and not deleted_keys:
+        stats['seconds'] = round(time.time() - started, 3)
+        if viewed:
+            logger.info(f"Library sync: {stats}")
+        return catalog, stats, watermark, retry_keys
+
+    new_catalog = catalog.with_changes(embedded_df, deleted_keys)
+
+    stats['seconds'] = round(time.time() - started, 3)
+    logger.info(f"Library sync: {stats}")
+    return new_catalog, stats, watermark, retry_keys
+
+class SyncScheduler:
+    """Runs a sync callable every ``interval`` seconds on a daemon thread"""
+
+    def __init__(self, interval, sync_fn):
+        self.interval = interval
+        self.sync_fn = sync_fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="library-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"Library sync scheduled every {self.interval} seconds")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync_fn()
+            except Exception as e:
+                logger.error(f"Scheduled library sync failed: {str(e)}")
@@ -1,70 +1,475 @@
 import os
-import chromadb
-from chromadb.config import Settings
+import uuid
+import hashlib
+import numpy as np
 import logging
+from src.cache import LRUCache
+from src.filters import evaluate_filters
+from src.embedding_store import unit_rows
 
 logger = logging.getLogger(__name__)
 
-def setup_vector_db(movies_df, persist_directory="./chroma_db"):
-    """Set up a ChromaDB vector database with movie embeddings"""
+# Bump when the metadata layout changes so existing indexes are rewritten
+METADATA_VERSION = 2
+
+# Metadata key prefix of the per-genre boolean flags used for filtering
+GENRE_FLAG_PREFIX = 'genre:'
+
+class VectorIndex:
+    """Interface shared by the vector index backends
+
+    Results use ChromaDB's query layout: ``{'ids': [[...]], 'distances': [[...]],
+    'metadatas': [[...]]}`` with one inner list per query embedding. ``filters``
+    is a filter dict as described in ``src.filters`` and restricts the search
+    before ranking, so filtered queries still return up to ``n`` results.
+    """
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        """Insert new ids and overwrite existing ones"""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def get_fingerprints(self):
+        """Map every stored id to the content fingerprint it was indexed with"""
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n=5, filters=None):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def clone(self):
+        """Index to stage updates on before they are published
+
+        Backends that cannot be copied cheaply return themselves and are
+        updated in place.
+        """
+        return self
+
+    def activate(self):
+        """Called once this index is the one being served"""
+
+def _chroma_client(persist_directory):
+    import chromadb
+    from chromadb.config import Settings
+
     # Ensure the directory exists
     os.makedirs(persist_directory, exist_ok=True)
-    
+
     # Initialize ChromaDB with minimal settings to avoid errors
     logger.info(f"Initializing ChromaDB with persist_directory={persist_directory}")
     try:
-        chroma_client = chromadb.Client(Settings(
+        if hasattr(chromadb, 'PersistentClient'):
+            # Persisted collections survive restarts, so warm starts skip the re-insert
+            return chromadb.PersistentClient(
+                path=persist_directory,
+                settings=Settings(anonymized_telemetry=False)
+            )
+        return chromadb.Client(Settings(
             persist_directory=persist_directory,
             anonymized_telemetry=False
         ))
     except TypeError as e:
         logger.warning(f"Error with ChromaDB settings: {e}. Trying with minimal settings.")
         # Try with minimal settings if the above fails
-        chroma_client = chromadb.Client(Settings(
+        return chromadb.Client(Settings(
             persist_directory=persist_directory
         ))
-    
-    # Create or get collection
-    logger.info("Creating or getting collection 'plex_movies'")
-    collection = chroma_client.get_or_create_collection(name="plex_movies")
-    
-    # Prepare data for ChromaDB
-    ids = [str(i) for i in range(len(movies_df))]
-    embeddings = movies_df['embedding'].tolist()
-    
-    # Prepare metadata
-    metadatas = []
-    for _, row in movies_df.iterrows():
-        metadata = {
-            'title': row['title'],
-            'year': str(row['year']) if row['year'] else "",
-            'genres': ','.join(row['genres']),
-            'key': row['key']
+
+class ChromaVectorIndex(VectorIndex):
+    """Vector index stored in a ChromaDB collection
+
+    ``clone`` copies the served collection into a new staging collection, so
+    initialization and syncs never touch the one being queried. The name of
+    the served collection is kept in an ``active_collection`` file, so a
+    restart opens the last published one; older generations are dropped on
+    the next clone.
+    """
+
+    def __init__(self, persist_directory="./chroma_db", collection_name="plex_movies", client=None,
+                 active_name=None):
+        self.persist_directory = persist_directory
+        self.base_name = collection_name
+        self.client = client if client is not None else _chroma_client(persist_directory)
+        if active_name is None:
+            active_name = self._read_active_name() or collection_name
+
+        # Create or get collection
+        logger.info(f"Creating or getting collection '{active_name}'")
+        self.collection = self.client.get_or_create_collection(name=active_name)
+
+    def _active_file(self):
+        return os.path.join(self.persist_directory, f"{self.base_name}.active_collection")
+
+    def _read_active_name(self):
+        try:
+            with open(self._active_file(), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.collection.upsert(
+            ids=ids,
+            embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in embeddings],
+            metadatas=metadatas,
+            documents=documents
+        )
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def get_fingerprints(self):
+        stored = self.collection.get(include=['metadatas'])
+        return {
+            id_: (metadata or {}).get('fingerprint')
+            for id_, metadata in zip(stored['ids'], stored['metadatas'])
         }
-        metadatas.append(metadata)
-    
-    # Prepare documents
-    documents = movies_df['text_representation'].tolist()
-    
-    # Add documents to the collection
-    logger.info(f"Adding {len(ids)} documents to collection")
-    collection.add(
-        ids=ids,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        documents=documents
-    )
-    
-    return collection
-
-def query_vector_db(collection, query_embedding, n=5):
-    """Query the vector database for similar movies"""
+
+    def query(self, query_embeddings, n=5, filters=None):
+        where = _chroma_where(filters)
+        kwargs = {'where': where} if where else {}
+        return self.collection.query(
+            query_embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in query_embeddings],
+            n_results=n,
+            **kwargs
+        )
+
+    def count(self):
+        return self.collection.count()
+
+    def clone(self, page_size=5000):
+        # Collections of earlier generations are no longer served by anyone
+        for collection in self.client.list_collections():
+            name = getattr(collection, 'name', collection)
+            if (name == self.base_name or name.startswith(f"{self.base_name}_")) and name != self.collection.name:
+                self.client.delete_collection(name=name)
+
+        staging_name = f"{self.base_name}_{uuid.uuid4().hex[:8]}"
+        index = ChromaVectorIndex(self.persist_directory, self.base_name, client=self.client,
+                                  active_name=staging_name)
+        total = self.count()
+        for offset in range(0, total, page_size):
+            page = self.collection.get(
+                limit=page_size, offset=offset, include=['embeddings', 'metadatas', 'documents']
+            )
+            if page['ids']:
+                index.collection.upsert(
+                    ids=page['ids'], embeddings=page['embeddings'],
+                    metadatas=page['metadatas'], documents=page['documents']
+                )
+        logger.info(f"Copied {total} vectors into staging collection '{staging_name}'")
+        return index
+
+    def activate(self):
+        path = self._active_file()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.collection.name)
+        os.replace(tmp_path, path)
+
+class NumpyVectorIndex(VectorIndex):
+    """Exact in-process cosine search over a normalized float32 matrix
+
+    A query is a single matrix product against the unit-normalized rows, with
+    ``argpartition`` selecting the top k before the small final sort. Updates
+    build new arrays and swap them in as one state tuple, so concurrent queries
+    always see a consistent index while a sync is running. ``share`` serves a
+    catalog's (already normalized, possibly memory-mapped) matrix without a copy.
+    """
+
+    def __init__(self):
+        self._state = ([], np.zeros((0, 0), dtype=np.float32), [], {})
+        self._filter_columns = None
+
+    @property
+    def ids(self):
+        return self._state[0]
+
+    @property
+    def matrix(self):
+        return self._state[1]
+
+    @property
+    def metadatas(self):
+        return self._state[2]
+
+    @property
+    def id_to_row(self):
+        return self._state[3]
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        if len(ids) == 0:
+            return
+        vectors = unit_rows(np.asarray(np.vstack(embeddings), dtype=np.float32))
+        old_ids, old_matrix, old_metadatas, old_id_to_row = self._state
+        if len(old_ids) == 0:
+            old_matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+        matrix = old_matrix.copy()
+        id_list = list(old_ids)
+        metadata_list = list(old_metadatas)
+        id_to_row = dict(old_id_to_row)
+
+        existing = [(i, id_to_row[id_]) for i, id_ in enumerate(ids) if id_ in id_to_row]
+        if existing:
+            positions, rows = zip(*existing)
+            matrix[list(rows)] = vectors[list(positions)]
+            for position, row in existing:
+                metadata_list[row] = metadatas[position]
+
+        new_positions = [i for i, id_ in enumerate(ids) if id_ not in id_to_row]
+        if new_positions:
+            matrix = np.vstack([matrix, vectors[new_positions]])
+            for position in new_positions:
+                id_to_row[ids[position]] = len(id_list)
+                id_list.append(ids[position])
+                metadata_list.append(metadatas[position])
+
+        self._state = (id_list, matrix, metadata_list, id_to_row)
+
+    def share(self, ids, matrix, metadatas):
+        """Serve ``matrix`` as is, one unit-normalized row per id; it must never be written to"""
+        ids = list(ids)
+        self._state = (ids, matrix, list(metadatas), {id_: row for row, id_ in enumerate(ids)})
+
+    def delete(self, ids):
+        old_ids, old_matrix, old_metadatas, old_id_to_row = self._state
+        doomed = {old_id_to_row[id_] for id_ in ids if id_ in old_id_to_row}
+        if not doomed:
+            return
+        keep = np.ones(len(old_ids), dtype=bool)
+        keep[list(doomed)] = False
+        id_list = [id_ for id_, kept in zip(old_ids, keep) if kept]
+        self._state = (
+            id_list,
+            old_matrix[keep],
+            [m for m, kept in zip(old_metadatas, keep) if kept],
+            {id_: row for row, id_ in enumerate(id_list)}
+        )
+
+    def get_fingerprints(self):
+        ids, _, metadatas, _ = self._state
+        return {id_: metadata.get('fingerprint') for id_, metadata in zip(ids, metadatas)}
+
+    def query(self, query_embeddings, n=5, filters=None):
+        state = self._state
+        ids, matrix, metadatas, _ = state
+        results = {'ids': [], 'distances': [], 'metadatas': []}
+        if len(ids) == 0:
+            return {key: [[] for _ in query_embeddings] for key in results}
+
+        # Pre-filter: only rows passing the mask are scored at all
+        rows = None
+        if filters:
+            rows = np.flatnonzero(self._filter_mask(state, filters))
+            if len(rows) == 0:
+                return {key: [[] for _ in query_embeddings] for key in results}
+            matrix = matrix[rows]
+
+        queries = _normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        scores = queries @ matrix.T
+        k = min(n, len(matrix))
+        for row_scores in scores:
+            top = top_k_indices(row_scores, k)
+            index_rows = rows[top] if rows is not None else top
+            results['ids'].append([ids[i] for i in index_rows])
+            results['distances'].append([float(1.0 - row_scores[i]) for i in top])
+            results['metadatas'].append([metadatas[i] for i in index_rows])
+        return results
+
+    def _filter_mask(self, state, filters):
+        """Boolean mask of the rows passing ``filters``
+
+        Per-genre bitmasks and the numeric columns are built once per index
+        state, and recent masks are cached, so a filter costs a few vectorized
+        comparisons at most.
+        """
+        cached = self._filter_columns
+        if cached is None or cached[0] is not state:
+            cached = (state, _build_filter_columns(state[2]), LRUCache(maxsize=128))
+            self._filter_columns = cached
+        _, columns, masks = cached
+
+        cache_key = _filter_cache_key(filters)
+        mask = masks.get(cache_key)
+        if mask is None:
+            mask = evaluate_filters(columns, filters)
+            masks.put(cache_key, mask)
+        return mask
+
+    def count(self):
+        return len(self._state[0])
+
+    def clone(self):
+        # Updates never modify arrays in place, so the copy can share them
+        index = NumpyVectorIndex()
+        index._state = self._state
+        index._filter_columns = self._filter_columns
+        return index
+
+def _build_filter_columns(metadatas):
+    size = len(metadatas)
+    columns = {
+        'year': np.zeros(size, dtype=np.int32),
+        'duration': np.zeros(size, dtype=np.int32),
+        'rating': np.zeros(size, dtype=np.float32),
+        'genres': {},
+    }
+    for row, metadata in enumerate(metadatas):
+        columns['year'][row] = int(metadata.get('year') or 0)
+        columns['duration'][row] = int(metadata.get('duration') or 0)
+        columns['rating'][row] = float(metadata.get('rating') or 0.0)
+        for genre in (metadata.get('genres') or '').split(','):
+            if genre:
+                mask = columns['genres'].get(genre.lower())
+                if mask is None:
+                    mask = columns['genres'][genre.lower()] = np.zeros(size, dtype=bool)
+                mask[row] = True
+    return columns
+
+def _filter_cache_key(filters):
+    return tuple(sorted(
+        (key, tuple(sorted(g.lower() for g in value)) if key == 'genres' else value)
+        for key, value in filters.items() if value is not None
+    ))
+
+def _chroma_where(filters):
+    """Translate a filter dict into a ChromaDB ``where`` clause"""
+    if not filters:
+        return None
+    conditions = []
+    for field, low, high in (('year', 'year_min', 'year_max'), ('duration', 'duration_min', 'duration_max')):
+        if filters.get(low) is not None:
+            conditions.append({field: {'$gte': filters[low]}})
+        if filters.get(high) is not None:
+            conditions.append({field: {'$lte': filters[high]}})
+            conditions.append({field: {'$gt': 0}})
+    if filters.get('rating_min') is not None:
+        conditions.append({'rating': {'$gte': filters['rating_min']}})
+    for genre in filters.get('genres') or ():
+        conditions.append({GENRE_FLAG_PREFIX + genre.lower(): True})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores, k):
+    """Indices of the ``k`` highest scores, best first"""
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+VECTOR_BACKENDS = {
+    'chroma': ChromaVectorIndex,
+    'numpy': NumpyVectorIndex,
+}
+
+def create_vector_index(backend="numpy", persist_directory="./chroma_db"):
+    """Instantiate the configured vector index backend"""
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend '{backend}', expected one of {sorted(VECTOR_BACKENDS)}")
+    logger.info(f"Using '{backend}' vector index backend")
+    if backend == 'chroma':
+        return ChromaVectorIndex(persist_directory)
+    return NumpyVectorIndex()
+
+def build_metadata(catalog, row):
+    """Index metadata for one movie: numeric fields for range filters plus per-genre flags"""
+    year = catalog.value('year', row)
+    duration = catalog.value('duration', row)
+    rating = catalog.value('audience_rating', row)
+    if rating is None:
+        rating = catalog.value('rating', row)
+    genres = catalog.tags['genres'][row]
+    metadata = {
+        'title': catalog.strings['title'][row],
+        'year': int(year or 0),
+        'duration': int(round(duration / 60000)) if duration else 0,
+        'rating': float(rating or 0.0),
+        'genres': ','.join(genres),
+        'key': catalog.keys[row]
+    }
+    for genre in genres:
+        metadata[GENRE_FLAG_PREFIX + genre.lower()] = True
+    return metadata
+
+def _index_fingerprint(fingerprint, metadata):
+    """Fingerprint of everything the index stores for a movie: its text and its metadata"""
+    digest = hashlib.sha1(f"{METADATA_VERSION}\0{fingerprint}\0{sorted(metadata.items())}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def setup_vector_db(catalog, persist_directory="./chroma_db", backend="numpy", index=None, progress=None):
+    """Bring a vector index in line with a ``MovieCatalog``, keyed by Plex key
+
+    Only movies that are new or whose text or filterable metadata changed are
+    upserted, and movies no longer in the library are deleted. Pass the
+    previous ``index`` to update it in place instead of starting from an empty one.
+    ``progress(done, total)`` reports the number of movies indexed.
+    """
+    if index is None:
+        index = create_vector_index(backend, persist_directory)
+
+    keys = catalog.keys
+    fingerprints = catalog.strings['fingerprint']
+    metadatas = [build_metadata(catalog, row) for row in range(len(catalog))]
+    for metadata, fingerprint in zip(metadatas, fingerprints):
+        if fingerprint is not None:
+            metadata['fingerprint'] = _index_fingerprint(fingerprint, metadata)
+
+    stored = index.get_fingerprints()
+    stale_ids = [id_ for id_ in stored if id_ not in catalog]
+    changed_rows = [
+        row for row, (key, metadata) in enumerate(zip(keys, metadatas))
+        if 'fingerprint' not in metadata or stored.get(key) != metadata['fingerprint']
+    ]
+
+    logger.info(f"Vector index sync: {len(changed_rows)} to upsert, {len(stale_ids)} to delete, "
+                f"{len(keys) - len(changed_rows)} unchanged")
+
+    if progress:
+        progress(len(keys) - len(changed_rows), len(keys))
+
+    if isinstance(index, NumpyVectorIndex):
+        # The catalog matrix is already normalized, so the index reads it in place
+        if changed_rows or stale_ids or index.matrix is not catalog.embeddings:
+            index.share(keys, catalog.embeddings, metadatas)
+        if progress:
+            progress(len(keys), len(keys))
+        return index
+
+    if stale_ids:
+        index.delete(stale_ids)
+
+    if changed_rows:
+        texts = catalog.strings['text_representation']
+        index.upsert(
+            ids=[keys[row] for row in changed_rows],
+            embeddings=catalog.embeddings[changed_rows],
+            metadatas=[metadatas[row] for row in changed_rows],
+            documents=[texts[row] for row in changed_rows]
+        )
+
+    if progress:
+        progress(len(keys), len(keys))
+
+    return index
+
+def query_vector_db(index, query_embedding, n=5, filters=None):
+    """Query the vector index for similar movies, restricted by an optional filter dict"""
     if query_embedding is None:
         return []
-    
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n
-    )
-    
-    return results
+
+    return index.query([query_embedding], n, filters=filters)
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import numpy as np
+
+# Keep the app's files out of the working tree; config reads these on import
+os.environ.setdefault('VECTOR_DB_PATH', tempfile.mkdtemp(prefix='plex-rec-test-'))
+os.environ.setdefault('SYNC_INTERVAL_MINUTES', '0')
+
+import app
+from src.catalog import MovieCatalog
+from src.snapshot import save_snapshot
+
+def _catalog(size=3):
+    records = [
+        {'key': f"/library/metadata/{i}", 'title': f"Movie {i}", 'year': 1990 + i, 'genres': ['Drama'],
+         'text_representation': f"Title: Movie {i}", 'fingerprint': f"f{i}"}
+        for i in range(size)
+    ]
+    return MovieCatalog.from_records(records, np.eye(size, 4, dtype=np.float32))
+
+def test_first_request_serves_the_snapshot(tmp_path, monkeypatch):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    save_snapshot(_catalog(), snapshot_dir, embedding_model=app.config.EMBEDDING_MODEL)
+    monkeypatch.setattr(app.config, 'SNAPSHOT_DIR', snapshot_dir)
+    monkeypatch.setattr(app.config, 'SYNC_STATE_FILE', str(tmp_path / 'sync_state.json'))
+    monkeypatch.setattr(app.config, 'NEIGHBOR_GRAPH_FILE', str(tmp_path / 'neighbors.npz'))
+    # Reconciling with Plex runs in the background and is not under test
+    monkeypatch.setattr(app, 'start_initialization', lambda: None)
+    monkeypatch.setattr(app, 'warm_started', False)
+    app.publish_catalog(None, None)
+
+    response = app.app.test_client().get('/api/status')
+
+    serving_catalog, serving_index = app.current_catalog()
+    assert serving_catalog is not None and len(serving_catalog) == 3
+    assert serving_index.count() == 3
+    assert response.get_json()['movies'] == 3
+
+def test_warm_start_runs_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'warm_start', lambda: calls.append(1))
+    monkeypatch.setattr(app, 'warm_started', False)
+    app.publish_catalog(None, None)
+
+    client = app.app.test_client()
+    client.get('/api/status')
+    client.get('/api/status')
+
+    assert calls == [1]
+
+def test_batch_requests_leave_intent_stats_alone(monkeypatch):
+    catalog = _catalog()
+    monkeypatch.setattr(app, 'current_catalog', lambda: (catalog, object()))
+    monkeypatch.setattr(app, 'llm_service', object())
+    monkeypatch.setattr(app, 'get_batch_recommendations', lambda queries, *args, **kwargs: ([[] for _ in queries], {}))
+    before = app.get_intent_stats()
+
+    response = app.app.test_client().post('/api/recommend/batch', json={'queries': ['drama'], 'interpret': False})
+
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['query'] != 'drama'
+    assert app.get_intent_stats() == before
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import src.embedding as embedding
+from src.embedding import generate_embeddings, save_embeddings, fingerprint_text, load_embeddings
+
+class FailingClient:
+    """OpenAI client stand-in whose embedding requests always fail"""
+
+    def __init__(self):
+        self.embeddings = self
+        self.with_raw_response = self
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, input, model):
+        raise RuntimeError("embedding API unavailable")
+
+def _movies(texts):
+    return pd.DataFrame({
+        'key': [f"/library/metadata/{i}" for i in range(len(texts))],
+        'text_representation': texts,
+    })
+
+def test_model_change_with_embed_error_drops_old_vectors(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "cached_embeddings")
+    movies = _movies(["Title: Heat", "Title: Alien"])
+    cached = movies.copy()
+    cached['embedding'] = list(np.ones((2, 3), dtype=np.float32))
+    cached['fingerprint'] = [fingerprint_text(text, 'old-model') for text in movies['text_representation']]
+    save_embeddings(cached, cache_file, model='old-model')
+
+    monkeypatch.setattr(embedding, 'get_openai_client', lambda api_key: FailingClient())
+    embedded, stats = generate_embeddings(
+        movies, 'key', model='new-model', cache_file=cache_file, return_stats=True, max_retries=0
+    )
+
+    assert len(embedded) == 0
+    assert stats['failed'] == 2
+    cache_data = load_embeddings(cache_file)
+    assert cache_data is None or len(cache_data['movie_keys']) == 0
+
+def test_same_model_embed_error_keeps_previous_vectors(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "cached_embeddings")
+    cached = _movies(["Title: Heat", "Title: Alien"])
+    cached['embedding'] = list(np.ones((2, 3), dtype=np.float32))
+    cached['fingerprint'] = [fingerprint_text(text, 'model') for text in cached['text_representation']]
+    save_embeddings(cached, cache_file, model='model')
+
+    monkeypatch.setattr(embedding, 'get_openai_client', lambda api_key: FailingClient())
+    changed = _movies(["Title: Heat (1995)", "Title: Alien (1979)"])
+    embedded, stats = generate_embeddings(
+        changed, 'key', model='model', cache_file=cache_file, return_stats=True, max_retries=0
+    )
+
+    assert len(embedded) == 2
+    assert stats['failed'] == 0
+    assert embedded['fingerprint'].tolist() == cached['fingerprint'].tolist()
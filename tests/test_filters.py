@@ -0,0 +1,18 @@
+from src.filters import extract_filters
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Family', 'History', 'Music', 'Short']
+
+def _genres(text):
+    return (extract_filters(text, GENRES) or {}).get('genres')
+
+def test_everyday_words_are_not_genre_filters():
+    assert _genres("a short comedy") == ['Comedy']
+    assert _genres("something with great music") is None
+    assert _genres("an action-packed family-friendly pick") is None
+    assert _genres("a drama about family and history") == ['Drama']
+
+def test_ambiguous_genres_filter_when_used_as_genres():
+    assert _genres("a family movie from the 90s") == ['Family']
+    assert _genres("short films about music") == ['Short']
+    assert _genres("something in the history genre") == ['History']
+    assert _genres("anything but music films") is None
@@ -0,0 +1,64 @@
+import numpy as np
+import src.embedding as embedding
+from src.catalog import MovieCatalog
+from src.query_cache import QueryEmbeddingCache
+from src.recommendation import get_batch_recommendations
+from src.semantic_cache import SemanticResultCache
+from src.vector_db import setup_vector_db
+
+# Paraphrases embed almost alike, and so do the two Toms
+QUERY_VECTORS = {
+    "funny space movies": [1.0, 0.0, 0.0],
+    "comedic movies set in space": [0.99, 0.05, 0.0],
+    "tom hanks movies": [0.0, 1.0, 0.0],
+    "tom cruise movies": [0.0, 0.99, 0.05],
+}
+
+class FakeItem:
+    def __init__(self, index, embedding):
+        self.index = index
+        self.embedding = embedding
+
+class FakeClient:
+    """OpenAI client stand-in that embeds the known test queries"""
+
+    def __init__(self):
+        self.embeddings = self
+
+    def create(self, input, model):
+        return type('Response', (), {'data': [FakeItem(i, QUERY_VECTORS[text.lower()]) for i, text in enumerate(input)]})
+
+def _catalog():
+    records = [
+        {'key': "/library/metadata/1", 'title': "Airplane!", 'genres': ['Comedy'], 'actors': ['Tom Hanks'],
+         'text_representation': "Title: Airplane! Genres: Comedy Actors: Tom Hanks", 'fingerprint': "f1"},
+        {'key': "/library/metadata/2", 'title': "Top Gun", 'genres': ['Action'], 'actors': ['Tom Cruise'],
+         'text_representation': "Title: Top Gun Genres: Action Actors: Tom Cruise", 'fingerprint': "f2"},
+    ]
+    return MovieCatalog.from_records(records, np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float32))
+
+def _search(query, catalog, index, result_cache):
+    _, timings = get_batch_recommendations(
+        [query], catalog, index, 'key', n=1, hybrid=True, result_cache=result_cache
+    )
+    return timings['semantic_cache_hits']
+
+def test_paraphrases_share_results_with_hybrid_search(monkeypatch):
+    monkeypatch.setattr(embedding, 'get_openai_client', lambda api_key: FakeClient())
+    monkeypatch.setattr(embedding, '_query_cache', QueryEmbeddingCache(maxsize=16))
+    catalog = _catalog()
+    index = setup_vector_db(catalog, backend='numpy')
+    result_cache = SemanticResultCache(maxsize=8, threshold=0.95)
+
+    assert _search("funny space movies", catalog, index, result_cache) == 0
+    assert _search("comedic movies set in space", catalog, index, result_cache) == 1
+
+def test_different_names_never_share_results(monkeypatch):
+    monkeypatch.setattr(embedding, 'get_openai_client', lambda api_key: FakeClient())
+    monkeypatch.setattr(embedding, '_query_cache', QueryEmbeddingCache(maxsize=16))
+    catalog = _catalog()
+    index = setup_vector_db(catalog, backend='numpy')
+    result_cache = SemanticResultCache(maxsize=8, threshold=0.95)
+
+    assert _search("tom hanks movies", catalog, index, result_cache) == 0
+    assert _search("tom cruise movies", catalog, index, result_cache) == 0
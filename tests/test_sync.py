@@ -0,0 +1,62 @@
+import numpy as np
+import src.sync as sync
+from src.catalog import MovieCatalog
+
+def _record(i, **changes):
+    record = {
+        'key': f"/library/metadata/{i}", 'title': f"Movie {i}", 'summary': "A summary", 'genres': ['Drama'],
+        'directors': [], 'actors': ['Someone'], 'year': 2000, 'rating': 7.3, 'duration': 6000000,
+        'audience_rating': None, 'view_count': i, 'added_at': 100 + i, 'updated_at': 100 + i,
+        'last_viewed_at': None, 'text_representation': f"Title: Movie {i}", 'fingerprint': f"f{i}",
+    }
+    record.update(changes)
+    return record
+
+def _fake_plex(monkeypatch, library):
+    monkeypatch.setattr(sync, 'iter_plex_movies_since', lambda plex, since, *args: [
+        record for record in library.values()
+        if max(record['updated_at'], record['added_at'], record['last_viewed_at'] or 0) > since
+    ])
+    monkeypatch.setattr(sync, 'iter_plex_movies_by_key', lambda *args: [])
+    monkeypatch.setattr(sync, 'count_plex_movies', lambda *args: len(library))
+
+def test_watched_movies_are_patched_without_reindexing(monkeypatch):
+    library = {i: _record(i) for i in range(5)}
+    catalog = MovieCatalog.from_records(list(library.values()), np.eye(5, 4, dtype=np.float32))
+    lexical_index = catalog.lexical_index()
+    library[1] = _record(1, view_count=50, last_viewed_at=500, updated_at=500)
+    _fake_plex(monkeypatch, library)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("a view-only sync must not embed or index")
+    monkeypatch.setattr(sync, 'embed_movie_updates', fail)
+
+    new_catalog, stats, watermark, _ = sync.sync_library(None, catalog, 200, 'key')
+
+    assert stats['viewed'] == 1 and stats['updated'] == 0
+    assert watermark == 500
+    assert new_catalog.version == catalog.version
+    assert new_catalog.lexical_index() is lexical_index
+    assert new_catalog.value('view_count', 1) == 50 and catalog.value('view_count', 1) == 1
+    assert new_catalog.ranked('popular', 5) == [1, 4, 3, 2, 0]
+
+def test_content_changes_are_reembedded(monkeypatch):
+    library = {i: _record(i) for i in range(3)}
+    catalog = MovieCatalog.from_records(list(library.values()), np.eye(3, 4, dtype=np.float32))
+    library[2] = _record(2, title="Renamed", text_representation="Title: Renamed", updated_at=600)
+    _fake_plex(monkeypatch, library)
+    embedded_keys = []
+
+    def embed(updates_df, previous_catalog, api_key, **options):
+        embedded_keys.extend(updates_df['key'])
+        updates_df = updates_df.copy()
+        updates_df['embedding'] = [np.ones(4, dtype=np.float32)] * len(updates_df)
+        return updates_df, {'reused': 0, 'embedded': len(updates_df), 'failed': 0}
+    monkeypatch.setattr(sync, 'embed_movie_updates', embed)
+
+    new_catalog, stats, _, _ = sync.sync_library(None, catalog, 200, 'key')
+
+    assert embedded_keys == ['/library/metadata/2']
+    assert stats['updated'] == 1 and stats['viewed'] == 0
+    assert new_catalog.version != catalog.version
+    assert new_catalog.value('title', new_catalog.row('/library/metadata/2')) == "Renamed"
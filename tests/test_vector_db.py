@@ -0,0 +1,30 @@
+import numpy as np
+from src.catalog import MovieCatalog
+from src.snapshot import save_snapshot, load_snapshot
+from src.vector_db import setup_vector_db, query_vector_db
+
+def _catalog(embeddings):
+    records = [
+        {'key': f"/library/metadata/{i}", 'title': f"Movie {i}", 'genres': ['Drama'],
+         'text_representation': f"Title: Movie {i}", 'fingerprint': f"f{i}"}
+        for i in range(len(embeddings))
+    ]
+    return MovieCatalog.from_records(records, embeddings)
+
+def test_catalog_rows_are_normalized_once():
+    catalog = _catalog(np.array([[3, 4], [0, 2], [1, 0]], dtype=np.float32))
+
+    assert np.allclose(np.linalg.norm(catalog.embeddings, axis=1), 1.0)
+    assert _catalog(catalog.embeddings).embeddings is catalog.embeddings
+
+def test_numpy_index_reads_the_snapshot_matrix_in_place(tmp_path):
+    save_snapshot(_catalog(np.eye(3, 4, dtype=np.float32) * 2), str(tmp_path))
+    catalog, _ = load_snapshot(str(tmp_path))
+
+    index = setup_vector_db(catalog, backend='numpy')
+
+    assert index.matrix is catalog.embeddings
+    assert isinstance(catalog.embeddings.base, np.memmap)
+    results = query_vector_db(index, np.array([0, 1, 0, 0], dtype=np.float32), n=1)
+    assert results['ids'][0] == ["/library/metadata/1"]
+    assert np.isclose(results['distances'][0][0], 0.0, atol=1e-6)